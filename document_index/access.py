@@ -0,0 +1,112 @@
+"""
+Hierarchical access to groups.
+
+A user may write to the groups they own and to groups shared with them, or
+with one of their teams, through a writable GroupACL, and to everything
+below those. Read only ACLs add to the groups a user may read. Both sets
+are kept as minimal lists of path prefixes per user, so a check is a
+prefix test and a queryset filter is a few path range conditions.
+
+Prefix lists are cached. A cached list is stamped with the versions of the
+branches it covers, the version of all ACLs and of the user's own groups,
+and computed again when any of them changed. Versions are bumped in the
+cache of the process making the change, so prefixes are only cached when
+the cache is shared by all processes, see cache.is_shared(). Otherwise
+they are read from the database on every call.
+"""
+from django.core.cache import cache
+from django.db.models import Q
+from document_index import versions
+from document_index.cache import is_shared, roots_generation
+from document_index.models import Group, GroupACL
+from document_index.tree import subtree_q
+
+ACCESS_KEY = 'document_index:access:{0}'
+
+READ, WRITE = 'read', 'write'
+
+
+def minimize(paths):
+    """
+    Return sorted paths without those below another path in the list.
+    """
+    result = []
+    for path in sorted(paths):
+        if not result or not path.startswith(result[-1]):
+            result.append(path)
+    return result
+
+
+def _compute(user):
+    query = Q(user=user)
+    team_ids = list(user.groups.values_list('id', flat=True))
+    if team_ids:
+        query |= Q(team__in=team_ids)
+    acls = list(GroupACL.objects.filter(query).values_list(
+        'group__path', 'can_write'))
+    owned = Group.objects.filter(owner=user).values_list('path', flat=True)
+
+    write = minimize(list(owned) + [path for path, can_write in acls
+        if can_write])
+    read = minimize(write + [path for path, can_write in acls])
+    return read, write
+
+
+def _stamp(names):
+    generation = roots_generation()
+    values = versions.get_versions(names)
+    if generation is None or values is None:
+        return None
+    return [generation] + values
+
+
+def get_prefixes(user):
+    """
+    Return dict with the READ and WRITE path prefix lists of a user.
+    """
+    if not user.is_authenticated():
+        return {READ: [], WRITE: []}
+    if not is_shared():
+        read, write = _compute(user)
+        return {READ: read, WRITE: write}
+
+    key = ACCESS_KEY.format(user.pk)
+    entry = cache.get(key)
+    if entry is not None and _stamp(entry['names']) == entry['stamp']:
+        return entry['prefixes']
+
+    # Stamp before reading so a concurrent ACL change is not lost.
+    names = [versions.GROUPS, versions.ACLS, versions.owner(user.pk)]
+    stamp = _stamp(names)
+    read, write = _compute(user)
+    branches = sorted(set(versions.branch(path) for path in read))
+    branch_stamp = versions.get_versions(branches)
+    if stamp is None or branch_stamp is None:
+        # The versions are unknown, so nothing could tell it stale.
+        return {READ: read, WRITE: write}
+    entry = {
+        'names': names + branches,
+        'stamp': stamp + branch_stamp,
+        'prefixes': {READ: read, WRITE: write},
+    }
+    cache.set(key, entry)
+    return entry['prefixes']
+
+
+def has_access(user, path, access=WRITE):
+    """
+    Return True if user has access to the group at path.
+    """
+    return any(path.startswith(prefix)
+            for prefix in get_prefixes(user)[access])
+
+
+def filter_access(queryset, user, access=READ, prefix=''):
+    """
+    Restrict queryset to groups, or with prefix e.g. 'group__' to rows of
+    groups, the user has access to.
+    """
+    query = subtree_q(get_prefixes(user)[access], prefix=prefix)
+    if query is None:
+        return queryset.none()
+    return queryset.filter(query)
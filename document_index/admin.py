@@ -1,7 +1,9 @@
 from django.contrib import admin
 from treebeard.admin import TreeAdmin
 from treebeard.forms import movenodeform_factory
-from document_index.models import GroupTreeList, Group, Document, Source
+from document_index.integrity import check_tree
+from document_index.models import (GroupTreeList, Group, Document, Source,
+        GroupACL, Job)
 
 class SourceInline(admin.TabularInline):
     model = Source
@@ -32,6 +34,27 @@ class GroupAdmin(TreeAdmin):
 #       obj.save()
 
 
+def check_and_repair_groups(modeladmin, request, queryset):
+    for tree in queryset:
+        report = check_tree(tree.id, repair=True)
+        modeladmin.message_user(request, '{0}: {1} node(s) checked, {2} '
+                'problem(s), {3} fixed.'.format(tree.name, report.checked,
+                    len(report.problems), report.fixed))
+check_and_repair_groups.short_description = 'Check and repair group paths'
+
+
+class GroupTreeListAdmin(admin.ModelAdmin):
+    actions = [check_and_repair_groups]
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'worker', 'attempts',
+            'progress', 'total', 'created', 'modified')
+    list_filter = ('status', 'name')
+
+
 admin.site.register(Document, DocumentAdmin)
 admin.site.register(Group, GroupAdmin)
-admin.site.register(GroupTreeList)
+admin.site.register(GroupTreeList, GroupTreeListAdmin)
+admin.site.register(GroupACL)
+admin.site.register(Job, JobAdmin)
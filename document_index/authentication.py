@@ -1,5 +1,94 @@
-from rest_framework.authentication import SessionAuthentication
+import hashlib
+import time
+from django.core.cache import cache
+from rest_framework.authentication import (OAuth2Authentication,
+        SessionAuthentication)
+from rest_framework.compat import provider_now
+from document_index.cache import is_shared
 
+TOKEN_KEY = 'document_index:token:{0}'
+
+# Longest time a validated token is trusted without looking at the database.
+# Deleted tokens and changed users are evicted from signals in signals.py,
+# in every process only if the cache is shared, see cache.is_shared().
+TOKEN_TIMEOUT = 300
+
+# Per backend counters of this process: calls, seconds, hits, misses.
+stats = {}
+
+
+def _record(backend, seconds=0, **counters):
+    entry = stats.setdefault(backend, {'calls': 0, 'seconds': 0.0,
+        'hits': 0, 'misses': 0})
+    entry['seconds'] += seconds
+    for name, value in counters.items():
+        entry[name] += value
+
+
+def token_key(access_token):
+    if not isinstance(access_token, bytes):
+        access_token = access_token.encode('utf-8')
+    # Keep the token itself out of the cache.
+    return TOKEN_KEY.format(hashlib.sha256(access_token).hexdigest())
+
+
+def invalidate_token(access_token):
+    cache.delete(token_key(access_token))
+
+
+def timed(cls):
+    """
+    Class decorator recording number of calls and time spent in the
+    authenticate() method of a backend.
+    """
+    authenticate = cls.authenticate
+
+    def timed_authenticate(self, request):
+        start = time.time()
+        try:
+            return authenticate(self, request)
+        finally:
+            _record(cls.__name__, time.time() - start, calls=1)
+
+    timed_authenticate.__doc__ = authenticate.__doc__
+    cls.authenticate = timed_authenticate
+    return cls
+
+
+@timed
+class CachedOAuth2Authentication(OAuth2Authentication):
+    """
+    OAuth2Authentication keeping validated access tokens, with their users,
+    in Django's cache until the token expires or TOKEN_TIMEOUT passes.
+
+    Revoking a token or deactivating its user takes effect at once only
+    with a cache shared by all processes, e.g. memcached. With a per
+    process cache every token is checked against the database.
+    """
+
+    def authenticate_credentials(self, request, access_token):
+        if not is_shared():
+            _record(self.__class__.__name__, misses=1)
+            return super(CachedOAuth2Authentication,
+                    self).authenticate_credentials(request, access_token)
+
+        key = token_key(access_token)
+        token = cache.get(key)
+        if token is not None and token.expires > provider_now():
+            _record(self.__class__.__name__, hits=1)
+            return (token.user, token)
+
+        _record(self.__class__.__name__, misses=1)
+        user, token = super(CachedOAuth2Authentication,
+                self).authenticate_credentials(request, access_token)
+        timeout = min(TOKEN_TIMEOUT,
+                int((token.expires - provider_now()).total_seconds()))
+        if timeout > 0:
+            cache.set(key, token, timeout)
+        return (user, token)
+
+
+@timed
 class SuperUserSessionAuthentication(SessionAuthentication):
     """
     Use Django's session framework for authentication of super users.
@@ -0,0 +1,207 @@
+"""
+Content addressable store for source files.
+
+Files are kept below DOCUMENT_INDEX_BLOB_ROOT under their SHA-256, sharded
+by the first two byte pairs of the hash: ab/cd/abcd... Uploads are written
+to a temporary file in chunks while hashing and renamed into place, so
+identical files are stored once and a file is never seen half written.
+Receiving runs outside any transaction, as it lasts as long as the upload;
+only the rename holds a lock.
+
+Downloads are served from a memory map in chunks, for a single byte range
+if asked. With DOCUMENT_INDEX_BLOB_SENDFILE set to the header of a front end
+server, e.g. 'X-Sendfile' or 'X-Accel-Redirect', the server sends the file
+instead and handles ranges itself. DOCUMENT_INDEX_BLOB_SENDFILE_PREFIX is
+put in front of the shard path in place of the blob root, e.g. for an nginx
+internal location.
+"""
+import errno
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import ProtectedError
+from django.utils import timezone
+from django.utils.six.moves import range
+from document_index.models import Blob
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def blob_root():
+    return getattr(settings, 'DOCUMENT_INDEX_BLOB_ROOT', None) or \
+            os.path.join(settings.MEDIA_ROOT, 'blobs')
+
+
+def relative_path(sha256):
+    return os.path.join(sha256[:2], sha256[2:4], sha256)
+
+
+def blob_path(sha256):
+    return os.path.join(blob_root(), relative_path(sha256))
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def receive(stream, chunk_size=CHUNK_SIZE):
+    """
+    Write the content read from a file-like object to a temporary file.
+    Return (tmp_path, sha256, size) for commit(). Opens no transaction.
+    """
+    tmp_dir = os.path.join(blob_root(), 'tmp')
+    _makedirs(tmp_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, 'wb') as tmp:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+    except Exception:
+        _remove(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+def commit(tmp_path, sha256, size):
+    """
+    Put a file from receive() in place. Return (blob, created), created
+    False if the content was stored before.
+
+    The file is put in place while the blob row is locked, so prune()
+    cannot remove it between the check and the commit. Call it in the
+    transaction linking a source to the blob to keep the lock until then.
+    """
+    path = blob_path(sha256)
+    try:
+        with transaction.atomic():
+            blob, created = Blob.objects.select_for_update().get_or_create(
+                    sha256=sha256, defaults={'size': size})
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                _makedirs(os.path.dirname(path))
+                # Atomic, a concurrent upload of the same content wins or
+                # loses with identical bytes.
+                os.rename(tmp_path, path)
+    except Exception:
+        _remove(tmp_path)
+        raise
+    return blob, created
+
+
+def store(stream, chunk_size=CHUNK_SIZE):
+    """
+    Store the content read from a file-like object, see receive() and
+    commit(). Return (blob, created).
+    """
+    return commit(*receive(stream, chunk_size))
+
+
+def parse_range(header, size):
+    """
+    Return inclusive (start, end) of a single byte range in a Range header,
+    or None to send the whole file, e.g. for multiple ranges. Raise
+    ValueError if the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix range: the last n bytes.
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError('Range not satisfiable.')
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError('Range not satisfiable.')
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def iter_file(path, start=0, end=None, chunk_size=CHUNK_SIZE):
+    """
+    Generate the bytes start..end, inclusive, of a file in chunks sliced
+    from a memory map.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size - 1 if end is None else end
+        if size == 0 or end < start:
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for offset in range(start, end + 1, chunk_size):
+                yield mapped[offset:min(offset + chunk_size, end + 1)]
+        finally:
+            mapped.close()
+
+
+def sendfile_header():
+    """
+    Return (header, value prefix) for front end server file sending, or
+    None to serve files from Python.
+    """
+    header = getattr(settings, 'DOCUMENT_INDEX_BLOB_SENDFILE', None)
+    if not header:
+        return None
+    return header, getattr(settings, 'DOCUMENT_INDEX_BLOB_SENDFILE_PREFIX',
+            None)
+
+
+def prune(hours=1):
+    """
+    Delete blobs no source refers to and their files. Blobs stored less
+    than hours ago are kept for uploads not linked to their source yet.
+    Return number of blobs deleted.
+    """
+    cutoff = timezone.now() - timedelta(hours=hours)
+    deleted = 0
+    for sha256 in list(Blob.objects.filter(sources__isnull=True,
+            created__lt=cutoff).values_list('sha256', flat=True)):
+        try:
+            # The row stays locked until the file is gone, so a concurrent
+            # store() of the same content waits and then writes the file
+            # again.
+            with transaction.atomic():
+                blobs = list(Blob.objects.select_for_update().filter(
+                    sha256=sha256))
+                if not blobs:
+                    continue
+                blobs[0].delete()
+                _remove(blob_path(sha256))
+        except ProtectedError:
+            # A source was linked to it meanwhile.
+            continue
+        deleted += 1
+    return deleted
@@ -0,0 +1,282 @@
+"""
+Bulk loading of group trees and documents.
+
+Adding nodes through treebeard saves every node on its own and sorted
+insertion shifts sibling paths on every call. A new subtree has no existing
+siblings to shift though, so all of its paths can be computed up front and
+inserted with bulk_create.
+"""
+import json
+from django.db import DatabaseError, transaction
+from django.utils import six
+from django.utils.datastructures import SortedDict
+from document_index import changes
+from document_index.models import Group, Document, Source, ChangeLog
+from document_index.pagination import iter_keyset_chunks
+from document_index.parsers import InvalidLine
+from document_index.search import index_documents
+from document_index.signals import deferred_indexing, tree_changed
+from document_index.tree import subtree_q
+
+GROUP_FIELDS = ('name', 'description', 'comment')
+
+
+def validate_tree(data, prefix=''):
+    """
+    Check nested tree data. Return list of error strings.
+    """
+    if not isinstance(data, list):
+        return ['{0}: expected a list of groups.'.format(prefix or 'tree')]
+
+    errors = []
+    for i, item in enumerate(data):
+        location = '{0}{1}'.format(prefix, i)
+        if not isinstance(item, dict):
+            errors.append('{0}: expected an object.'.format(location))
+            continue
+        for field in GROUP_FIELDS:
+            value = item.get(field, '')
+            max_length = Group._meta.get_field(field).max_length
+            if not isinstance(value, six.string_types):
+                errors.append('{0}.{1}: expected a string.'.format(
+                    location, field))
+            elif field == 'name' and not value:
+                errors.append('{0}.name: this field is required.'.format(
+                    location))
+            elif len(value) > max_length:
+                errors.append('{0}.{1}: longer than {2} characters.'.format(
+                    location, field, max_length))
+        if 'children' in item:
+            errors.extend(validate_tree(item['children'],
+                '{0}.children.'.format(location)))
+    return errors
+
+
+def _sorted_items(items):
+    # Same sibling order treebeard keeps for node_order_by = ['name'].
+    return sorted(items, key=lambda item: item['name'])
+
+
+def _group_kwargs(item, owner, tree_id):
+    kwargs = dict((field, item.get(field, '')) for field in GROUP_FIELDS)
+    kwargs.update({'owner': owner, 'tree_id': tree_id})
+    return kwargs
+
+
+def _build_nodes(parent_path, depth, items, owner, tree_id, nodes):
+    """
+    Append unsaved Group instances for items, and recursively their
+    children, below parent_path. Return number of children added.
+    """
+    items = _sorted_items(items)
+    for step, item in enumerate(items, 1):
+        path = Group._get_path(parent_path, depth, step)
+        children = item.get('children') or []
+        nodes.append(Group(path=path, depth=depth, numchild=len(children),
+            **_group_kwargs(item, owner, tree_id)))
+        _build_nodes(path, depth + 1, children, owner, tree_id, nodes)
+    return len(items)
+
+
+def load_tree(data, owner, tree_id, parent=None):
+    """
+    Insert nested tree data below ``parent``, or as root nodes when parent
+    is None, in one transaction. Return list of the top level nodes created.
+
+    Top level nodes are placed with treebeard so that they sort correctly
+    among existing siblings. Everything below them is new, so their paths
+    are computed here and inserted with bulk_create.
+    """
+    with transaction.atomic():
+        top_ids = []
+        for item in _sorted_items(data):
+            kwargs = _group_kwargs(item, owner, tree_id)
+            if parent is None:
+                node = Group.add_root(**kwargs)
+            else:
+                # Reload so treebeard sees the current numchild and path.
+                node = Group.objects.get(pk=parent.pk).add_child(**kwargs)
+            top_ids.append(node.pk)
+
+        # Later sorted inserts may have shifted earlier siblings.
+        tops = Group.objects.in_bulk(top_ids)
+        nodes = []
+        for pk, item in zip(top_ids, _sorted_items(data)):
+            top = tops[pk]
+            top.numchild = _build_nodes(top.path, top.depth + 1,
+                    item.get('children') or [], owner, tree_id, nodes)
+            if top.numchild:
+                Group.objects.filter(pk=pk).update(numchild=top.numchild)
+
+        # Without batch_size Django keeps each INSERT within the parameter
+        # limit of the database, e.g. 999 on SQLite.
+        Group.objects.bulk_create(nodes)
+        # Top level nodes were recorded by their signals.
+        if nodes:
+            changes.record_query('group', Group.objects.filter(subtree_q(
+                [top.path for top in tops.values()], include_self=False
+                )).order_by('path'), ChangeLog.INSERT)
+
+    tree_changed.send(sender=Group)
+    return [tops[pk] for pk in top_ids]
+
+
+def count_nodes(data):
+    """
+    Return number of groups in nested tree data.
+    """
+    return sum(1 + count_nodes(item.get('children') or []) for item in data)
+
+
+def iter_tree_json(paths, chunk_size=500):
+    """
+    Generate the subtrees below ``paths`` as a nested JSON array, in the
+    format accepted by load_tree(). Nodes are read in path order, chunk_size
+    at a time with keyset queries, and written as they arrive, so memory use
+    does not grow with the size of the tree.
+    """
+    yield '['
+    query = subtree_q(paths)
+    if query is not None:
+        chunks = iter_keyset_chunks(Group.objects.filter(query).values_list(
+            'path', 'depth', *GROUP_FIELDS), ('path',),
+            lambda row: [row[0]], chunk_size)
+        rows = (row for chunk in chunks for row in chunk)
+        start_depth = prev_depth = None
+        for row in rows:
+            depth = row[1]
+            if prev_depth is None:
+                start_depth = depth
+                separator = ''
+            elif depth > prev_depth:
+                separator = ''
+            else:
+                separator = ']}' * (prev_depth - depth + 1) + ', '
+            data = json.dumps(SortedDict(zip(GROUP_FIELDS, row[2:])))
+            yield '{0}{1}, "children": ['.format(separator, data[:-1])
+            prev_depth = depth
+        if prev_depth is not None:
+            yield ']}' * (prev_depth - start_depth + 1)
+    yield ']'
+
+
+DOCUMENT_FIELDS = ('name', 'description', 'comment')
+SOURCE_FIELDS = ('name', 'description', 'filename', 'mime_type', 'comment')
+
+
+def _validate_fields(model, item, fields, location):
+    errors = []
+    for field in fields:
+        value = item.get(field, '')
+        max_length = model._meta.get_field(field).max_length
+        if not isinstance(value, six.string_types):
+            errors.append('{0}{1}: expected a string.'.format(
+                location, field))
+        elif len(value) > max_length:
+            errors.append('{0}{1}: longer than {2} characters.'.format(
+                location, field, max_length))
+    return errors
+
+
+def validate_document(row, group_paths, write_prefixes=None):
+    """
+    Check one document row for ingestion. ``group_paths`` maps the ids of
+    existing groups to their paths. With ``write_prefixes`` the group must
+    be below one of them. Return list of error strings.
+    """
+    if isinstance(row, InvalidLine):
+        return [row.message]
+    if not isinstance(row, dict):
+        return ['expected an object.']
+
+    errors = _validate_fields(Document, row, DOCUMENT_FIELDS, '')
+    if not row.get('name'):
+        errors.append('name: this field is required.')
+    group_id = row.get('group')
+    if not isinstance(group_id, six.integer_types) or \
+            group_id not in group_paths:
+        errors.append('group: expected the id of an existing group.')
+    elif write_prefixes is not None and not any(
+            group_paths[group_id].startswith(prefix)
+            for prefix in write_prefixes):
+        errors.append('group: write access required.')
+
+    sources = row.get('sources', [])
+    if not isinstance(sources, list):
+        return errors + ['sources: expected a list.']
+    for i, source in enumerate(sources):
+        if not isinstance(source, dict):
+            errors.append('sources.{0}: expected an object.'.format(i))
+        else:
+            errors.extend(_validate_fields(Source, source, SOURCE_FIELDS,
+                'sources.{0}.'.format(i)))
+    return errors
+
+
+def ingest_documents(rows, batch_size=500, write_prefixes=None):
+    """
+    Create documents with their sources. Rows that fail validation or
+    insertion are reported and skipped without aborting the batch. With
+    ``write_prefixes``, the WRITE path prefixes of the user from access.py,
+    rows for other groups fail.
+
+    Group ids are checked with one query per batch, sources are numbered
+    1..n in the order given and inserted with bulk_create, ``source_count``
+    is set as the documents are written and the search index is updated
+    once for the whole batch. Lists of group and document ids in queries
+    are cut at batch_size.
+    Return list of per row results in input order, each with either
+    ``document_id`` or ``errors``.
+    """
+    rows = list(rows)
+    referenced = list(set(row.get('group') for row in rows
+            if isinstance(row, dict) and
+            isinstance(row.get('group'), six.integer_types)))
+    group_paths = {}
+    for start in range(0, len(referenced), batch_size):
+        group_paths.update(Group.objects.filter(
+            id__in=referenced[start:start + batch_size]).values_list(
+                'id', 'path'))
+
+    results = []
+    created = []
+    with transaction.atomic(), deferred_indexing():
+        for i, row in enumerate(rows):
+            errors = validate_document(row, group_paths, write_prefixes)
+            if errors:
+                results.append({'row': i, 'errors': errors})
+                continue
+
+            sources = row.get('sources', [])
+            document = Document(group_id=row['group'],
+                    source_count=len(sources), **dict(
+                        (field, row.get(field, ''))
+                        for field in DOCUMENT_FIELDS))
+            try:
+                # A failing row only rolls back its own savepoint.
+                with transaction.atomic():
+                    document.save()
+            except DatabaseError as e:
+                results.append({'row': i, 'errors': [str(e)]})
+                continue
+
+            document_sources = [Source(document_id=document.pk,
+                sequence=sequence, **dict(
+                    (field, source.get(field, ''))
+                    for field in SOURCE_FIELDS))
+                for sequence, source in enumerate(sources, 1)]
+            created.append((document, document_sources))
+            results.append({'row': i, 'document_id': document.pk})
+
+        # Batched by Django to fit the parameter limit of the database.
+        Source.objects.bulk_create(
+                [source for _, sources in created for source in sources])
+        with_sources = [document.pk for document, sources in created
+                if sources]
+        for start in range(0, len(with_sources), batch_size):
+            changes.record_query('source', Source.objects.filter(
+                document__in=with_sources[start:start + batch_size]
+                ).order_by('source_id'), ChangeLog.INSERT)
+        index_documents(created, batch_size=batch_size, replace=False)
+
+    return results
@@ -0,0 +1,113 @@
+"""
+Cache of per user tree lookups.
+
+Every group request for parent 0 resolves the requesting user's tree by
+username and then the root nodes of that tree. Both change rarely, so they
+are kept in Django's cache and invalidated from signals in signals.py.
+
+Root paths are shared by all trees: adding or removing a root node in one
+tree can shift the root paths of another. Cached root paths are therefore
+keyed by a generation number which any change to the set of root nodes
+bumps.
+
+Both lookups go to the database every time unless the cache is shared by
+all processes, see is_shared().
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from document_index.models import GroupTreeList, Group
+
+TREE_ID_KEY = 'document_index:tree_id:{0}'
+ROOT_PATHS_KEY = 'document_index:root_paths:{0}:{1}'
+ROOTS_GENERATION_KEY = 'document_index:roots_generation'
+
+# Cached in place of a tree id for users without a tree.
+NO_TREE = 0
+
+# Backends keeping entries in the memory of each process, or nowhere.
+LOCAL_BACKENDS = ('LocMemCache', 'DummyCache')
+
+# Hit and miss counters of this process.
+stats = {'hits': 0, 'misses': 0}
+
+
+def _record(hit):
+    stats['hits' if hit else 'misses'] += 1
+
+
+def is_shared():
+    """
+    Return True if Django's cache is shared by all processes serving the
+    API. Signal handlers evict entries from the cache of their own process
+    only, so data that must not outlive a write, e.g. validated tokens,
+    access prefixes and versioned responses, is only cached then.
+    DOCUMENT_INDEX_SHARED_CACHE overrides the guess from the backend.
+    """
+    shared = getattr(settings, 'DOCUMENT_INDEX_SHARED_CACHE', None)
+    if shared is None:
+        backend = settings.CACHES['default']['BACKEND']
+        shared = backend.rsplit('.', 1)[-1] not in LOCAL_BACKENDS
+    return shared
+
+
+def get_tree_id(username):
+    """
+    Return id of the tree named after username, or None.
+    """
+    shared = is_shared()
+    key = TREE_ID_KEY.format(username)
+    tree_id = cache.get(key) if shared else None
+    _record(tree_id is not None)
+    if tree_id is None:
+        try:
+            tree_id = GroupTreeList.objects.get(name=username).id
+        except GroupTreeList.DoesNotExist:
+            tree_id = NO_TREE
+        if shared:
+            cache.set(key, tree_id)
+    return tree_id or None
+
+
+def roots_generation():
+    """
+    Return the roots generation, or None if the cache cannot store it.
+    """
+    generation = cache.get(ROOTS_GENERATION_KEY)
+    if generation is None:
+        # Start from the clock so an evicted generation is not reused.
+        cache.add(ROOTS_GENERATION_KEY, int(time.time()))
+        generation = cache.get(ROOTS_GENERATION_KEY)
+    return generation
+
+
+def get_root_paths(tree_id):
+    """
+    Return list of root node paths of a tree in path order.
+    """
+    generation = roots_generation() if is_shared() else None
+    shared = generation is not None
+    if shared:
+        key = ROOT_PATHS_KEY.format(generation, tree_id)
+        paths = cache.get(key)
+    else:
+        paths = None
+    _record(paths is not None)
+    if paths is None:
+        paths = list(Group.get_root_nodes().filter(
+            tree_id=tree_id).values_list('path', flat=True))
+        if shared:
+            cache.set(key, paths)
+    return paths
+
+
+def invalidate_tree(username):
+    cache.delete(TREE_ID_KEY.format(username))
+
+
+def invalidate_roots():
+    try:
+        cache.incr(ROOTS_GENERATION_KEY)
+    except ValueError:
+        # Not cached yet. Nothing can be stale.
+        pass
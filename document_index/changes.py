@@ -0,0 +1,162 @@
+"""
+Change feed for incremental sync.
+
+Every write to a group, document or source adds a ChangeLog row in the same
+transaction, from model signals or, for set based writes, from the code
+doing them. Clients keep the id of the last change they saw as an opaque
+token and ask for the changes after it.
+
+Ids are handed out when rows are inserted but become visible when their
+transaction commits, however long that takes, so a reader can see id 12
+before id 11. Readers therefore do not follow ids. Before reading, they
+publish the committed changes that have no ``position`` yet, giving them
+positions above every position handed out before, in id order. Publishing
+is serialized by a lock on the ChangeWatermark row, so a change committed
+late is published late and lands after the token of every reader that
+has moved on. Tokens are positions.
+"""
+import time
+from datetime import timedelta
+from django.db import connection, transaction
+from django.db.models import F, Max, Min
+from django.utils import timezone
+from document_index import versions
+from document_index.models import ChangeLog, ChangeWatermark
+from document_index.pagination import decode_cursor, encode_cursor
+
+# Version bumped with every recorded change. Long polls watch it instead of
+# the table.
+CHANGES = 'changes'
+
+POLL_INTERVAL = 0.5
+
+# Long polls look at the table at least this often, for changes whose
+# version bump was seen before their transaction committed.
+RECHECK_SECONDS = 5
+
+
+def record(model, object_id, action):
+    ChangeLog.objects.create(model=model, object_id=object_id,
+            action=action)
+    versions.bump_version(CHANGES)
+
+
+def record_query(model, queryset, action):
+    """
+    Record a change for each row of a queryset with one INSERT ... SELECT,
+    for rows written with set based SQL. Rows are recorded in the order of
+    the queryset.
+    """
+    column = queryset.model._meta.pk.column
+    sql, params = queryset.values_list(
+            queryset.model._meta.pk.name).query.sql_with_params()
+    quote = connection.ops.quote_name
+    now = connection.ops.value_to_db_datetime(timezone.now())
+    cursor = connection.cursor()
+    cursor.execute('INSERT INTO {0} ({1}, {2}, {3}, {4}) '
+        'SELECT %s, T.{5}, %s, %s FROM ({6}) T'.format(
+            quote(ChangeLog._meta.db_table), quote('model'),
+            quote('object_id'), quote('action'), quote('created'),
+            quote(column), sql), [model, action, now] + list(params))
+    versions.bump_version(CHANGES)
+
+
+def encode_token(change_id):
+    return encode_cursor([change_id])
+
+
+def decode_token(token):
+    """
+    Return change id of a token. Raise ValueError on malformed tokens.
+    """
+    values = decode_cursor(token)
+    if len(values) != 1 or not isinstance(values[0], int):
+        raise ValueError('Invalid token.')
+    return values[0]
+
+
+def _lock_watermark():
+    """
+    Lock the watermark row until the transaction ends. Return position.
+    """
+    if not ChangeWatermark.objects.filter(pk=1).update(
+            position=F('position')):
+        ChangeWatermark.objects.get_or_create(pk=1)
+        ChangeWatermark.objects.filter(pk=1).update(position=F('position'))
+    return ChangeWatermark.objects.values_list('position', flat=True).get(
+            pk=1)
+
+
+def publish():
+    """
+    Give the committed changes without a position the next positions, in
+    id order. Every change published later gets a higher position than all
+    published before, whatever order their transactions committed in.
+    """
+    if not ChangeLog.objects.filter(position__isnull=True).exists():
+        return
+    with transaction.atomic():
+        watermark = _lock_watermark()
+        unpublished = ChangeLog.objects.filter(position__isnull=True)
+        first = unpublished.aggregate(first=Min('id'))['first']
+        if first is None:
+            return
+        # Rows committing meanwhile with a lower id wait for the next call.
+        unpublished.filter(id__gte=first).update(
+                position=F('id') + (watermark + 1 - first))
+        ChangeWatermark.objects.filter(pk=1).update(
+                position=ChangeLog.objects.aggregate(
+                    last=Max('position'))['last'])
+
+
+def latest_id():
+    """
+    Return position of the last published change, 0 if none.
+    """
+    publish()
+    change = ChangeLog.objects.filter(position__isnull=False).order_by(
+            '-position').values_list('position', flat=True)[:1]
+    return change[0] if change else 0
+
+
+def get_changes(since_id, limit=500):
+    """
+    Return (changes, last position) for up to limit changes after the
+    position since_id, in order.
+    """
+    publish()
+    changes = list(ChangeLog.objects.filter(position__gt=since_id).order_by(
+        'position')[:limit])
+    return changes, changes[-1].position if changes else since_id
+
+
+def wait_for_changes(since_id, timeout, limit=500):
+    """
+    Like get_changes(), but wait up to timeout seconds for changes to
+    arrive. The database is queried when the change version moved and
+    every RECHECK_SECONDS.
+    """
+    deadline = time.time() + timeout
+    version = versions.get_versions([CHANGES])
+    changes, last_id = get_changes(since_id, limit)
+    checked = time.time()
+    while not changes and time.time() < deadline:
+        time.sleep(POLL_INTERVAL)
+        current = versions.get_versions([CHANGES])
+        if current != version or time.time() - checked >= RECHECK_SECONDS:
+            version = current
+            changes, last_id = get_changes(since_id, limit)
+            checked = time.time()
+    return changes, last_id
+
+
+def prune(days):
+    """
+    Delete changes older than days. Return number deleted. Clients holding
+    a token from before then have to sync everything again.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    queryset = ChangeLog.objects.filter(created__lt=cutoff)
+    count = queryset.count()
+    queryset.delete()
+    return count
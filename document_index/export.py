@@ -0,0 +1,181 @@
+"""
+Streaming export of document and source metadata.
+
+Documents are read in keyset chunks on document_id, or on modified time and
+document_id when filtering on it, and the sources of each chunk with one
+more query, as plain value tuples without model instances. Each chunk is
+written out before the next is read, so memory use depends on the chunk
+size only.
+"""
+import csv
+import json
+import zlib
+from django.db.models import Q
+from django.utils import six
+from document_index.models import Document, Source
+from document_index.tree import subtree_range
+
+DOCUMENT_FIELDS = ('document_id', 'group_id', 'name', 'description',
+        'comment', 'source_count', 'created', 'modified')
+MODIFIED = DOCUMENT_FIELDS.index('modified')
+SOURCE_FIELDS = ('source_id', 'sequence', 'name', 'description', 'filename',
+        'mime_type', 'comment', 'created', 'modified')
+
+NDJSON, CSV = 'ndjson', 'csv'
+
+CONTENT_TYPES = {NDJSON: 'application/x-ndjson', CSV: 'text/csv'}
+
+# Documents per chunk. Their ids are one IN list when reading the sources,
+# kept below SQLite's limit of 999 parameters.
+CHUNK_SIZE = 900
+
+
+def _isoformat(value):
+    # Same representation as the API serializers.
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def _row(fields, values):
+    return [(field, _isoformat(value) if field in ('created', 'modified')
+        else value) for field, value in zip(fields, values)]
+
+
+def iter_documents(group=None, modified_after=None, modified_before=None,
+        chunk_size=CHUNK_SIZE):
+    """
+    Generate chunks of documents as lists of (document, sources) tuples,
+    each a list of (field, value) pairs. Optionally limited to the subtree
+    below ``group`` and to documents modified in [after, before), then in
+    order of modification.
+    """
+    queryset = Document.objects.all()
+    if group is not None:
+        queryset = queryset.filter(
+                group__path__range=subtree_range(group.path))
+    if modified_after is not None:
+        queryset = queryset.filter(modified__gte=modified_after)
+    if modified_before is not None:
+        queryset = queryset.filter(modified__lt=modified_before)
+
+    # With a modified range, read along the modified index. Its order is
+    # also the order of changes, which suits incremental exports.
+    by_modified = modified_after is not None or modified_before is not None
+    key = (('modified', 'document_id') if by_modified else
+            ('document_id',))
+    last = None
+    while True:
+        chunk = queryset.order_by(*key)
+        if last is not None:
+            if by_modified:
+                chunk = chunk.filter(Q(modified__gt=last[MODIFIED]) |
+                        Q(modified=last[MODIFIED], document_id__gt=last[0]))
+            else:
+                chunk = chunk.filter(document_id__gt=last[0])
+        documents = list(chunk.values_list(*DOCUMENT_FIELDS)[:chunk_size])
+        if not documents:
+            return
+
+        sources = {}
+        for row in Source.objects.filter(document_id__in=[
+                document[0] for document in documents]).order_by(
+                    'document', 'sequence', 'source_id').values_list(
+                        'document_id', *SOURCE_FIELDS):
+            sources.setdefault(row[0], []).append(
+                    _row(SOURCE_FIELDS, row[1:]))
+
+        yield [(_row(DOCUMENT_FIELDS, document),
+            sources.get(document[0], [])) for document in documents]
+        if len(documents) < chunk_size:
+            return
+        last = documents[-1]
+
+
+def iter_ndjson(chunks):
+    """
+    Generate one string per chunk with a JSON object per document, its
+    sources nested.
+    """
+    for chunk in chunks:
+        lines = []
+        for document, sources in chunk:
+            data = dict(document)
+            data['sources'] = [dict(source) for source in sources]
+            lines.append(json.dumps(data, sort_keys=True))
+        yield '\n'.join(lines) + '\n'
+
+
+class _Buffer(object):
+    """
+    File-like target for csv.writer collecting written strings.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, value):
+        self.parts.append(value)
+
+    def pop(self):
+        value = ''.join(self.parts)
+        self.parts = []
+        return value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if six.PY2 and isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    return value
+
+
+def iter_csv(chunks):
+    """
+    Generate one string per chunk with a CSV row per source, the document
+    columns repeated. Documents without sources get one row with empty
+    source columns. The first string holds the header.
+    """
+    buf = _Buffer()
+    writer = csv.writer(buf)
+    writer.writerow(['document_' + field if not field.startswith('document')
+        else field for field in DOCUMENT_FIELDS] +
+        ['source_' + field if not field.startswith('source') else field
+            for field in SOURCE_FIELDS])
+    yield buf.pop()
+
+    empty = [''] * len(SOURCE_FIELDS)
+    for chunk in chunks:
+        for document, sources in chunk:
+            values = [_csv_value(value) for _, value in document]
+            for source in sources or [None]:
+                writer.writerow(values + (empty if source is None else
+                    [_csv_value(value) for _, value in source]))
+        yield buf.pop()
+
+
+def gzip_stream(strings):
+    """
+    Compress a stream of strings to a gzip stream.
+    """
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+            zlib.MAX_WBITS | 16)
+    for value in strings:
+        if isinstance(value, six.text_type):
+            value = value.encode('utf-8')
+        data = compressor.compress(value)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_documents(output=NDJSON, compress=False, **kwargs):
+    """
+    Generate the export in ``output`` format, gzip compressed if asked.
+    Other arguments are passed to iter_documents().
+    """
+    chunks = iter_documents(**kwargs)
+    strings = iter_csv(chunks) if output == CSV else iter_ndjson(chunks)
+    return gzip_stream(strings) if compress else strings
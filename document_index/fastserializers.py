@@ -0,0 +1,295 @@
+"""
+Read only serializers for list endpoints working on values_list() rows.
+
+The DRF serializers in serializers.py build a model instance per row and
+then run every field of the serializer on it. For long lists most of the
+time goes there rather than into SQL. The serializers here read plain
+tuples, keep them in light named tuples, and build each output row from a
+fixed column list, with hyperlinks from a URL template resolved once per
+page. Their output is identical to that of the DRF serializers.
+
+Rows have an attribute per column, named by attname, and ``pk``, so they
+work with keyset_values() and the tree helpers in tree.py.
+"""
+from collections import namedtuple
+from operator import itemgetter
+from django.contrib.auth.models import User
+from django.utils.datastructures import SortedDict
+from rest_framework import ISO_8601
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.templatetags.rest_framework import replace_query_param
+from document_index.fields import url_template
+from document_index.models import Group, Document, Source
+from document_index.pagination import iter_keyset_chunks
+from document_index.renderers import StreamingJSONResponse
+
+# Rows serialized at a time when streaming.
+STREAM_CHUNK_SIZE = 500
+
+
+def format_datetime(value):
+    """
+    Format a datetime like DRF's DateTimeField does.
+    """
+    output_format = api_settings.DATETIME_FORMAT
+    if value is None or output_format is None:
+        return value
+    if output_format.lower() == ISO_8601:
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return value.strftime(output_format)
+
+
+def _row_class(model, columns, pk):
+    """
+    Return named tuple class for values_list() rows of columns. Fields are
+    named by attname, e.g. ``group_id``, so model field methods can read
+    them like instances. Lookups across relations, e.g. ``owner__username``,
+    become ``owner_username``.
+    """
+    opts = model._meta
+    names = [column.replace('__', '_') if '__' in column
+            else opts.get_field(column).attname for column in columns]
+    row_class = namedtuple(model.__name__ + 'Row', names)
+    row_class.pk = property(itemgetter(columns.index(pk)))
+    return row_class
+
+
+class ValuesSerializer(object):
+    """
+    Base class. Subclasses set ``model``, ``columns``, the values_list()
+    fields, and ``pk`` and implement to_native() for a single row.
+    """
+    model = None
+    columns = ()
+    pk = 'pk'
+    _row_classes = {}
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        self.request = self.context.get('request')
+        self.format = self.context.get('format')
+
+    @classmethod
+    def row_class(cls):
+        row_class = cls._row_classes.get(cls)
+        if row_class is None:
+            row_class = cls._row_classes[cls] = _row_class(
+                    cls.model, cls.columns, cls.pk)
+        return row_class
+
+    def url_template(self, view_name):
+        return url_template(view_name, self.request, self.format)
+
+    @classmethod
+    def rows(cls, queryset):
+        """
+        Return list of rows of a queryset. Prefetching is turned off, rows
+        are no model instances.
+        """
+        make = cls.row_class()._make
+        return [make(values) for values in queryset.prefetch_related(
+            None).values_list(*cls.columns)]
+
+    @classmethod
+    def iter_rows(cls, queryset, fields=None, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Generate lists of up to chunk_size rows of a queryset, ordered by
+        the unique key ``fields``, by default the primary key. Each list is
+        read with its own keyset query, as the database driver would fetch
+        the whole result of a single query at once.
+        """
+        fields = fields or (cls.pk,)
+        names = [cls.model._meta.get_field(field).attname
+                for field in fields]
+        make = cls.row_class()._make
+
+        def key(values):
+            row = make(values)
+            return [getattr(row, name) for name in names]
+
+        for chunk in iter_keyset_chunks(queryset.prefetch_related(
+                None).values_list(*cls.columns), fields, key, chunk_size):
+            yield [make(values) for values in chunk]
+
+    def iter_serialize(self, queryset, fields=None):
+        """
+        Generate the serialized rows of a queryset, a chunk at a time.
+        """
+        for rows in self.iter_rows(queryset, fields):
+            for data in self.serialize(rows):
+                yield data
+
+    def to_native(self, row):
+        raise NotImplementedError
+
+    def serialize(self, rows):
+        return [self.to_native(row) for row in rows]
+
+
+class UserValuesSerializer(ValuesSerializer):
+    """
+    Same output as serializers.UserSerializer.
+    """
+    model = User
+    columns = ('id', 'username')
+    pk = 'id'
+
+    def to_native(self, row):
+        return SortedDict([('id', row[0]), ('username', row[1])])
+
+
+class GroupValuesSerializer(ValuesSerializer):
+    """
+    Same output as serializers.GroupSerializer, including ``child_counts``
+    from the context.
+    """
+    model = Group
+    columns = ('id', 'path', 'depth', 'owner__username', 'name',
+            'description', 'comment', 'numchild')
+    pk = 'id'
+
+    def __init__(self, context=None):
+        super(GroupValuesSerializer, self).__init__(context)
+        self.prefix, self.suffix = self.url_template('group-detail')
+        self.child_counts = self.context.get('child_counts') or {}
+
+    def to_native(self, row):
+        group_id = row[0]
+        return SortedDict([
+            ('group', self.prefix + str(group_id) + self.suffix),
+            ('owner', row[3]),
+            ('name', row[4]),
+            ('description', row[5]),
+            ('comment', row[6]),
+            # Group.parent, a class attribute.
+            ('parent', Group.parent),
+            ('numchild', self.child_counts.get(group_id, row[7])),
+        ])
+
+
+class SourceValuesSerializer(ValuesSerializer):
+    """
+    Same output as serializers.SourceSerializer.
+    """
+    model = Source
+    columns = ('source_id', 'document', 'name', 'description', 'sequence',
+            'filename', 'mime_type', 'comment', 'blob', 'created',
+            'modified')
+    pk = 'source_id'
+
+    def __init__(self, context=None):
+        super(SourceValuesSerializer, self).__init__(context)
+        self.prefix, self.suffix = self.url_template('source-detail')
+
+    def to_native(self, row):
+        return SortedDict([
+            ('source', self.prefix + str(row[0]) + self.suffix),
+            ('document', row[1]),
+            ('name', row[2]),
+            ('description', row[3]),
+            ('sequence', row[4]),
+            ('filename', row[5]),
+            ('mime_type', row[6]),
+            ('comment', row[7]),
+            ('blob', row[8]),
+            ('created', format_datetime(row[9])),
+            ('modified', format_datetime(row[10])),
+        ])
+
+
+class DocumentValuesSerializer(ValuesSerializer):
+    """
+    Same output as serializers.DocumentSerializer. The sources of all rows
+    are read with one more query.
+    """
+    model = Document
+    columns = ('document_id', 'group', 'name', 'description', 'created',
+            'modified', 'source_count', 'comment')
+    pk = 'document_id'
+
+    def __init__(self, context=None):
+        super(DocumentValuesSerializer, self).__init__(context)
+        self.prefix, self.suffix = self.url_template('group-detail')
+        self.source_serializer = SourceValuesSerializer(context)
+        self.sources = {}
+
+    def serialize(self, rows):
+        self.sources = {}
+        if rows:
+            # Same query, and so the same order, as prefetch_related().
+            source_serializer = self.source_serializer
+            for source in source_serializer.rows(Source.objects.filter(
+                    document__in=[row[0] for row in rows])):
+                self.sources.setdefault(source[1], []).append(
+                        source_serializer.to_native(source))
+        return super(DocumentValuesSerializer, self).serialize(rows)
+
+    def to_native(self, row):
+        return SortedDict([
+            ('document_id', row[0]),
+            ('group', self.prefix + str(row[1]) + self.suffix),
+            ('name', row[2]),
+            ('description', row[3]),
+            ('created', format_datetime(row[4])),
+            ('modified', format_datetime(row[5])),
+            ('source_count', row[6]),
+            ('comment', row[7]),
+            ('sources', self.sources.get(row[0], [])),
+        ])
+
+
+class ValuesListMixin(object):
+    """
+    List views serializing with ``values_serializer_class`` instead of the
+    DRF serializer. Page number pagination gives the same response as DRF's
+    PaginationSerializer. Works with KeysetPaginationMixin, which must come
+    later in the bases.
+
+    With ``stream=1`` the whole list is streamed as a JSON array, unpaged,
+    in the order of ``keyset_fields`` or else the primary key.
+    """
+    values_serializer_class = None
+    stream_param = 'stream'
+
+    def get_values_serializer(self):
+        return self.values_serializer_class(self.get_serializer_context())
+
+    def get_rows(self, queryset):
+        self.values_serializer = self.get_values_serializer()
+        return self.values_serializer.rows(queryset)
+
+    def serialize_rows(self, rows):
+        return self.values_serializer.serialize(rows)
+
+    def _page_url(self, page_number):
+        return replace_query_param(self.request.build_absolute_uri(),
+                'page', page_number)
+
+    def list(self, request, *args, **kwargs):
+        if request.QUERY_PARAMS.get(self.stream_param) == '1':
+            self.object_list = self.filter_queryset(self.get_queryset())
+            return StreamingJSONResponse(
+                    self.get_values_serializer().iter_serialize(
+                        self.object_list, getattr(self, 'keyset_fields',
+                            None)))
+        if getattr(self, 'cursor_param', None) in request.QUERY_PARAMS:
+            return super(ValuesListMixin, self).list(request, *args, **kwargs)
+
+        self.object_list = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(self.object_list)
+        if page is None:
+            return Response(self.serialize_rows(self.get_rows(
+                self.object_list)))
+        return Response(SortedDict([
+            ('count', page.paginator.count),
+            ('next', self._page_url(page.next_page_number())
+                if page.has_next() else None),
+            ('previous', self._page_url(page.previous_page_number())
+                if page.has_previous() else None),
+            ('results', self.serialize_rows(self.get_rows(
+                page.object_list))),
+        ]))
@@ -0,0 +1,66 @@
+"""
+Serializer fields for document_index.
+"""
+from django.core.urlresolvers import get_script_prefix, get_urlconf
+from rest_framework import serializers
+from rest_framework.reverse import reverse
+
+# Reversed in place of a real pk. Must match the pk patterns in urls.py.
+PK_PLACEHOLDER = '9081726354'
+
+_url_templates = {}
+
+
+def url_template(view_name, request=None, format=None):
+    """
+    Return (prefix, suffix) of the URLs reverse_pk() returns for a view.
+    The URL of a pk is prefix + str(pk) + suffix.
+    """
+    key = (get_urlconf(), get_script_prefix(), view_name, format)
+    template = _url_templates.get(key)
+    if template is None:
+        url = reverse(view_name, kwargs={'pk': PK_PLACEHOLDER}, format=format)
+        template = _url_templates[key] = tuple(url.split(PK_PLACEHOLDER, 1))
+
+    if request:
+        # Same result as request.build_absolute_uri(url) for absolute paths.
+        base = getattr(request, '_document_index_url_base', None)
+        if base is None:
+            base = request.build_absolute_uri('/')[:-1]
+            request._document_index_url_base = base
+        return base + template[0], template[1]
+    return template
+
+
+def reverse_pk(view_name, pk, request=None, format=None):
+    """
+    Same as rest_framework reverse() for views taking a single ``pk`` kwarg.
+    The URL is resolved once per view and format and the pk is substituted
+    afterwards, so list views do not run the resolver for every row.
+    """
+    prefix, suffix = url_template(view_name, request, format)
+    return '{0}{1}{2}'.format(prefix, pk, suffix)
+
+
+class CachedHyperlinkedIdentityField(serializers.HyperlinkedIdentityField):
+    """
+    HyperlinkedIdentityField using reverse_pk().
+    """
+
+    def get_url(self, obj, view_name, request, format):
+        if self.lookup_field != 'pk':
+            return super(CachedHyperlinkedIdentityField, self).get_url(
+                    obj, view_name, request, format)
+        return reverse_pk(view_name, obj.pk, request, format)
+
+
+class CachedHyperlinkedRelatedField(serializers.HyperlinkedRelatedField):
+    """
+    HyperlinkedRelatedField using reverse_pk().
+    """
+
+    def get_url(self, obj, view_name, request, format):
+        if self.lookup_field != 'pk':
+            return super(CachedHyperlinkedRelatedField, self).get_url(
+                    obj, view_name, request, format)
+        return reverse_pk(view_name, obj.pk, request, format)
@@ -0,0 +1,139 @@
+"""
+Consistency checks for the materialized path columns of Group.
+
+Nodes are streamed in path order in chunks, so memory use depends on the
+chunk size and tree depth, not on the number of nodes. In path order every
+parent comes before its children, and a stack of open ancestors is enough
+to check parents, depths and child counts in one pass.
+"""
+import re
+from django.db import connection
+from document_index.models import Group
+from document_index.plans import explain_queryset
+from document_index.signals import tree_changed
+from document_index.tree import subtree_range, update_by_value
+
+
+class IntegrityReport(object):
+    """
+    Result of check_tree(). ``problems`` is a list of (group id, message)
+    tuples, ``fixed`` the number of rows repaired.
+    """
+
+    def __init__(self):
+        self.checked = 0
+        self.problems = []
+        self.fixed = 0
+
+    @property
+    def ok(self):
+        return not self.problems
+
+    def add(self, group_id, message, *args):
+        self.problems.append((group_id, message.format(*args)))
+
+
+def iter_nodes(path, chunk_size=1000):
+    """
+    Generate (id, path, depth, numchild) of the subtree at path, all nodes
+    for '', in path order. Each chunk is one keyset query on the path index.
+    """
+    low, high = subtree_range(path)
+    after = {'path__gte': low}
+    while True:
+        rows = list(Group.objects.filter(path__lte=high, **after)
+                .order_by('path')
+                .values_list('id', 'path', 'depth', 'numchild')[:chunk_size])
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        after = {'path__gt': rows[-1][1]}
+
+
+def _fix(fixes, field):
+    """
+    Apply fixes, a dict of correct value to ids, and clear them.
+    """
+    fixed = update_by_value(fixes, field)
+    fixes.clear()
+    return fixed
+
+
+def check_tree(tree_id=None, repair=False, chunk_size=1000):
+    """
+    Check path, depth and numchild of the nodes below the root nodes of a
+    tree, or of all nodes when ``tree_id`` is None. With ``repair`` wrong
+    depth and numchild values are corrected with bulk updates. Bad paths
+    and orphans are only reported. Return an IntegrityReport.
+    """
+    if tree_id is None:
+        paths = ['']
+    else:
+        paths = list(Group.get_root_nodes().filter(
+            tree_id=tree_id).values_list('path', flat=True))
+
+    report = IntegrityReport()
+    fixes = {'depth': {}, 'numchild': {}}
+
+    def close(node):
+        group_id, path, numchild, children = node
+        if numchild != children:
+            report.add(group_id, 'numchild is {0}, has {1} children.',
+                    numchild, children)
+            fixes['numchild'].setdefault(children, []).append(group_id)
+
+    for start in paths:
+        # Open ancestors as [id, path, numchild, children counted].
+        stack = []
+        for group_id, path, depth, numchild in iter_nodes(start, chunk_size):
+            report.checked += 1
+            while stack and not path.startswith(stack[-1][1]):
+                close(stack.pop())
+
+            if not path or len(path) % Group.steplen:
+                report.add(group_id, 'path {0!r} is not a whole number of '
+                        'steps.', path)
+                continue
+            if depth != len(path) // Group.steplen:
+                report.add(group_id, 'depth is {0}, path says {1}.',
+                        depth, len(path) // Group.steplen)
+                fixes['depth'].setdefault(
+                        len(path) // Group.steplen, []).append(group_id)
+
+            parent_path = path[:-Group.steplen]
+            if stack and stack[-1][1] == parent_path:
+                stack[-1][3] += 1
+            elif parent_path and len(path) > len(start):
+                report.add(group_id, 'parent {0!r} does not exist.',
+                        parent_path)
+            stack.append([group_id, path, numchild, 0])
+
+            if repair and report.checked % chunk_size == 0:
+                report.fixed += _fix(fixes['depth'], 'depth')
+                report.fixed += _fix(fixes['numchild'], 'numchild')
+
+        while stack:
+            close(stack.pop())
+
+    if repair:
+        report.fixed += _fix(fixes['depth'], 'depth')
+        report.fixed += _fix(fixes['numchild'], 'numchild')
+        if report.fixed:
+            tree_changed.send(sender=Group)
+    return report
+
+
+def explain_path_query(path=''):
+    """
+    Run EXPLAIN on a subtree range query. Return (uses_index, plan lines).
+    On small tables the planner may rightly prefer a full scan.
+    """
+    lines = explain_queryset(Group.objects.filter(
+        path__range=subtree_range(path)).only('id').order_by('path'))
+    if connection.vendor == 'mysql':
+        uses_index = any(re.search(r"'key': (?!None)", line)
+                for line in lines)
+    else:
+        uses_index = any('index' in line.lower() for line in lines)
+    return uses_index, lines
@@ -0,0 +1,213 @@
+"""
+Background jobs for operations too slow for the request thread.
+
+Jobs are rows of the Job table. Web processes only insert them; the
+run_jobs management command claims pending jobs with a conditional UPDATE,
+so any number of workers can share the table, and runs them in a pool of
+threads. Job functions are registered by name with the task() decorator and
+take JSON serializable arguments.
+
+A failing job is retried after RETRY_DELAY * 2 ** (attempts - 1) seconds
+until it used up its attempts, unless the error was about its arguments,
+which a retry cannot fix. A job is leased to the worker process claiming
+it, which renews the lease of all its running jobs every HEARTBEAT_SECONDS
+however long they take. Jobs of a worker that died are handed out again
+once their lease is STALE_SECONDS old.
+
+With the DOCUMENT_INDEX_JOBS_EAGER setting jobs run inline when submitted,
+e.g. for tests.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from document_index.models import Job
+
+logger = logging.getLogger(__name__)
+
+PENDING, RUNNING, DONE, FAILED = Job.PENDING, Job.RUNNING, Job.DONE, Job.FAILED
+
+RETRY_DELAY = 10
+MAX_RETRY_DELAY = 60 * 60
+STALE_SECONDS = 15 * 60
+HEARTBEAT_SECONDS = 60
+
+# Errors failing a job without retry.
+FATAL_ERRORS = (ValueError, TypeError, KeyError, ObjectDoesNotExist,
+        PermissionDenied)
+
+# Registered job functions by name.
+tasks = {}
+
+_local = threading.local()
+
+
+def task(name):
+    """
+    Decorator registering a function as job ``name``.
+    """
+    def register(func):
+        tasks[name] = func
+        return func
+    return register
+
+
+def get_job(job_id):
+    """
+    Return Job, or None if unknown.
+    """
+    return Job.objects.filter(id=job_id).first()
+
+
+def submit(name, *args, **kwargs):
+    """
+    Queue job ``name`` with positional args. Keyword arguments are
+    ``idempotency_key``, ``owner`` and ``max_attempts``. Return the Job,
+    the existing one if the owner used the key for this job before. Raise
+    ValueError if args are not JSON serializable.
+    """
+    if name not in tasks:
+        raise ValueError('Unknown job {0}.'.format(name))
+    try:
+        encoded_args = json.dumps(list(args))
+    except TypeError:
+        raise ValueError('Arguments of job {0} are not JSON '
+                'serializable.'.format(name))
+    key = kwargs.get('idempotency_key') or None
+    owner = kwargs.get('owner')
+    # Keys are scoped to the owner and job, see Job.Meta.
+    same_key = Job.objects.filter(owner=owner, name=name,
+            idempotency_key=key)
+    if key is not None:
+        job = same_key.first()
+        if job is not None:
+            return job
+
+    job = Job(id=uuid.uuid4().hex, name=name, args=encoded_args,
+            idempotency_key=key, owner=owner,
+            max_attempts=kwargs.get('max_attempts', 3),
+            run_after=timezone.now())
+    try:
+        with transaction.atomic():
+            job.save(force_insert=True)
+    except IntegrityError:
+        if key is None:
+            raise
+        # Submitted concurrently with the same key.
+        return same_key.get()
+
+    if getattr(settings, 'DOCUMENT_INDEX_JOBS_EAGER', False):
+        if claim(job.id):
+            run(job.id)
+        job = Job.objects.get(id=job.id)
+    return job
+
+
+def worker_id():
+    """
+    Return an id for a worker process, unique across hosts and restarts.
+    """
+    return '{0}:{1}:{2}'.format(socket.gethostname()[:40], os.getpid(),
+            uuid.uuid4().hex[:8])
+
+
+def claim(job_id, worker=''):
+    """
+    Mark a pending job as running by worker. Return False if another
+    worker was faster.
+    """
+    now = timezone.now()
+    return Job.objects.filter(id=job_id, status=PENDING,
+            run_after__lte=now).update(status=RUNNING, worker=worker,
+                modified=now) == 1
+
+
+def claim_next(worker=''):
+    """
+    Claim the oldest job that is due. Return its id, or None.
+    """
+    while True:
+        job_id = Job.objects.filter(status=PENDING,
+                run_after__lte=timezone.now()).order_by(
+                    'run_after', 'created').values_list(
+                        'id', flat=True).first()
+        if job_id is None or claim(job_id, worker):
+            return job_id
+
+
+def heartbeat(worker):
+    """
+    Renew the lease of the jobs worker is running. Return their number.
+    """
+    return Job.objects.filter(status=RUNNING, worker=worker).update(
+            modified=timezone.now())
+
+
+def requeue_stale(seconds=STALE_SECONDS):
+    """
+    Hand out again running jobs whose lease was not renewed for seconds.
+    Return number of jobs requeued.
+    """
+    now = timezone.now()
+    return Job.objects.filter(status=RUNNING,
+            modified__lt=now - timedelta(seconds=seconds)).update(
+                status=PENDING, worker='', run_after=now, modified=now)
+
+
+def report_progress(done, total=None):
+    """
+    Record progress of the job running in this thread, if any.
+    """
+    job_id = getattr(_local, 'job_id', None)
+    if job_id is None:
+        return
+    values = {'progress': done, 'modified': timezone.now()}
+    if total is not None:
+        values['total'] = total
+    Job.objects.filter(id=job_id).update(**values)
+
+
+def _retry_delay(attempts):
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def run(job_id, worker=''):
+    """
+    Run a job claimed by worker and record its result, or schedule a retry.
+    Return False if the lease was lost meanwhile, e.g. the job was requeued
+    and claimed by another worker, which then owns the outcome.
+    """
+    job = Job.objects.get(id=job_id)
+    attempts = job.attempts + 1
+    Job.objects.filter(id=job_id).update(attempts=attempts)
+    leased = Job.objects.filter(id=job_id, status=RUNNING, worker=worker)
+    _local.job_id = job_id
+    try:
+        result = tasks[job.name](*json.loads(job.args))
+    except Exception as e:
+        logger.exception('Job %s %s failed.', job.name, job_id)
+        now = timezone.now()
+        if (attempts < job.max_attempts and
+                not isinstance(e, FATAL_ERRORS)):
+            updated = leased.update(status=PENDING, error=str(e),
+                run_after=now + timedelta(seconds=_retry_delay(attempts)),
+                modified=now)
+        else:
+            updated = leased.update(status=FAILED, error=str(e),
+                modified=now)
+    else:
+        updated = leased.update(status=DONE, result=json.dumps(result),
+                error='', modified=timezone.now())
+    finally:
+        _local.job_id = None
+    if not updated:
+        logger.warning('Job %s %s lost its lease, outcome discarded.',
+                job.name, job_id)
+    return updated == 1
@@ -0,0 +1,40 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from document_index.integrity import check_tree, explain_path_query
+from document_index.models import GroupTreeList
+
+
+class Command(BaseCommand):
+    help = 'Check Group path, depth and numchild columns for consistency.'
+    option_list = BaseCommand.option_list + (
+        make_option('--tree', action='store', dest='tree', type='int',
+            default=None, help='Only check the tree with this id.'),
+        make_option('--repair', action='store_true', dest='repair',
+            default=False, help='Fix wrong depth and numchild values.'),
+        make_option('--chunk-size', action='store', dest='chunk_size',
+            type='int', default=1000, help='Nodes read per query.'),
+        make_option('--explain', action='store_true', dest='explain',
+            default=False, help='Check that path queries use an index.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['tree'] is not None and not GroupTreeList.objects.filter(
+                id=options['tree']).exists():
+            raise CommandError('Unknown tree {0}.'.format(options['tree']))
+
+        report = check_tree(options['tree'], repair=options['repair'],
+                chunk_size=options['chunk_size'])
+        for group_id, message in report.problems:
+            self.stdout.write('Group {0}: {1}'.format(group_id, message))
+        self.stdout.write('{0} node(s) checked, {1} problem(s), '
+                '{2} fixed.'.format(report.checked, len(report.problems),
+                    report.fixed))
+
+        if options['explain']:
+            uses_index, plan = explain_path_query()
+            for line in plan:
+                self.stdout.write(line)
+            if uses_index:
+                self.stdout.write('Path queries use an index.')
+            else:
+                self.stdout.write('Path queries do not use an index.')
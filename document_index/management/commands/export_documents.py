@@ -0,0 +1,66 @@
+import sys
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from document_index import export
+from document_index.models import Group
+
+
+class Command(BaseCommand):
+    help = 'Export documents with their sources as NDJSON or CSV.'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', action='store', dest='format',
+            default=export.NDJSON, choices=list(export.CONTENT_TYPES),
+            help='ndjson (default) or csv.'),
+        make_option('--gzip', action='store_true', dest='gzip',
+            default=False, help='Compress the output.'),
+        make_option('--group', action='store', dest='group', type='int',
+            default=None, help='Only export the subtree below this group.'),
+        make_option('--modified-after', action='store',
+            dest='modified_after', default=None,
+            help='Only export documents modified at or after this time.'),
+        make_option('--modified-before', action='store',
+            dest='modified_before', default=None,
+            help='Only export documents modified before this time.'),
+        make_option('--chunk-size', action='store', dest='chunk_size',
+            type='int', default=export.CHUNK_SIZE,
+            help='Documents read per query, at most {0}.'.format(
+                export.CHUNK_SIZE)),
+        make_option('--output', action='store', dest='output', default=None,
+            help='Output file. Default: standard output.'),
+    )
+
+    def handle(self, *args, **options):
+        if not 0 < options['chunk_size'] <= export.CHUNK_SIZE:
+            # The ids of a chunk are one IN list, see export.CHUNK_SIZE.
+            raise CommandError('Chunk size must be between 1 and {0}.'.format(
+                export.CHUNK_SIZE))
+        kwargs = {'chunk_size': options['chunk_size']}
+        if options['group'] is not None:
+            try:
+                kwargs['group'] = Group.objects.get(id=options['group'])
+            except Group.DoesNotExist:
+                raise CommandError('Unknown group {0}.'.format(
+                    options['group']))
+        for option in ('modified_after', 'modified_before'):
+            if options[option]:
+                try:
+                    kwargs[option] = parse_datetime(options[option])
+                except ValueError:
+                    # Well formed, but out of range.
+                    kwargs[option] = None
+                if kwargs[option] is None:
+                    raise CommandError('Invalid datetime {0}.'.format(
+                        options[option]))
+
+        output = open(options['output'], 'wb') if options['output'] else \
+                getattr(sys.stdout, 'buffer', sys.stdout)
+        try:
+            for data in export.export_documents(options['format'],
+                    options['gzip'], **kwargs):
+                if not isinstance(data, bytes):
+                    data = data.encode('utf-8')
+                output.write(data)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,41 @@
+import sys
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from document_index.bulk import iter_tree_json
+from document_index.models import Group
+
+
+class Command(BaseCommand):
+    help = 'Export group trees as nested JSON.'
+    option_list = BaseCommand.option_list + (
+        make_option('--tree', action='store', dest='tree', type='int',
+            default=None, help='Export the tree with this id.'),
+        make_option('--parent', action='store', dest='parent', type='int',
+            default=None, help='Export the subtrees below this group.'),
+        make_option('--output', action='store', dest='output', default=None,
+            help='Output file. Default: standard output.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['parent'] is not None:
+            try:
+                queryset = Group.objects.get(
+                        id=options['parent']).get_children()
+            except Group.DoesNotExist:
+                raise CommandError('Unknown parent group {0}.'.format(
+                    options['parent']))
+        elif options['tree'] is not None:
+            queryset = Group.get_root_nodes().filter(tree_id=options['tree'])
+        else:
+            queryset = Group.get_root_nodes()
+        paths = list(queryset.values_list('path', flat=True))
+
+        output = open(options['output'], 'w') if options['output'] else \
+                sys.stdout
+        try:
+            for chunk in iter_tree_json(paths):
+                output.write(chunk)
+            output.write('\n')
+        finally:
+            if options['output']:
+                output.close()
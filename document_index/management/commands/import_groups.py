@@ -0,0 +1,52 @@
+import json
+from optparse import make_option
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from document_index.bulk import count_nodes, load_tree, validate_tree
+from document_index.models import GroupTreeList, Group
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = 'Import a nested JSON group tree in a single transaction.'
+    option_list = BaseCommand.option_list + (
+        make_option('--user', action='store', dest='user',
+            help='Username owning the imported groups.'),
+        make_option('--parent', action='store', dest='parent', type='int',
+            default=0, help='Id of the parent group. Default: root nodes.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Give exactly one file to import.')
+        try:
+            owner = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('Unknown user {0}.'.format(options['user']))
+
+        parent = None
+        if options['parent']:
+            try:
+                parent = Group.objects.get(id=options['parent'])
+            except Group.DoesNotExist:
+                raise CommandError('Unknown parent group {0}.'.format(
+                    options['parent']))
+
+        with open(args[0]) as f:
+            try:
+                data = json.load(f)
+            except ValueError as e:
+                raise CommandError('Invalid JSON: {0}'.format(e))
+
+        errors = validate_tree(data)
+        if errors:
+            raise CommandError('\n'.join(errors))
+
+        if parent is not None:
+            # Nodes belong to the tree of their parent.
+            tree_id = parent.tree_id
+        else:
+            tree_id = GroupTreeList.objects.get_or_create(
+                    name=owner.username)[0].id
+        load_tree(data, owner, tree_id, parent)
+        self.stdout.write('{0} group(s) imported.'.format(count_nodes(data)))
@@ -0,0 +1,16 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from document_index.blobs import prune
+
+
+class Command(BaseCommand):
+    help = 'Delete stored files no source refers to.'
+    option_list = BaseCommand.option_list + (
+        make_option('--hours', action='store', dest='hours', type='int',
+            default=1, help='Keep files stored in the last hours '
+            '(default 1).'),
+    )
+
+    def handle(self, *args, **options):
+        deleted = prune(options['hours'])
+        self.stdout.write('{0} file(s) deleted.'.format(deleted))
@@ -0,0 +1,15 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from document_index.changes import prune
+
+
+class Command(BaseCommand):
+    help = 'Delete change feed entries older than a number of days.'
+    option_list = BaseCommand.option_list + (
+        make_option('--days', action='store', dest='days', type='int',
+            default=30, help='Keep changes of this many days (default 30).'),
+    )
+
+    def handle(self, *args, **options):
+        deleted = prune(options['days'])
+        self.stdout.write('{0} change(s) deleted.'.format(deleted))
@@ -0,0 +1,20 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from document_index.models import Group
+from document_index.signals import tree_changed
+from document_index.tree import rebuild_numchild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized Group.numchild column from actual counts.'
+    option_list = BaseCommand.option_list + (
+        make_option('--tree', action='store', dest='tree', type='int',
+            default=None, help='Only check the tree with this id.'),
+    )
+
+    def handle(self, *args, **options):
+        fixed = rebuild_numchild(options['tree'])
+        if fixed:
+            # Rows were updated without model signals.
+            tree_changed.send(sender=Group)
+        self.stdout.write('{0} node(s) fixed.'.format(fixed))
@@ -0,0 +1,16 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from document_index.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the document search index.'
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', action='store', dest='chunk_size',
+            type='int', default=500,
+            help='Number of documents indexed per batch.'),
+    )
+
+    def handle(self, *args, **options):
+        count = rebuild_index(options['chunk_size'])
+        self.stdout.write('{0} document(s) indexed.'.format(count))
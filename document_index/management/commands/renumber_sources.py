@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max
+from document_index.models import Document
+from document_index.sequences import renumber
+
+
+class Command(BaseCommand):
+    help = ('Number the sources of every document 1..n again, e.g. before '
+            'adding the unique (document, sequence) index to old tables.')
+
+    def handle(self, *args, **options):
+        documents = Document.objects.annotate(count=Count('sources'),
+                distinct=Count('sources__sequence', distinct=True),
+                last=Max('sources__sequence')).values_list(
+                    'document_id', 'count', 'distinct', 'last',
+                    'source_count')
+        fixed = 0
+        for document_id, count, distinct, last, source_count in documents:
+            # Gap free numbering has n distinct numbers, the last being n.
+            if distinct != count or (last or 0) != count or \
+                    source_count != count:
+                renumber(document_id)
+                fixed += 1
+        self.stdout.write('{0} document(s) renumbered.'.format(fixed))
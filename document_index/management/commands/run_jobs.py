@@ -0,0 +1,65 @@
+import threading
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db import connection
+from document_index import jobs
+# Registers the job functions.
+from document_index import tasks
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs in a pool of worker threads.'
+    option_list = BaseCommand.option_list + (
+        make_option('--threads', action='store', dest='threads', type='int',
+            default=4, help='Number of worker threads (default 4).'),
+        make_option('--poll-interval', action='store', dest='poll_interval',
+            type='float', default=1.0,
+            help='Seconds to wait when no job is due (default 1).'),
+        make_option('--once', action='store_true', dest='once',
+            default=False, help='Exit when no job is due.'),
+    )
+
+    def work(self, worker, stop, once, poll_interval):
+        try:
+            while not stop.is_set():
+                job_id = jobs.claim_next(worker)
+                if job_id is not None:
+                    jobs.run(job_id, worker)
+                elif once:
+                    return
+                else:
+                    stop.wait(poll_interval)
+        finally:
+            # Every thread has its own connection.
+            connection.close()
+
+    def handle(self, *args, **options):
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write('{0} stale job(s) requeued.'.format(requeued))
+
+        worker = jobs.worker_id()
+        stop = threading.Event()
+        threads = [threading.Thread(target=self.work, args=(worker, stop,
+            options['once'], options['poll_interval']))
+            for _ in range(max(options['threads'], 1))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        beat = time.time()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                # Joining with a timeout keeps Ctrl-C working.
+                for thread in threads:
+                    thread.join(1)
+                # Long jobs report rarely or never, renew their lease here.
+                if time.time() - beat >= jobs.HEARTBEAT_SECONDS:
+                    jobs.heartbeat(worker)
+                    beat = time.time()
+                if not options['once']:
+                    jobs.requeue_stale()
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
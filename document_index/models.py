@@ -1,10 +1,12 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 from treebeard.mp_tree import MP_Node
 
 
 class GroupTreeList(models.Model):
     id = models.AutoField(primary_key=True)
-    name = models.CharField(max_length=50)
+    # Looked up by username on every tree request.
+    name = models.CharField(max_length=50, db_index=True)
     description = models.CharField(max_length=255)
     created = models.DateTimeField('Date Created', auto_now_add=True)
     modified = models.DateTimeField('Date Last Modified', auto_now=True)
@@ -26,6 +28,10 @@ class Group(MP_Node):
     created = models.DateTimeField('Date Created', auto_now_add=True)
     modified = models.DateTimeField('Date Last Modified', auto_now=True)
 
+    class Meta:
+        # Root nodes and subtrees of one tree.
+        index_together = (('tree', 'path'),)
+
     def __unicode__(self):
         return self.name
 
@@ -51,13 +57,32 @@ class Document(models.Model):
     name = models.CharField(max_length=200)
     description = models.CharField(max_length=1024)
     created = models.DateTimeField('date created', auto_now_add=True)
-    modified = models.DateTimeField('date last modified', auto_now=True)
+    modified = models.DateTimeField('date last modified', auto_now=True,
+            db_index=True)
     source_count = models.IntegerField(default=0)
     comment = models.CharField(max_length=1024)
 
+    class Meta:
+        # Documents of a group in the default list ordering, and all
+        # documents in keyset order, ``created`` then ``document_id``.
+        index_together = (('group', 'created'), ('created', 'document_id'))
+
     def __unicode__(self):
         return self.name
 
+    @classmethod
+    def allocate_sequences(cls, document_id, count=1):
+        """
+        Reserve count source sequence numbers of a document. Return the
+        first. ``source_count`` is the counter. Incrementing it in the
+        database locks the row, so concurrent callers wait for each other
+        until the transaction ends. Must run inside a transaction.
+        """
+        cls.objects.filter(pk=document_id).update(
+                source_count=models.F('source_count') + count)
+        return cls.objects.values_list('source_count', flat=True).get(
+                pk=document_id) - count + 1
+
 # Vainly commenting this so my test coverage is better since this is not yet
 # implemented.
 #   def save(self, *args, **kwargs):
@@ -67,32 +92,193 @@ class Document(models.Model):
 #       return self.group_id
 
 
+class Blob(models.Model):
+    """
+    File content in the blob store, see blobs.py. Stored once per content
+    and shared by all sources with identical files.
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    created = models.DateTimeField('date created', auto_now_add=True)
+
+    def __unicode__(self):
+        return self.sha256
+
+
 class Source(models.Model):
     source_id = models.AutoField(primary_key=True)
     document = models.ForeignKey(Document, related_name='sources')
     name = models.CharField(max_length=200)
     description = models.CharField(max_length=1024)
-    sequence = models.IntegerField(default=1)
+    # Numbered 1..n per document, see sequences.py.
+    sequence = models.IntegerField(blank=True)
     filename = models.CharField(max_length=1024)
     mime_type = models.CharField(max_length=50)
     comment = models.CharField(max_length=1024)
+    blob = models.ForeignKey(Blob, null=True, blank=True,
+            related_name='sources', on_delete=models.PROTECT)
     created = models.DateTimeField('date created', auto_now_add=True)
     modified = models.DateTimeField('date last modified', auto_now=True)
 
     class Meta:
-        unique_together = (('source_id', 'sequence'),)
+        unique_together = (('document', 'sequence'),)
 
     def __unicode__(self):
         return self.name
 
-# Vainly commenting this so my test coverage is better since this is not yet
-# implemented.
-#   def save(self, *args, **kwargs):
-#       sequence = Source.objects.filter(
-#           document_id= \
-#           self.document_id).aggregate(models.Max('source_id'))['source_id__max']
-#       if (not sequence):
-#           self.sequence = 1
-#       else:
-#           self.sequence = sequence + 1
-#       super(Source, self).save(*args, **kwargs)
+    def _check_gap(self, source_count):
+        if source_count and self.sequence > source_count[0] + 1:
+            raise ValidationError({'sequence': ['Sequence {0} would leave a '
+                'gap after {1} sources.'.format(self.sequence,
+                    source_count[0])]})
+
+    def clean(self):
+        """
+        Reject an explicit sequence of a new source that would leave a gap,
+        so forms and serializers report it like any invalid field.
+        """
+        if self.pk is None and self.sequence is not None:
+            self._check_gap(Document.objects.filter(
+                pk=self.document_id).values_list('source_count', flat=True))
+
+    def save(self, *args, **kwargs):
+        """
+        Number new sources after the last source of their document. A
+        sequence given explicitly must be the next one, as a later one would
+        leave a gap, and an earlier one is taken. Raise ValidationError for a
+        later one.
+        """
+        if self.pk is not None:
+            return super(Source, self).save(*args, **kwargs)
+        with transaction.atomic():
+            if self.sequence is None:
+                self.sequence = Document.allocate_sequences(
+                        self.document_id)
+            elif not Document.objects.filter(pk=self.document_id,
+                    source_count=self.sequence - 1).update(
+                        source_count=models.F('source_count') + 1):
+                self._check_gap(Document.objects.filter(
+                    pk=self.document_id).values_list('source_count',
+                        flat=True))
+            super(Source, self).save(*args, **kwargs)
+
+
+class SearchTerm(models.Model):
+    """
+    Inverted search index. One row per term and document with the summed
+    weight of the fields the term appears in. Terms from sources are indexed
+    under their document.
+    """
+    term = models.CharField(max_length=64)
+    document = models.ForeignKey(Document, related_name='search_terms')
+    weight = models.IntegerField(default=1)
+
+    class Meta:
+        unique_together = (('term', 'document'),)
+
+    def __unicode__(self):
+        return self.term
+
+
+class GroupACL(models.Model):
+    """
+    Access granted on a group and everything below it, to a user or to all
+    members of a team (a Django auth group).
+    """
+    group = models.ForeignKey(Group, related_name='acls')
+    user = models.ForeignKey('auth.User', null=True, blank=True,
+            related_name='group_acls')
+    team = models.ForeignKey('auth.Group', null=True, blank=True,
+            related_name='group_acls')
+    can_write = models.BooleanField(default=False)
+    created = models.DateTimeField('Date Created', auto_now_add=True)
+
+    def __unicode__(self):
+        return '{0} on {1}'.format(self.user or self.team, self.group)
+
+
+class Job(models.Model):
+    """
+    Background job run by the run_jobs worker. Arguments and result are
+    stored as JSON. Failed attempts are retried after a growing delay until
+    max_attempts is reached. Jobs submitted again by the same owner with the
+    same name and idempotency key return the existing job.
+    """
+    PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    id = models.CharField(max_length=32, primary_key=True)
+    name = models.CharField(max_length=64)
+    args = models.TextField(default='[]')
+    status = models.CharField(max_length=8, choices=STATUSES,
+            default=PENDING, db_index=True)
+    idempotency_key = models.CharField(max_length=64, null=True,
+            blank=True)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(db_index=True)
+    # Worker process running the job, see jobs.heartbeat().
+    worker = models.CharField(max_length=64, blank=True)
+    progress = models.IntegerField(default=0)
+    total = models.IntegerField(null=True, blank=True)
+    result = models.TextField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    owner = models.ForeignKey('auth.User', null=True, blank=True,
+            related_name='jobs')
+    created = models.DateTimeField('Date Created', auto_now_add=True)
+    modified = models.DateTimeField('Date Last Modified', auto_now=True)
+
+    class Meta:
+        # Keys are chosen by clients and only unique per user and job.
+        unique_together = (('owner', 'name', 'idempotency_key'),)
+
+    def __unicode__(self):
+        return '{0} {1}'.format(self.name, self.id)
+
+
+class ChangeLog(models.Model):
+    """
+    Log of inserts, updates, deletes and moves of groups, documents and
+    sources, in the order they were written. Read by sync clients through
+    the change feed in the order of ``position``, given once the writing
+    transaction committed, see changes.py.
+    """
+    INSERT, UPDATE, DELETE, MOVE = 'insert', 'update', 'delete', 'move'
+    ACTIONS = (
+        (INSERT, 'Insert'),
+        (UPDATE, 'Update'),
+        (DELETE, 'Delete'),
+        (MOVE, 'Move'),
+    )
+
+    id = models.AutoField(primary_key=True)
+    model = models.CharField(max_length=16)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=8, choices=ACTIONS)
+    created = models.DateTimeField('Date Created', auto_now_add=True,
+            db_index=True)
+    position = models.IntegerField(null=True, blank=True, unique=True)
+
+    def __unicode__(self):
+        return '{0} {1} {2}'.format(self.action, self.model, self.object_id)
+
+
+class ChangeWatermark(models.Model):
+    """
+    Single row holding the last change feed position handed out. Its row
+    lock serializes publishing, see changes.publish().
+    """
+    id = models.IntegerField(primary_key=True)
+    position = models.IntegerField(default=0)
+
+    def __unicode__(self):
+        return str(self.position)
+
+
+# Connect signal handlers once models are defined.
+from document_index import signals
@@ -0,0 +1,191 @@
+"""
+Atomic moves and deletes of group subtrees.
+
+treebeard's move() runs outside a transaction and reads sibling positions
+without locking, so two concurrent moves into the same parent can hand out
+the same path. Here the rows involved are locked first, positions are read
+again under the lock, and every subtree is rewritten with one UPDATE of
+its path range. Deletes likewise remove a subtree with one DELETE.
+"""
+from django.db import connection, transaction
+from django.db.models import F
+from document_index import changes
+from document_index.models import Group, Document, GroupACL, ChangeLog
+from document_index.signals import tree_changed
+from document_index.tree import subtree_range
+
+
+class MoveError(ValueError):
+    pass
+
+
+class DeleteError(ValueError):
+    pass
+
+
+def _step(path):
+    return Group._str2int(path[-Group.steplen:])
+
+
+def _newpath_sql():
+    vendor = Group.get_database_vendor('write')
+    if vendor == 'mysql':
+        newpath = 'CONCAT(%s, SUBSTR(path, %s))'
+    elif vendor == 'sqlite':
+        # sqlite wants the length argument.
+        newpath = '%s || SUBSTR(path, %s, LENGTH(path))'
+    else:
+        newpath = '%s || SUBSTR(path, %s)'
+    return ('UPDATE {0} SET path = {1}, depth = depth + %s '
+            'WHERE path BETWEEN %s AND %s').format(
+                connection.ops.quote_name(Group._meta.db_table), newpath)
+
+
+def move_branch(oldpath, newpath):
+    """
+    Rewrite the subtree at ``oldpath`` to ``newpath`` with one UPDATE.
+    Return number of nodes moved.
+    """
+    low, high = subtree_range(oldpath)
+    cursor = connection.cursor()
+    cursor.execute(_newpath_sql(), [newpath, len(oldpath) + 1,
+        (len(newpath) - len(oldpath)) // Group.steplen, low, high])
+    return cursor.rowcount
+
+
+def _lock(paths):
+    """
+    Lock the subtrees at paths, in path order so that concurrent moves
+    lock rows in the same order.
+    """
+    query = Group.objects.select_for_update()
+    for path in sorted(paths):
+        list(query.filter(path__range=subtree_range(path)).order_by(
+            'path').values_list('id', flat=True))
+
+
+def _sibling_step(node, parent_path, depth):
+    """
+    Return step for node among the children of parent_path in name order.
+    Siblings in the way are shifted right, last first, unless there is a
+    gap to use.
+    """
+    siblings = Group.objects.filter(path__range=subtree_range(parent_path),
+            depth=depth).order_by('path')
+    # Compared in the database, like treebeard's sorted inserts.
+    after = list(siblings.filter(name__gt=node.name).values_list(
+        'path', flat=True))
+    before = siblings.filter(name__lte=node.name).order_by(
+            '-path').values_list('path', flat=True)[:1]
+    previous = _step(before[0]) if before else 0
+    if not after:
+        return previous + 1
+
+    step = _step(after[0])
+    if step - previous > 1:
+        return step - 1
+
+    shift = []
+    for path in after:
+        if _step(path) != step + len(shift):
+            break
+        shift.append(path)
+    for path in reversed(shift):
+        newpath = Group._get_path(path, depth, _step(path) + 1)
+        if len(newpath) != len(path):
+            raise MoveError('No room for another child below the group.')
+        move_branch(path, newpath)
+    return step
+
+
+def move_node(node_id, parent_id):
+    """
+    Move a group with its subtree to be a sorted child of the group
+    ``parent_id``, or a root node when it is 0. Must run inside a
+    transaction. Return the moved node and number of descendants.
+    """
+    node = Group.objects.get(id=node_id)
+    parent = Group.objects.get(id=parent_id) if parent_id else None
+    # Everything at or below the new parent may be shifted.
+    _lock([node.path, parent.path if parent else ''])
+
+    # Positions may have changed while waiting for the lock.
+    node = Group.objects.get(id=node_id)
+    if parent is not None:
+        parent = Group.objects.get(id=parent_id)
+        if parent.path.startswith(node.path):
+            raise MoveError('Cannot move a group below itself.')
+    parent_path = parent.path if parent else ''
+    depth = parent.depth + 1 if parent else 1
+
+    if node.path[:-Group.steplen] == parent_path:
+        # Already a sorted child of the parent.
+        return node, Group.objects.filter(
+            path__range=subtree_range(node.path)).count() - 1
+
+    step = _sibling_step(node, parent_path, depth)
+    # Shifting siblings may have moved the node, or its parent, too.
+    oldpath = Group.objects.values_list('path', flat=True).get(id=node_id)
+    moved = move_branch(oldpath, Group._get_path(parent_path, depth, step))
+
+    old_parent_path = oldpath[:-Group.steplen]
+    if old_parent_path:
+        Group.objects.filter(path=old_parent_path).update(
+                numchild=F('numchild') - 1)
+    if parent is not None:
+        Group.objects.filter(id=parent.id).update(numchild=F('numchild') + 1)
+    # Descendants keep their parent, only the node itself is reported.
+    changes.record('group', node_id, ChangeLog.MOVE)
+    return Group.objects.get(id=node_id), moved - 1
+
+
+def move_nodes(node_ids, parent_id):
+    """
+    Move groups in one transaction. Return list of (node, descendants)
+    tuples in the order given.
+    """
+    with transaction.atomic():
+        moved = [move_node(node_id, parent_id) for node_id in node_ids]
+    tree_changed.send(sender=Group)
+    return moved
+
+
+def has_documents(path):
+    """
+    Return True if the group at path or any descendant holds documents.
+    """
+    return Document.objects.filter(
+            group__path__range=subtree_range(path)).exists()
+
+
+def delete_subtree(group_id):
+    """
+    Delete a group with all of its descendants in one DELETE statement.
+    Refuse if any of them holds documents. Return number of groups deleted.
+    """
+    with transaction.atomic():
+        path = Group.objects.values_list('path', flat=True).get(id=group_id)
+        _lock([path])
+        # The group may have moved while waiting for the lock.
+        path = Group.objects.values_list('path', flat=True).get(id=group_id)
+        if has_documents(path):
+            raise DeleteError('Group or its descendants have documents.')
+
+        low, high = subtree_range(path)
+        changes.record_query('group', Group.objects.filter(
+            path__range=(low, high)).order_by('path'), ChangeLog.DELETE)
+        # The raw DELETE does not cascade. Deleting the grants through the
+        # ORM sends post_delete, which bumps the ACL version and so
+        # invalidates cached access prefixes.
+        GroupACL.objects.filter(group__path__range=(low, high)).delete()
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM {0} WHERE path BETWEEN %s AND %s'.format(
+            connection.ops.quote_name(Group._meta.db_table)), [low, high])
+        deleted = cursor.rowcount
+
+        parent_path = path[:-Group.steplen]
+        if parent_path:
+            Group.objects.filter(path=parent_path).update(
+                    numchild=F('numchild') - 1)
+    tree_changed.send(sender=Group)
+    return deleted
@@ -0,0 +1,142 @@
+"""
+Keyset (cursor) pagination for list views.
+
+Page number pagination costs an OFFSET scan proportional to the page number
+plus a COUNT(*) for every page. Keyset pagination instead filters on the
+ordering key of the last row seen, so every page costs the same.
+"""
+import base64
+import json
+from django.db.models import Q
+from django.utils.datastructures import SortedDict
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+from rest_framework.templatetags.rest_framework import replace_query_param
+
+
+def encode_cursor(values):
+    """
+    Return opaque token for a list of string values.
+    """
+    return base64.urlsafe_b64encode(
+            json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token):
+    """
+    Return list of values encoded by encode_cursor(). Raise ValueError on
+    malformed tokens.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(
+            token.encode('ascii')).decode('utf-8'))
+    except (TypeError, UnicodeError, ValueError):
+        raise ValueError('Invalid cursor.')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor.')
+    return values
+
+
+def keyset_filter(queryset, fields, values):
+    """
+    Return queryset ordered by ``fields`` and restricted to rows after the
+    row with key ``values``. ``values`` are strings as produced by
+    keyset_values(), or field values.
+    """
+    queryset = queryset.order_by(*fields)
+    if not values:
+        return queryset
+    if len(values) != len(fields):
+        raise ValueError('Invalid cursor.')
+
+    opts = queryset.model._meta
+    try:
+        values = [opts.get_field(field).to_python(value)
+                for field, value in zip(fields, values)]
+    except Exception:
+        raise ValueError('Invalid cursor.')
+
+    # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+    query = None
+    for i, field in enumerate(fields):
+        lookups = dict(zip(fields[:i], values[:i]))
+        lookups[field + '__gt'] = values[i]
+        query = Q(**lookups) if query is None else query | Q(**lookups)
+    return queryset.filter(query)
+
+
+def iter_keyset_chunks(queryset, fields, key, chunk_size=500):
+    """
+    Generate lists of up to chunk_size rows of a queryset ordered by
+    ``fields``, one LIMIT query per list, so a long result is never fetched
+    as a whole. ``key`` returns the values of ``fields`` for a row.
+    """
+    values = []
+    while True:
+        rows = list(keyset_filter(queryset, fields, values)[:chunk_size])
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        values = key(rows[-1])
+
+
+def keyset_values(obj, fields, opts=None):
+    """
+    Return the key of ``obj`` as strings suitable for a cursor. ``obj`` may
+    be any object with the field attnames as attributes if the model
+    ``opts`` are given.
+    """
+    opts = opts or obj._meta
+    return [opts.get_field(field).value_to_string(obj) for field in fields]
+
+
+class KeysetPaginationMixin(object):
+    """
+    Opt-in keyset pagination for generic list views.
+
+    Clients ask for it with ``?cursor=`` (empty for the first page) and
+    follow the ``next`` link until it is null. No COUNT query is run. The
+    view must set ``keyset_fields`` to a unique ordering key.
+    """
+    keyset_fields = None
+    cursor_param = 'cursor'
+    cursor_page_size = 50
+
+    def get_rows(self, queryset):
+        """
+        Return list of the rows of a page.
+        """
+        return list(queryset)
+
+    def serialize_rows(self, rows):
+        return self.get_serializer(rows, many=True).data
+
+    def list(self, request, *args, **kwargs):
+        if self.cursor_param not in request.QUERY_PARAMS:
+            return super(KeysetPaginationMixin, self).list(
+                    request, *args, **kwargs)
+
+        token = request.QUERY_PARAMS[self.cursor_param]
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            values = decode_cursor(token) if token else []
+            queryset = keyset_filter(queryset, self.keyset_fields, values)
+        except ValueError as e:
+            raise ParseError(str(e))
+
+        page_size = self.get_paginate_by() or self.cursor_page_size
+        # One extra row tells whether there is a next page.
+        self.object_list = self.get_rows(queryset[:page_size + 1])
+        next_url = None
+        if len(self.object_list) > page_size:
+            self.object_list = self.object_list[:page_size]
+            next_url = replace_query_param(request.build_absolute_uri(),
+                    self.cursor_param, encode_cursor(keyset_values(
+                        self.object_list[-1], self.keyset_fields,
+                        queryset.model._meta)))
+
+        return Response(SortedDict([
+            ('next', next_url),
+            ('results', self.serialize_rows(self.object_list)),
+        ]))
@@ -0,0 +1,44 @@
+"""
+Request parsers for document_index.
+"""
+import json
+from django.conf import settings
+from rest_framework.parsers import BaseParser
+
+
+class InvalidLine(object):
+    """
+    Placeholder for an NDJSON line that could not be parsed. Lets bulk
+    endpoints report the line as a failed row instead of rejecting the
+    whole request.
+    """
+
+    def __init__(self, message):
+        self.message = message
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline delimited JSON into a list with one item per non-blank
+    line.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        rows = []
+        for line in stream:
+            try:
+                line = line.decode(encoding).strip()
+            except UnicodeDecodeError as e:
+                rows.append(InvalidLine('Encoding error - {0}'.format(e)))
+                continue
+            if not line:
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError as e:
+                rows.append(InvalidLine('JSON parse error - {0}'.format(e)))
+        return rows
@@ -1,10 +1,39 @@
-from rest_framework import permissions
+from rest_framework import filters, permissions
+from document_index.access import READ, WRITE, filter_access, has_access
 
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
+    """
+    Anyone may read. Writes need ownership of the object, or write access to
+    its group or an ancestor through a GroupACL.
+    """
 
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        return obj.owner == request.user
+        # Compare ids where possible. Loading the owner costs a query.
+        owner_id = getattr(obj, 'owner_id', None)
+        if owner_id is not None:
+            if owner_id == request.user.pk:
+                return True
+        elif obj.owner == request.user:
+            return True
+
+        path = getattr(obj, 'path', None)
+        return path is not None and has_access(request.user, path, WRITE)
+
+
+class GroupAccessFilter(filters.BaseFilterBackend):
+    """
+    With ``access=read`` or ``access=write`` restrict the queryset to groups
+    the user owns or that are shared with them, and everything below. Views
+    listing rows of groups set ``access_lookup_prefix``, e.g. 'group__'.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        access = request.QUERY_PARAMS.get('access')
+        if access not in (READ, WRITE):
+            return queryset
+        return filter_access(queryset, request.user, access,
+                getattr(view, 'access_lookup_prefix', ''))
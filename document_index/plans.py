@@ -0,0 +1,74 @@
+"""
+Query plan inspection, to catch queries that read a whole table.
+
+explain() returns the plan of a statement as lines for the database in use.
+full_scans() lists the tables a statement scans without an index on SQLite,
+whose planner does not use table statistics unless ANALYZE was run, so the
+result does not depend on the amount of test data.
+"""
+import re
+from django.db import connection
+
+SQLITE_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\S+)(.*)$')
+
+
+def explain(sql, params=()):
+    """
+    Return list of plan lines of a statement.
+    """
+    cursor = connection.cursor()
+    if connection.vendor == 'sqlite':
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+    cursor.execute('EXPLAIN ' + sql, params)
+    if connection.vendor == 'mysql':
+        columns = [column[0] for column in cursor.description]
+        return [repr(dict(zip(columns, row))) for row in cursor.fetchall()]
+    return [row[0] for row in cursor.fetchall()]
+
+
+def explain_queryset(queryset):
+    sql, params = queryset.query.sql_with_params()
+    return explain(sql, params)
+
+
+def full_scans(sql, params=()):
+    """
+    Return names of tables a statement scans without using an index. SQLite
+    only.
+    """
+    tables = []
+    for line in explain(sql, params):
+        match = SQLITE_SCAN_RE.match(line.strip())
+        if match and 'INDEX' not in match.group(2):
+            tables.append(match.group(1).strip('"'))
+    return tables
+
+
+class CaptureQueries(object):
+    """
+    Context manager collecting (sql, params) of the statements executed on
+    the default connection, with placeholders, so they can be explained.
+    """
+
+    def __enter__(self):
+        self.queries = []
+        self.use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        ops = connection.ops
+        last_executed_query = ops.last_executed_query
+
+        def record(cursor, sql, params):
+            self.queries.append((sql, tuple(params or ())))
+            return last_executed_query(cursor, sql, params)
+        # The debug cursor calls this with the raw statement of every query.
+        ops.last_executed_query = record
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        del connection.ops.last_executed_query
+        connection.use_debug_cursor = self.use_debug_cursor
+
+    def selects(self):
+        return [(sql, params) for sql, params in self.queries
+                if sql.lstrip().upper().startswith('SELECT')]
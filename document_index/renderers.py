@@ -0,0 +1,144 @@
+"""
+JSON rendering with the fastest encoder installed.
+
+FastJSONRenderer encodes with ujson when a version taking ``default`` is
+installed and falls back to DRF's JSONRenderer otherwise, for indented
+output, e.g. the browsable API, and for data ujson cannot handle.
+Datetimes, decimals and other types JSON lacks are converted by DRF's
+encoder in every case, so only whitespace and the escaping of non-ASCII
+characters differ between backends. DOCUMENT_INDEX_JSON_BACKEND selects
+'ujson' or 'json' instead of the best one installed. A backend that is
+selected but not installed raises ImproperlyConfigured on import.
+
+StreamingJSONResponse writes a JSON array from a generator in chunks, so
+large listings are never held in memory as a whole.
+"""
+import json
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import StreamingHttpResponse
+from django.utils import six
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import ujson
+    # Versions without ``default`` turn unknown objects into nonsense.
+    ujson.dumps(None, default=None)
+except (ImportError, TypeError):
+    ujson = None
+
+UJSON, JSON = 'ujson', 'json'
+
+BUFFER_SIZE = 64 * 1024
+
+_default = JSONEncoder().default
+
+
+def _ujson_dumps(data):
+    data = ujson.dumps(data, default=_default, ensure_ascii=False,
+            escape_forward_slashes=False)
+    if isinstance(data, six.text_type):
+        return data.encode('utf-8')
+    return data
+
+
+def _json_dumps(data):
+    # Same output as JSONRenderer.
+    data = json.dumps(data, cls=JSONEncoder)
+    if isinstance(data, six.text_type):
+        return data.encode('utf-8')
+    return data
+
+
+# name: (module, dumps, array item separator)
+BACKENDS = {
+    UJSON: (ujson, _ujson_dumps, b','),
+    JSON: (json, _json_dumps, b', '),
+}
+
+
+def get_backend():
+    """
+    Return name of the JSON backend in use.
+    """
+    name = getattr(settings, 'DOCUMENT_INDEX_JSON_BACKEND', None)
+    if name is not None:
+        if BACKENDS.get(name, (None,))[0] is None:
+            raise ImproperlyConfigured(
+                    'JSON backend {0} is not available.'.format(name))
+        return name
+    if ujson is not None:
+        return UJSON
+    return JSON
+
+
+def dumps(data, backend=None):
+    """
+    Return data encoded as JSON bytes, with the stdlib encoder if the
+    backend fails.
+    """
+    encode = BACKENDS[backend or get_backend()][1]
+    try:
+        return encode(data)
+    except (TypeError, ValueError, OverflowError):
+        if encode is _json_dumps:
+            raise
+        return _json_dumps(data)
+
+
+def iter_json_array(items, buffer_size=BUFFER_SIZE):
+    """
+    Generate a JSON array of items in chunks of about buffer_size bytes.
+    """
+    backend = get_backend()
+    separator = BACKENDS[backend][2]
+    chunk = [b'[']
+    size = 1
+    first = True
+    for item in items:
+        if not first:
+            chunk.append(separator)
+            size += len(separator)
+        first = False
+        data = dumps(item, backend)
+        chunk.append(data)
+        size += len(data)
+        if size >= buffer_size:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    chunk.append(b']')
+    yield b''.join(chunk)
+
+
+# Fail at startup rather than on the first response.
+get_backend()
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    """
+    Response streaming a JSON array of the items of an iterable.
+    """
+
+    def __init__(self, items, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super(StreamingJSONResponse, self).__init__(iter_json_array(items),
+                **kwargs)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer encoding with the fastest backend installed.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        backend = get_backend()
+        indent = (renderer_context or {}).get('indent') or \
+                'indent=' in (accepted_media_type or '')
+        if backend == JSON or indent:
+            return super(FastJSONRenderer, self).render(data,
+                    accepted_media_type, renderer_context)
+        return dumps(data, backend)
@@ -0,0 +1,158 @@
+"""
+Full text search over Document and Source metadata.
+
+Terms are kept in an inverted index, the SearchTerm table, which is updated
+from model signals. A lookup is an index range scan on the term column rather
+than a LIKE scan over the metadata tables.
+"""
+import re
+from django.db import connection
+from django.db.models import Q
+from django.utils.encoding import force_text
+from document_index.models import Document, Source, SearchTerm
+from document_index.tree import subtree_range
+
+DOCUMENT_WEIGHTS = (('name', 4), ('description', 2), ('comment', 1))
+SOURCE_WEIGHTS = (('name', 2), ('filename', 2), ('description', 1))
+
+# Letters and digits. Underscores and punctuation separate terms so that
+# filenames like 'scan_2014-03.pdf' are searchable by their parts.
+TERM_RE = re.compile(r'[^\W_]+', re.UNICODE)
+TERM_MAX_LENGTH = SearchTerm._meta.get_field('term').max_length
+
+# Results returned by search() at most.
+MAX_RESULTS = 1000
+
+
+def tokenize(text):
+    """
+    Return list of lower case terms in text.
+    """
+    return [term[:TERM_MAX_LENGTH]
+            for term in TERM_RE.findall(force_text(text or '').lower())]
+
+
+def _add_terms(weights, obj, field_weights):
+    for field, weight in field_weights:
+        for term in tokenize(getattr(obj, field)):
+            weights[term] = weights.get(term, 0) + weight
+
+
+def document_terms(document, sources=None):
+    """
+    Return dict of term weights for a document and its sources.
+    """
+    if sources is None:
+        sources = Source.objects.filter(document_id=document.pk)
+    weights = {}
+    _add_terms(weights, document, DOCUMENT_WEIGHTS)
+    for source in sources:
+        _add_terms(weights, source, SOURCE_WEIGHTS)
+    return weights
+
+
+def index_document(document, sources=None):
+    """
+    Replace the index entries of a document.
+    """
+    index_documents([(document, sources)])
+
+
+def _index_entries(pairs):
+    entries = []
+    for document, sources in pairs:
+        entries.extend(SearchTerm(term=term, document_id=document.pk,
+            weight=weight) for term, weight in document_terms(
+                document, sources).items())
+    return entries
+
+
+def index_documents(pairs, batch_size=500, replace=True):
+    """
+    Replace the index entries of many documents with batched DELETEs and
+    INSERTs. ``pairs`` is a list of (document, sources) tuples, deleted
+    batch_size documents at a time. Pass ``replace=False`` for documents
+    just created, which have no entries to delete.
+    """
+    pairs = list(pairs)
+    if replace:
+        for start in range(0, len(pairs), batch_size):
+            SearchTerm.objects.filter(document_id__in=[document.pk
+                for document, _ in pairs[start:start + batch_size]]).delete()
+    # Batched by Django to fit the parameter limit of the database.
+    SearchTerm.objects.bulk_create(_index_entries(pairs))
+
+
+def rebuild_index(chunk_size=500, progress=None):
+    """
+    Rebuild the whole index in chunks of documents. Return number of
+    documents indexed. ``progress`` is called with the number of documents
+    indexed and their total after each chunk.
+    """
+    SearchTerm.objects.all().delete()
+    total = Document.objects.count() if progress is not None else None
+    count = 0
+    last_id = 0
+    while True:
+        documents = list(Document.objects.filter(document_id__gt=last_id)
+                .order_by('document_id').prefetch_related('sources')
+                [:chunk_size])
+        if not documents:
+            return count
+        SearchTerm.objects.bulk_create(_index_entries(
+            (document, document.sources.all()) for document in documents))
+        count += len(documents)
+        last_id = documents[-1].pk
+        if progress is not None:
+            progress(count, total)
+
+
+def _term_sql(term, prefix):
+    if prefix:
+        return 'term >= %s AND term < %s', [term, term + u'\uffff']
+    return 'term = %s', [term]
+
+
+def search(query, group=None, prefix=True, limit=MAX_RESULTS):
+    """
+    Return list of (document_id, score) for the ``limit`` documents best
+    matching every term in query, best match first. With ``prefix`` terms
+    also match longer indexed terms. Restrict to the subtree below ``group``
+    when given.
+
+    Ranking is done in the database: postings are grouped by document,
+    documents missing a term are dropped and only the top rows are read.
+    """
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return []
+
+    postings = SearchTerm.objects.all()
+    if group is not None:
+        postings = postings.filter(
+                document__group__path__range=subtree_range(group.path))
+    any_term = Q()
+    for term in terms:
+        if prefix:
+            any_term |= Q(term__gte=term, term__lt=term + u'\uffff')
+        else:
+            any_term |= Q(term=term)
+    matches_sql, params = postings.filter(any_term).values_list(
+            'document', 'term', 'weight').query.sql_with_params()
+
+    # A posting counts towards every query term it matches.
+    scores, required, term_params = [], [], []
+    for term in terms:
+        condition, condition_params = _term_sql(term, prefix)
+        scores.append('CASE WHEN {0} THEN weight ELSE 0 END'.format(
+            condition))
+        required.append('MAX(CASE WHEN {0} THEN 1 ELSE 0 END) = 1'.format(
+            condition))
+        term_params.extend(condition_params)
+    cursor = connection.cursor()
+    cursor.execute('SELECT document_id, SUM({0}) AS score FROM ({1}) matches '
+            'GROUP BY document_id HAVING {2} '
+            'ORDER BY score DESC, document_id LIMIT %s'.format(
+                ' + '.join(scores), matches_sql, ' AND '.join(required)),
+            term_params + list(params) + term_params + [limit])
+    return [tuple(row) for row in cursor.fetchall()]
@@ -0,0 +1,105 @@
+"""
+Gap free numbering of the sources of a document.
+
+Sources are numbered 1..n per document and (document, sequence) is unique.
+New numbers come from Document.allocate_sequences(), which increments
+``source_count`` in the database. Deleting a source closes the gap, and
+sources are reordered in bulk, with set based UPDATEs.
+
+Shifting numbers in place would collide with the unique constraint half
+way through an UPDATE, as rows are checked one by one. Renumbering is
+therefore done in two statements: the new numbers are first written
+negated, where they cannot collide with existing ones, and then flipped.
+"""
+from django.db import connection, transaction
+from django.db.models import F
+from document_index import changes, versions
+from document_index.models import Document, Source, ChangeLog
+
+# Sources renumbered per statement. Each binds three parameters, a CASE
+# pair and an IN list item, which keeps a batch below SQLite's default
+# limit of 999.
+BATCH_SIZE = 300
+
+
+def _flip(document_id):
+    Source.objects.filter(document=document_id, sequence__lt=0).update(
+            sequence=F('sequence') * -1)
+
+
+def _renumbered(document_id, queryset):
+    changes.record_query('source', queryset.order_by('sequence'),
+            ChangeLog.UPDATE)
+    versions.bump_version(versions.document(document_id))
+
+
+def locked_sequence(document_id, source_id):
+    """
+    Lock the counter row of a document, like allocate_sequences() does, and
+    return the current sequence number of one of its sources, or None if it
+    is gone. Earlier deletes may have moved it since it was loaded. Must run
+    inside a transaction.
+    """
+    Document.objects.filter(pk=document_id).update(
+            source_count=F('source_count'))
+    sequence = Source.objects.filter(pk=source_id).values_list('sequence',
+            flat=True)
+    return sequence[0] if sequence else None
+
+
+def close_gap(document_id, sequence):
+    """
+    Move the sources after a deleted sequence number down by one.
+    """
+    with transaction.atomic():
+        # Lock the counter row first, like allocate_sequences() does, so no
+        # source is numbered while the later ones move down.
+        Document.objects.filter(pk=document_id, source_count__gt=0).update(
+                source_count=F('source_count') - 1)
+        later = Source.objects.filter(document=document_id,
+                sequence__gt=sequence)
+        if later.update(sequence=(F('sequence') - 1) * -1):
+            _flip(document_id)
+            _renumbered(document_id, Source.objects.filter(
+                document=document_id, sequence__gte=sequence))
+
+
+def reorder(document_id, source_ids):
+    """
+    Number the sources of a document 1..n in the order of source_ids, which
+    must list all of them.
+    """
+    with transaction.atomic():
+        # Lock the counter row first, like allocate_sequences() does.
+        Document.objects.filter(pk=document_id).update(
+                source_count=F('source_count'))
+        current = set(Source.objects.filter(
+            document=document_id).values_list('source_id', flat=True))
+        if len(source_ids) != len(current) or set(source_ids) != current:
+            raise ValueError('Expected all sources of the document.')
+
+        table = connection.ops.quote_name(Source._meta.db_table)
+        cursor = connection.cursor()
+        for start in range(0, len(source_ids), BATCH_SIZE):
+            batch = source_ids[start:start + BATCH_SIZE]
+            params = []
+            for sequence, source_id in enumerate(batch, start + 1):
+                params.extend([source_id, -sequence])
+            cursor.execute('UPDATE {0} SET sequence = CASE source_id {1} END '
+                'WHERE source_id IN ({2})'.format(table,
+                    ' '.join(['WHEN %s THEN %s'] * len(batch)),
+                    ', '.join(['%s'] * len(batch))), params + batch)
+        _flip(document_id)
+        Document.objects.filter(pk=document_id).update(
+                source_count=len(source_ids))
+        _renumbered(document_id, Source.objects.filter(document=document_id))
+
+
+def renumber(document_id):
+    """
+    Close all gaps in the numbering of a document's sources, keeping their
+    order. Ties are broken by source_id.
+    """
+    reorder(document_id, list(Source.objects.filter(
+        document=document_id).order_by('sequence', 'source_id').values_list(
+            'source_id', flat=True)))
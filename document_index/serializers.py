@@ -1,10 +1,12 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from document_index.cache import get_tree_id
 from document_index.models import GroupTreeList, Group, Document, Source
-from django.contrib.auth.models import User
+from document_index.fields import (CachedHyperlinkedIdentityField,
+        CachedHyperlinkedRelatedField)
 
 class GroupSerializer(serializers.Serializer):
-    group = serializers.HyperlinkedIdentityField(view_name='group-detail')
+    group = CachedHyperlinkedIdentityField(view_name='group-detail')
     owner = serializers.Field(source='owner.username')
     name = serializers.CharField(max_length=32)
     description = serializers.CharField(max_length=256)
@@ -28,9 +30,8 @@ class GroupSerializer(serializers.Serializer):
         parent_id = int(attrs.get('parent'))
 
         # This will fail once for the first root node. Then we create it.
-        try:
-            tree_id = GroupTreeList.objects.get(name=user.username).id
-        except: # DoesNotExist
+        tree_id = get_tree_id(user.username)
+        if tree_id is None:
             tree = GroupTreeList(name=user.username)
             tree.save()
             tree_id = tree.id
@@ -67,22 +68,31 @@ class GroupSerializer(serializers.Serializer):
 #       return obj.get_parent().id
 
     def get_children_count(self, obj):
-        """Number of children below node."""
-        return obj.get_children_count()
+        """
+        Number of children below node. Use counts supplied by the view when
+        available, otherwise the denormalized treebeard column.
+        """
+        child_counts = self.context.get('child_counts')
+        if child_counts is not None and obj.pk in child_counts:
+            return child_counts[obj.pk]
+        return obj.numchild
 
 
 class SourceSerializer(serializers.ModelSerializer):
-    source = serializers.HyperlinkedIdentityField(view_name='source-detail')
+    source = CachedHyperlinkedIdentityField(view_name='source-detail')
 
     class Meta:
         model = Source
         fields = ('source', 'document', 'name', 'description',
-                  'sequence', 'filename', 'mime_type', 'comment', 'created',
-                  'modified')
+                  'sequence', 'filename', 'mime_type', 'comment', 'blob',
+                  'created', 'modified')
+        # Allocated on create, changed by reordering only. The blob is set
+        # by uploading the content, see SourceContent.
+        read_only_fields = ('sequence', 'blob')
 
 
 class DocumentSerializer(serializers.HyperlinkedModelSerializer):
-    group = serializers.HyperlinkedRelatedField(view_name='group-detail')
+    group = CachedHyperlinkedRelatedField(view_name='group-detail')
     sources = SourceSerializer(many=True)
 
     class Meta:
@@ -90,6 +100,8 @@ class DocumentSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('document_id', 'group', 'name', 'description',
                   'created', 'modified', 'source_count',
                   'comment', 'sources')
+        # The sequence counter of the sources, see sequences.py.
+        read_only_fields = ('source_count',)
 
 
 class UserSerializer(serializers.ModelSerializer):
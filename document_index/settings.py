@@ -95,13 +95,35 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Token, access and response caches are invalidated from signal handlers,
+# which only reach the cache of their own process. They need a cache shared
+# by all processes and are turned off with a per process one, e.g. the
+# default LocMemCache. See document_index/cache.py.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+    }
+}
+
+# Source file content store, see document_index/blobs.py.
+DOCUMENT_INDEX_BLOB_ROOT = os.path.join(BASE_DIR, 'blobs')
+
+# JSON encoder, see document_index/renderers.py. None picks ujson when
+# installed, else the standard library.
+DOCUMENT_INDEX_JSON_BACKEND = None
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'document_index.authentication.SuperUserSessionAuthentication',
-        'rest_framework.authentication.OAuth2Authentication',
+        'document_index.authentication.CachedOAuth2Authentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'document_index.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
     'PAGINATE_BY': 50,
 }
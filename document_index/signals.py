@@ -0,0 +1,186 @@
+"""
+Signal handlers keeping derived data in step with model writes.
+
+Imported at the bottom of models.py so the handlers are connected as soon as
+the models are loaded.
+"""
+import threading
+from contextlib import contextmanager
+from django.contrib.auth.models import User
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+        pre_delete)
+from django.dispatch import Signal, receiver
+from rest_framework.compat import oauth2_provider_models
+from document_index.models import (GroupTreeList, Group, Document, Source,
+        GroupACL, ChangeLog)
+from document_index import (authentication, cache, changes, search,
+        sequences, versions)
+
+# Sent after operations that rewrite group paths with set based SQL, such
+# as moves and bulk loads, which bypass the model signals.
+tree_changed = Signal()
+
+_local = threading.local()
+
+
+@contextmanager
+def deferred_indexing():
+    """
+    Skip search indexing in the handlers below for bulk writes. The caller
+    indexes the documents it wrote itself, e.g. with index_documents().
+    """
+    previous = getattr(_local, 'defer_indexing', False)
+    _local.defer_indexing = True
+    try:
+        yield
+    finally:
+        _local.defer_indexing = previous
+
+
+def _indexing_deferred():
+    return getattr(_local, 'defer_indexing', False)
+
+
+def _deleting_documents():
+    if not hasattr(_local, 'deleting_documents'):
+        _local.deleting_documents = set()
+    return _local.deleting_documents
+
+
+@receiver(post_save, sender=Document)
+def index_saved_document(sender, instance, raw=False, **kwargs):
+    if not raw and not _indexing_deferred():
+        search.index_document(instance)
+
+
+@receiver(pre_delete, sender=Document)
+def mark_deleting_document(sender, instance, **kwargs):
+    # Sources are deleted before their document during a cascade. Their
+    # handlers must not reindex a document that is about to disappear.
+    _deleting_documents().add(instance.pk)
+
+
+@receiver(post_delete, sender=Document)
+def unmark_deleting_document(sender, instance, **kwargs):
+    _deleting_documents().discard(instance.pk)
+
+
+@receiver(post_save, sender=Source)
+@receiver(post_delete, sender=Source)
+def index_source_document(sender, instance, raw=False, **kwargs):
+    if (raw or _indexing_deferred() or
+            instance.document_id in _deleting_documents()):
+        return
+    try:
+        document = Document.objects.get(pk=instance.document_id)
+    except Document.DoesNotExist:
+        return
+    search.index_document(document)
+
+
+@receiver(pre_delete, sender=Source)
+def refresh_deleted_sequence(sender, instance, **kwargs):
+    # The sequence in memory is stale if an earlier delete moved the source
+    # down, as when a formset deletes several sources in a row. The delete
+    # runs in the same transaction, so the number read here holds.
+    if instance.document_id not in _deleting_documents():
+        instance.sequence = sequences.locked_sequence(instance.document_id,
+                instance.pk)
+
+
+@receiver(post_delete, sender=Source)
+def close_sequence_gap(sender, instance, **kwargs):
+    # All sources of a deleted document go with it. A source that was
+    # already gone left no gap.
+    if (instance.document_id not in _deleting_documents() and
+            instance.sequence is not None):
+        sequences.close_gap(instance.document_id, instance.sequence)
+
+
+@receiver(post_save, sender=GroupTreeList)
+@receiver(post_delete, sender=GroupTreeList)
+def invalidate_tree_cache(sender, instance, **kwargs):
+    cache.invalidate_tree(instance.name)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_root_cache(sender, instance, **kwargs):
+    # Only adding or removing a root node can change root paths. Updates
+    # leave the path alone; post_delete sends no 'created' argument.
+    if instance.depth == 1 and kwargs.get('created', True):
+        cache.invalidate_roots()
+
+
+@receiver(tree_changed)
+def invalidate_root_cache_on_tree_change(sender, **kwargs):
+    cache.invalidate_roots()
+    versions.bump_version(versions.GROUPS)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def bump_branch_version(sender, instance, **kwargs):
+    versions.bump_version(versions.branch(instance.path))
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+def bump_document_version(sender, instance, **kwargs):
+    versions.bump_version(versions.document(instance.pk))
+
+
+@receiver(post_save, sender=Source)
+@receiver(post_delete, sender=Source)
+def bump_source_document_version(sender, instance, **kwargs):
+    versions.bump_version(versions.document(instance.document_id))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def bump_owner_version(sender, instance, **kwargs):
+    if kwargs.get('created', True):
+        versions.bump_version(versions.owner(instance.owner_id))
+
+
+@receiver(post_save, sender=GroupACL)
+@receiver(post_delete, sender=GroupACL)
+@receiver(m2m_changed, sender=User.groups.through)
+def bump_acl_version(sender, **kwargs):
+    versions.bump_version(versions.ACLS)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_save, sender=Document)
+@receiver(post_save, sender=Source)
+def record_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        changes.record(sender.__name__.lower(), instance.pk,
+                ChangeLog.INSERT if kwargs['created'] else ChangeLog.UPDATE)
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Document)
+@receiver(post_delete, sender=Source)
+def record_delete(sender, instance, **kwargs):
+    # The primary key may already be cleared by a cascade.
+    changes.record(sender.__name__.lower(),
+            getattr(instance, sender._meta.pk.attname), ChangeLog.DELETE)
+
+
+if oauth2_provider_models is not None:
+    AccessToken = oauth2_provider_models.AccessToken
+
+    @receiver(post_save, sender=AccessToken)
+    @receiver(post_delete, sender=AccessToken)
+    def invalidate_access_token(sender, instance, **kwargs):
+        authentication.invalidate_token(instance.token)
+
+    @receiver(post_save, sender=User)
+    @receiver(post_delete, sender=User)
+    def invalidate_user_tokens(sender, instance, **kwargs):
+        # Cached tokens carry a copy of the user.
+        if not kwargs.get('created', False):
+            for token in AccessToken.objects.filter(
+                    user_id=instance.pk).values_list('token', flat=True):
+                authentication.invalidate_token(token)
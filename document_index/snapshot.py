@@ -0,0 +1,259 @@
+"""
+Compact in-memory snapshots of group tree branches.
+
+A branch, the subtree below one root node, is loaded with one range query
+into parallel arrays in path order. In path order every subtree is a
+contiguous run, so keeping the index one past the end of each subtree makes
+descendant tests a comparison and descendant lists a slice. Ancestors follow
+parent indexes in O(depth), the lowest common ancestor is a binary search
+for the longest common path prefix.
+
+Snapshots are kept per process and checked against the branch versions from
+versions.py, which Group signals bump, before use. Only branches that
+changed are loaded again. Versions are bumped in the cache of the process
+handling the write, so snapshots are only kept with a cache shared by all
+processes, see cache.is_shared(). Otherwise every call loads the branches
+it needs from the database.
+"""
+import bisect
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from document_index import versions
+from document_index.cache import (get_root_paths, is_shared,
+        roots_generation)
+from document_index.models import Group
+from document_index.tree import subtree_range
+
+# Branch snapshots kept per process, least recently loaded dropped first.
+MAX_BRANCHES = 256
+
+_branches = OrderedDict()
+_lock = threading.Lock()
+
+
+class BranchSnapshot(object):
+    """
+    Ids, paths and names of the nodes of a branch in path order, with the
+    index of each node's parent and of the end of its subtree.
+    """
+
+    def __init__(self, rows):
+        self.ids = array('l')
+        self.parents = array('l')
+        self.ends = array('l')
+        self.paths = []
+        self.names = []
+        self.index = {}
+
+        open_nodes = []
+        for i, (group_id, path, name) in enumerate(rows):
+            while open_nodes and not path.startswith(
+                    self.paths[open_nodes[-1]]):
+                self.ends[open_nodes.pop()] = i
+            self.ids.append(group_id)
+            self.parents.append(open_nodes[-1] if open_nodes else -1)
+            self.ends.append(0)
+            self.paths.append(path)
+            self.names.append(name)
+            self.index[group_id] = i
+            open_nodes.append(i)
+        for i in open_nodes:
+            self.ends[i] = len(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, group_id):
+        return group_id in self.index
+
+    def depth(self, group_id):
+        return len(self.paths[self.index[group_id]]) // Group.steplen
+
+    def parent(self, group_id):
+        """
+        Return id of the parent, or None for the root node.
+        """
+        i = self.parents[self.index[group_id]]
+        return self.ids[i] if i >= 0 else None
+
+    def ancestors(self, group_id, include_self=False):
+        """
+        Return list of ancestor ids, root first.
+        """
+        i = self.index[group_id]
+        if not include_self:
+            i = self.parents[i]
+        result = []
+        while i >= 0:
+            result.append(self.ids[i])
+            i = self.parents[i]
+        result.reverse()
+        return result
+
+    def descendants(self, group_id):
+        """
+        Return list of descendant ids in path order.
+        """
+        i = self.index[group_id]
+        return self.ids[i + 1:self.ends[i]].tolist()
+
+    def is_descendant(self, group_id, ancestor_id, include_self=False):
+        """
+        Return True if group_id is below ancestor_id.
+        """
+        i = self.index.get(group_id)
+        j = self.index.get(ancestor_id)
+        if i is None or j is None:
+            return False
+        if i == j:
+            return include_self
+        return j < i < self.ends[j]
+
+    def lca(self, group_id, other_id):
+        """
+        Return id of the lowest common ancestor, a node itself if it is an
+        ancestor of the other.
+        """
+        prefix = os.path.commonprefix([self.paths[self.index[group_id]],
+            self.paths[self.index[other_id]]])
+        prefix = prefix[:len(prefix) - len(prefix) % Group.steplen]
+        return self.ids[bisect.bisect_left(self.paths, prefix)]
+
+    def breadcrumbs(self, group_id):
+        """
+        Return list of (id, name) from the root down to the node.
+        """
+        return [(ancestor_id, self.names[self.index[ancestor_id]])
+                for ancestor_id in self.ancestors(group_id, True)]
+
+
+class TreeSnapshot(object):
+    """
+    Branch snapshots of all root nodes of a tree. Queries are answered by
+    the branch holding the node.
+    """
+
+    def __init__(self, branches):
+        self.branches = branches
+        self.branch_of = {}
+        for branch in branches:
+            for group_id in branch.ids:
+                self.branch_of[group_id] = branch
+
+    def __len__(self):
+        return len(self.branch_of)
+
+    def __contains__(self, group_id):
+        return group_id in self.branch_of
+
+    def depth(self, group_id):
+        return self.branch_of[group_id].depth(group_id)
+
+    def parent(self, group_id):
+        return self.branch_of[group_id].parent(group_id)
+
+    def ancestors(self, group_id, include_self=False):
+        return self.branch_of[group_id].ancestors(group_id, include_self)
+
+    def descendants(self, group_id):
+        return self.branch_of[group_id].descendants(group_id)
+
+    def is_descendant(self, group_id, ancestor_id, include_self=False):
+        branch = self.branch_of.get(group_id)
+        return branch is not None and branch.is_descendant(
+                group_id, ancestor_id, include_self)
+
+    def lca(self, group_id, other_id):
+        """
+        Return id of the lowest common ancestor, None if the nodes are in
+        different branches.
+        """
+        branch = self.branch_of[group_id]
+        if branch is not self.branch_of[other_id]:
+            return None
+        return branch.lca(group_id, other_id)
+
+    def breadcrumbs(self, group_id):
+        return self.branch_of[group_id].breadcrumbs(group_id)
+
+
+def _branch_versions(root_paths):
+    """
+    Return list of branch versions, None for each if they are unknown.
+    """
+    generation = roots_generation()
+    values = versions.get_versions([versions.GROUPS] +
+            [versions.branch(path) for path in root_paths])
+    if generation is None or values is None:
+        return [None] * len(root_paths)
+    return [(generation, values[0], value) for value in values[1:]]
+
+
+def _load_branch(root_path):
+    return BranchSnapshot(Group.objects.filter(
+        path__range=subtree_range(root_path)).order_by('path').values_list(
+            'id', 'path', 'name'))
+
+
+def get_branch(root_path, version=None):
+    """
+    Return snapshot of the branch below root_path, loading it again if it
+    changed since it was loaded.
+    """
+    if not is_shared():
+        return _load_branch(root_path)
+    if version is None:
+        version = _branch_versions([root_path])[0]
+        if version is None:
+            return _load_branch(root_path)
+    entry = _branches.get(root_path)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    snapshot = _load_branch(root_path)
+    with _lock:
+        _branches.pop(root_path, None)
+        _branches[root_path] = (version, snapshot)
+        while len(_branches) > MAX_BRANCHES:
+            _branches.popitem(last=False)
+    return snapshot
+
+
+def get_tree_snapshot(tree_id):
+    """
+    Return TreeSnapshot of the root nodes of a tree.
+    """
+    root_paths = get_root_paths(tree_id)
+    if not is_shared():
+        return TreeSnapshot([_load_branch(path) for path in root_paths])
+    return TreeSnapshot([get_branch(path, version) for path, version in
+        zip(root_paths, _branch_versions(root_paths))])
+
+
+def get_group_snapshot(group_id):
+    """
+    Return snapshot of the branch holding a group, or None if there is no
+    such group. Costs no query if the branch is loaded and unchanged.
+    """
+    with _lock:
+        entries = list(_branches.items()) if is_shared() else []
+    for root_path, (version, snapshot) in entries:
+        if group_id in snapshot:
+            snapshot = get_branch(root_path)
+            if group_id in snapshot:
+                return snapshot
+            break
+
+    path = Group.objects.filter(id=group_id).values_list(
+            'path', flat=True).first()
+    if path is None:
+        return None
+    snapshot = get_branch(path[:Group.steplen])
+    return snapshot if group_id in snapshot else None
+
+
+def clear():
+    with _lock:
+        _branches.clear()
@@ -0,0 +1,62 @@
+"""
+Job functions for heavy group and document operations. See jobs.py.
+"""
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import PermissionDenied
+from document_index import jobs, search
+from document_index.access import WRITE, get_prefixes, has_access
+from document_index.bulk import count_nodes, ingest_documents, load_tree
+from document_index.models import Group
+from document_index.move import delete_subtree, move_nodes
+
+
+def _check_write(owner_id, group_ids):
+    # Access may have been revoked since the job was queued.
+    owner = User.objects.get(id=owner_id)
+    for path in Group.objects.filter(id__in=group_ids).values_list(
+            'path', flat=True):
+        if not has_access(owner, path, WRITE):
+            raise PermissionDenied('Write access required.')
+
+
+@jobs.task('delete_subtree')
+def delete_subtree_task(group_id, owner_id):
+    _check_write(owner_id, [group_id])
+    return delete_subtree(group_id)
+
+
+@jobs.task('move_nodes')
+def move_nodes_task(node_ids, parent_id, owner_id):
+    _check_write(owner_id, node_ids + [parent_id])
+    return [{'id': node.id, 'depth': node.depth, 'numchild': node.numchild,
+        'descendants': descendants}
+        for node, descendants in move_nodes(node_ids, parent_id)]
+
+
+@jobs.task('load_tree')
+def load_tree_task(data, owner_id, tree_id, parent_id):
+    owner = User.objects.get(id=owner_id)
+    parent = None
+    if parent_id:
+        _check_write(owner_id, [parent_id])
+        parent = Group.objects.get(id=parent_id)
+        tree_id = parent.tree_id
+    groups = load_tree(data, owner, tree_id, parent)
+    return {'created': count_nodes(data),
+            'groups': [group.id for group in groups]}
+
+
+@jobs.task('ingest_documents')
+def ingest_documents_task(rows, owner_id):
+    owner = User.objects.get(id=owner_id) if owner_id else AnonymousUser()
+    jobs.report_progress(0, len(rows))
+    # Access as of the time the job runs.
+    results = ingest_documents(rows,
+            write_prefixes=get_prefixes(owner)[WRITE])
+    jobs.report_progress(len(rows), len(rows))
+    return results
+
+
+@jobs.task('rebuild_search_index')
+def rebuild_search_index_task(chunk_size=500):
+    return search.rebuild_index(chunk_size, progress=jobs.report_progress)
@@ -0,0 +1,152 @@
+"""
+Tests for hierarchical group access.
+"""
+from django.contrib.auth.models import User, Group as Team
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+# Models first: they connect the signal handlers access.py relies on.
+from document_index.models import GroupTreeList, Group, Document, GroupACL
+from document_index.access import (READ, WRITE, filter_access,
+        get_prefixes, has_access, minimize)
+from document_index.bulk import load_tree
+from document_index.move import move_nodes
+from document_index.permissions import IsOwnerOrReadOnly
+from document_index.views import (DocumentList, GroupList, GroupMove,
+        GroupShared)
+
+
+class AccessTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(
+                username='alice', email='alice@_', password='secret')
+        self.bob = User.objects.create_user(
+                username='bob', email='bob@_', password='secret')
+        tree = GroupTreeList.objects.create(name='alice')
+        load_tree([
+            {'name': 'projects', 'children': [
+                {'name': 'apollo', 'children': [{'name': 'specs'}]},
+                {'name': 'gemini'},
+            ]},
+            {'name': 'private'},
+        ], self.alice, tree.id)
+
+    def get(self, name):
+        return Group.objects.get(name=name)
+
+    def test_minimize(self):
+        self.assertEqual(minimize(['00010002', '0001', '0002', '00020001']),
+                ['0001', '0002'])
+
+    def test_owner_prefixes(self):
+        prefixes = get_prefixes(self.alice)
+        self.assertEqual(prefixes[WRITE], sorted([self.get('projects').path,
+            self.get('private').path]))
+        self.assertEqual(get_prefixes(self.bob), {READ: [], WRITE: []})
+
+        path = self.get('specs').path
+        with self.assertNumQueries(0):
+            self.assertTrue(has_access(self.alice, path))
+
+    def test_inherited_acl(self):
+        GroupACL.objects.create(group=self.get('apollo'), user=self.bob)
+        self.assertTrue(has_access(self.bob, self.get('specs').path, READ))
+        self.assertFalse(has_access(self.bob, self.get('specs').path, WRITE))
+        self.assertFalse(has_access(self.bob, self.get('gemini').path, READ))
+
+        team = Team.objects.create(name='engineering')
+        GroupACL.objects.create(group=self.get('projects'), team=team,
+                can_write=True)
+        self.assertFalse(has_access(self.bob, self.get('gemini').path))
+        self.bob.groups.add(team)
+        self.assertTrue(has_access(self.bob, self.get('gemini').path))
+
+    @override_settings(DOCUMENT_INDEX_SHARED_CACHE=False)
+    def test_per_process_cache(self):
+        """
+        Without a shared cache an ACL changed in the database alone, e.g. by
+        another process, is seen at once.
+        """
+        acl = GroupACL.objects.create(group=self.get('apollo'),
+                user=self.bob, can_write=True)
+        self.assertTrue(has_access(self.bob, self.get('specs').path))
+        # No signals, so no version is bumped.
+        GroupACL.objects.filter(pk=acl.pk).update(can_write=False)
+        self.assertFalse(has_access(self.bob, self.get('specs').path))
+        self.assertTrue(has_access(self.bob, self.get('specs').path, READ))
+
+    def test_prefixes_follow_moves(self):
+        GroupACL.objects.create(group=self.get('apollo'), user=self.bob)
+        get_prefixes(self.bob)
+        move_nodes([self.get('apollo').id], self.get('private').id)
+        self.assertEqual(get_prefixes(self.bob)[READ],
+                [self.get('apollo').path])
+
+        # Sorted inserts shift sibling paths within the branch.
+        self.get('private').add_child(tree_id=self.get('private').tree_id,
+                owner=self.alice, name='a')
+        self.assertEqual(get_prefixes(self.bob)[READ],
+                [self.get('apollo').path])
+
+    def test_filter_access(self):
+        GroupACL.objects.create(group=self.get('apollo'), user=self.bob)
+        Document(group=self.get('specs'), name='in').save()
+        Document(group=self.get('gemini'), name='out').save()
+        self.assertEqual(sorted(filter_access(Group.objects.all(), self.bob)
+            .values_list('name', flat=True)), ['apollo', 'specs'])
+        self.assertEqual([document.name for document in filter_access(
+            Document.objects.all(), self.bob, prefix='group__')], ['in'])
+        self.assertEqual(filter_access(Group.objects.all(), self.bob,
+            WRITE).count(), 0)
+
+        request = APIRequestFactory().get('/documents/?access=read')
+        force_authenticate(request, self.bob)
+        response = DocumentList.as_view()(request)
+        self.assertEqual([row['name'] for row in response.data],
+                ['in'])
+
+    def test_object_permission(self):
+        GroupACL.objects.create(group=self.get('projects'), user=self.bob,
+                can_write=True)
+        request = RequestFactory().put('/')
+        request.user = self.bob
+        permission = IsOwnerOrReadOnly()
+        self.assertTrue(permission.has_object_permission(request, None,
+            self.get('specs')))
+        self.assertFalse(permission.has_object_permission(request, None,
+            self.get('private')))
+
+    def test_shared_and_move_views(self):
+        GroupACL.objects.create(group=self.get('apollo'), user=self.bob)
+        factory = APIRequestFactory()
+        request = factory.get('/groups/shared/')
+        force_authenticate(request, self.bob)
+        response = GroupShared.as_view()(request)
+        self.assertEqual([row['name'] for row in response.data],
+                ['apollo'])
+
+        request = factory.patch('/groups/move/', {'nodes': [
+            self.get('specs').id], 'parent': self.get('gemini').id},
+            format='json')
+        force_authenticate(request, self.bob)
+        self.assertEqual(GroupMove.as_view()(request).status_code, 403)
+
+    def test_create_child_view(self):
+        acl = GroupACL.objects.create(group=self.get('projects'),
+                user=self.bob)
+        factory = APIRequestFactory()
+        data = {'name': 'new', 'description': 'd', 'comment': 'c'}
+        for name, can_write, status_code in [('private', False, 403),
+                ('apollo', False, 403), ('apollo', True, 201)]:
+            acl.can_write = can_write
+            acl.save()
+            request = factory.post('/groups/parent/', data, format='json')
+            force_authenticate(request, self.bob)
+            self.assertEqual(GroupList.as_view()(request,
+                pk=self.get(name).id).status_code, status_code)
+        self.assertEqual(list(Group.objects.filter(name='new').values_list(
+            'depth', flat=True)), [3])
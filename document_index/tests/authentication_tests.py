@@ -1,9 +1,17 @@
+from datetime import timedelta
 from django.contrib.auth.models import User
+from django.core.cache import cache, get_cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import override_settings
 #from django.test.client import Client
 from django.test.client import RequestFactory
-from rest_framework import status
-from document_index.authentication import SuperUserSessionAuthentication
+from django.utils import timezone
+from provider.oauth2.models import AccessToken, Client
+from rest_framework import exceptions, status
+from document_index import authentication
+from document_index.authentication import (CachedOAuth2Authentication,
+        SuperUserSessionAuthentication, stats)
 
 
 class SuperUserSessionAuthenticationTestCases(TestCase):
@@ -56,3 +64,97 @@ class SuperUserSessionAuthenticationTestCases(TestCase):
         authentication_class = SuperUserSessionAuthentication()
         is_authenticated = authentication_class.authenticate(request)
         self.assertFalse(is_authenticated)
+
+
+class CachedOAuth2AuthenticationTest(TestCase):
+    """
+    Test cases for cached bearer token authentication.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        client = Client.objects.create(user=self.user, url='http://_/',
+                redirect_uri='http://_/', client_type=0)
+        self.token = AccessToken.objects.create(user=self.user, client=client)
+        self.backend = CachedOAuth2Authentication()
+
+    def authenticate(self, token=None):
+        request = self.factory.get('/', HTTP_AUTHORIZATION='Bearer {0}'.format(
+            token or self.token.token))
+        return self.backend.authenticate(request)
+
+    def test_token_cached(self):
+        self.authenticate()
+        before = dict(stats['CachedOAuth2Authentication'])
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+        self.assertEqual(user, self.user)
+        self.assertEqual(token.pk, self.token.pk)
+        after = stats['CachedOAuth2Authentication']
+        self.assertEqual(after['hits'], before['hits'] + 1)
+        self.assertEqual(after['calls'], before['calls'] + 1)
+
+    def test_invalid_token(self):
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate('bogus')
+
+    def test_revoked_token(self):
+        self.authenticate()
+        self.token.delete()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate(self.token.token)
+
+    def test_inactive_user(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+
+    def test_expired_token(self):
+        self.authenticate()
+        self.token.expires = timezone.now() - timedelta(seconds=1)
+        self.token.save()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+
+    def test_other_process_cache(self):
+        """
+        A process with its own cache keeps trusting a token revoked in
+        another one, which is why tokens are only cached in a shared cache.
+        """
+        other = get_cache('django.core.cache.backends.locmem.LocMemCache',
+                LOCATION='other')
+        authentication.cache = other
+        try:
+            self.authenticate()
+        finally:
+            authentication.cache = cache
+        # Revoked in this process, which evicts from its own cache only.
+        pk = self.token.pk
+        self.token.delete()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate(self.token.token)
+        authentication.cache = other
+        try:
+            user, token = self.authenticate(self.token.token)
+        finally:
+            authentication.cache = cache
+            other.clear()
+        self.assertEqual(token.pk, pk)
+
+    @override_settings(DOCUMENT_INDEX_SHARED_CACHE=False)
+    def test_per_process_cache(self):
+        """
+        Without a shared cache every request checks the database, so a
+        token deleted from the database alone, without signals, is rejected
+        at once.
+        """
+        self.authenticate()
+        connection.cursor().execute('DELETE FROM {0} WHERE id = %s'.format(
+            AccessToken._meta.db_table), [self.token.pk])
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
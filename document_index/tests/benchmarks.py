@@ -0,0 +1,488 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the tree, document and serializer hot paths.
+
+Builds a synthetic group tree and document set with the test factories in a
+test database, then runs each benchmark a number of times and records wall
+time, number of queries and peak memory. Results are written as JSON and
+can be compared against a stored baseline, failing when a benchmark got
+slower than the tolerance allows or runs more queries.
+
+Run from this directory like runtests.py, e.g.
+
+    python benchmarks.py --depth 3 --fanout 6 --documents 2000 \\
+            --output results.json --baseline baseline.json
+
+Peak memory is measured with tracemalloc where available, Python 3.4 and
+later, and is None otherwise. ``max_rss`` is the peak resident size of the
+process after each benchmark, in kilobytes on Linux.
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+from timeit import default_timer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+DEFAULTS = {
+    'depth': 3,
+    'fanout': 5,
+    'documents': 1000,
+    'sources': 2,
+    'repeat': 5,
+}
+
+# Allowed slowdown of the median time against the baseline.
+TOLERANCE = 0.25
+
+
+def build_tree_data(depth, fanout, counter=None):
+    """
+    Return nested tree data in the format of load_tree(), fanout nodes on
+    each of depth levels, with attributes from GroupFactory.
+    """
+    from document_index.tests.factories import GroupFactory
+    counter = counter if counter is not None else [0]
+    items = []
+    for i in range(fanout):
+        counter[0] += 1
+        group = GroupFactory.attributes(extra={'tree': None, 'owner': None})
+        items.append({
+            'name': '{0} {1}'.format(group['name'], counter[0])[:32],
+            'description': group['description'],
+            'comment': group['comment'],
+            'children': build_tree_data(depth - 1, fanout, counter)
+                if depth > 1 else [],
+        })
+    return items
+
+
+def build_data(depth=DEFAULTS['depth'], fanout=DEFAULTS['fanout'],
+        documents=DEFAULTS['documents'], sources=DEFAULTS['sources']):
+    """
+    Create a user with a tree of groups and documents spread over the
+    groups, each with a number of sources. Documents and sources are
+    inserted with bulk_create, so no change log or search index rows are
+    written. Return dict of the objects the benchmarks use.
+    """
+    from django.contrib.auth.models import User
+    from document_index.bulk import load_tree
+    from document_index.models import Group, Document, Source
+    from document_index.tests.factories import (GroupTreeListFactory,
+            DocumentFactory, SourceFactory)
+
+    user = User.objects.create_user(username='benchmark',
+            email='benchmark@_', password='secret')
+    tree = GroupTreeListFactory(name=user.username)
+    tree.save()
+    load_tree(build_tree_data(depth, fanout), user, tree.id)
+
+    groups = list(Group.objects.filter(tree=tree).order_by('path'))
+    Document.objects.bulk_create([
+        DocumentFactory.build(group=groups[i % len(groups)])
+        for i in range(documents)])
+    document_ids = list(Document.objects.filter(
+        group__tree=tree).values_list('document_id', flat=True))
+    Source.objects.bulk_create([
+        SourceFactory.build(document_id=document_id, sequence=j + 1)
+        for document_id in document_ids for j in range(sources)])
+    # A join instead of the ids, which would be one parameter each.
+    Document.objects.filter(group__tree=tree).update(source_count=sources)
+
+    roots = [group for group in groups if group.depth == 1]
+    return {
+        'user': user,
+        'tree': tree,
+        'groups': len(groups),
+        'documents': len(document_ids),
+        'roots': roots,
+        # First child of the first root, moved between the first two roots.
+        'moved': next((group for group in groups
+            if group.depth == 2 and group.path.startswith(roots[0].path)),
+            None),
+    }
+
+
+class Benchmark(object):
+    """
+    A benchmark. setup() runs before every repetition and is not timed.
+    """
+    name = None
+
+    def __init__(self, data):
+        self.data = data
+
+    def setup(self):
+        pass
+
+    def run(self):
+        raise NotImplementedError
+
+    def request(self, method, url, data=None):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        factory = APIRequestFactory()
+        if data is None:
+            request = getattr(factory, method)(url)
+        else:
+            request = getattr(factory, method)(url, data, format='json')
+        force_authenticate(request, self.data['user'])
+        return request
+
+    def render(self, response):
+        """
+        Return response content, the way the handler would produce it.
+        """
+        if hasattr(response, 'render'):
+            response.render()
+            return response.content
+        return b''.join(response.streaming_content)
+
+
+class ViewBenchmark(Benchmark):
+    method = 'get'
+    url = None
+    kwargs = {}
+
+    def get_view(self):
+        raise NotImplementedError
+
+    def get_data(self):
+        return None
+
+    def run(self):
+        response = self.get_view().as_view()(self.request(self.method,
+            self.url, self.get_data()), **self.kwargs)
+        assert response.status_code == 200, response.status_code
+        return self.render(response)
+
+
+class GroupListBenchmark(ViewBenchmark):
+    name = 'group_list'
+    url = '/groups/parent/0/'
+    kwargs = {'pk': 0}
+
+    def get_view(self):
+        from document_index.views import GroupList
+        return GroupList
+
+
+class GroupChildListBenchmark(GroupListBenchmark):
+    name = 'group_child_list'
+
+    def setup(self):
+        pk = self.data['roots'][0].pk
+        self.url = '/groups/parent/{0}/'.format(pk)
+        self.kwargs = {'pk': pk}
+
+
+class GroupAnnotatedListBenchmark(ViewBenchmark):
+    name = 'group_annotated_list'
+    url = '/groups/annotated_list/0/'
+    kwargs = {'pk': 0}
+
+    def setup(self):
+        # Measure building the list, not the response cache.
+        from django.core.cache import cache
+        cache.clear()
+
+    def get_view(self):
+        from document_index.views import GroupAnnotatedList
+        return GroupAnnotatedList
+
+
+class GroupAnnotatedListCachedBenchmark(GroupAnnotatedListBenchmark):
+    name = 'group_annotated_list_cached'
+
+    def setup(self):
+        if not getattr(self, 'warm', False):
+            super(GroupAnnotatedListCachedBenchmark, self).setup()
+            self.run()
+            self.warm = True
+
+
+class GroupAnnotatedListStreamBenchmark(GroupAnnotatedListBenchmark):
+    name = 'group_annotated_list_stream'
+    url = '/groups/annotated_list/0/?stream=1'
+
+
+class GroupMoveBenchmark(ViewBenchmark):
+    """
+    Move a subtree between the first two roots, in turns.
+    """
+    name = 'group_move'
+    method = 'patch'
+    moves = 0
+
+    def setup(self):
+        moved = self.data['moved']
+        self.url = '/groups/{0}/move/'.format(moved.pk)
+        self.kwargs = {'pk': moved.pk}
+        self.parent_id = self.data['roots'][1 - self.moves % 2].pk
+        self.moves += 1
+
+    def get_data(self):
+        return {'parent': self.parent_id}
+
+    def get_view(self):
+        from document_index.views import GroupMove
+        return GroupMove
+
+
+class DocumentListBenchmark(ViewBenchmark):
+    name = 'document_list'
+    url = '/documents/'
+
+    def get_view(self):
+        from document_index.views import DocumentList
+        return DocumentList
+
+
+class DocumentListCursorBenchmark(DocumentListBenchmark):
+    name = 'document_list_cursor'
+    url = '/documents/?cursor='
+
+
+class DocumentListStreamBenchmark(DocumentListBenchmark):
+    name = 'document_list_stream'
+    url = '/documents/?stream=1'
+
+
+class SerializerBenchmark(Benchmark):
+    """
+    Serialize all rows of a model, without rendering.
+    """
+
+    def get_context(self):
+        from rest_framework.test import APIRequestFactory
+        return {'request': APIRequestFactory().get('/'), 'format': None}
+
+
+class DocumentSerializerBenchmark(SerializerBenchmark):
+    name = 'document_serializer'
+
+    def run(self):
+        from document_index.models import Document
+        from document_index.serializers import DocumentSerializer
+        return DocumentSerializer(Document.objects.select_related(
+            'group').prefetch_related('sources'), many=True,
+            context=self.get_context()).data
+
+
+class DocumentValuesSerializerBenchmark(SerializerBenchmark):
+    name = 'document_values_serializer'
+
+    def run(self):
+        from document_index.models import Document
+        from document_index.fastserializers import DocumentValuesSerializer
+        serializer = DocumentValuesSerializer(self.get_context())
+        return serializer.serialize(serializer.rows(Document.objects.all()))
+
+
+class GroupSerializerBenchmark(SerializerBenchmark):
+    name = 'group_serializer'
+
+    def run(self):
+        from document_index.models import Group
+        from document_index.serializers import GroupSerializer
+        return GroupSerializer(Group.objects.select_related('owner'),
+                many=True, context=self.get_context()).data
+
+
+class GroupValuesSerializerBenchmark(SerializerBenchmark):
+    name = 'group_values_serializer'
+
+    def run(self):
+        from document_index.models import Group
+        from document_index.fastserializers import GroupValuesSerializer
+        serializer = GroupValuesSerializer(self.get_context())
+        return serializer.serialize(serializer.rows(Group.objects.all()))
+
+
+BENCHMARKS = [
+    GroupListBenchmark,
+    GroupChildListBenchmark,
+    GroupAnnotatedListBenchmark,
+    GroupAnnotatedListCachedBenchmark,
+    GroupAnnotatedListStreamBenchmark,
+    GroupMoveBenchmark,
+    DocumentListBenchmark,
+    DocumentListCursorBenchmark,
+    DocumentListStreamBenchmark,
+    DocumentSerializerBenchmark,
+    DocumentValuesSerializerBenchmark,
+    GroupSerializerBenchmark,
+    GroupValuesSerializerBenchmark,
+]
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def _max_rss():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(benchmark, repeat=DEFAULTS['repeat']):
+    """
+    Run a benchmark repeat times. Return dict of results. Queries and peak
+    memory are taken from the last run.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    times = []
+    for i in range(repeat):
+        benchmark.setup()
+        gc.collect()
+        last = i == repeat - 1
+        if last and tracemalloc is not None:
+            tracemalloc.start()
+        queries = CaptureQueriesContext(connection)
+        with queries:
+            start = default_timer()
+            benchmark.run()
+            times.append(default_timer() - start)
+        peak_memory = None
+        if last and tracemalloc is not None:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    return {
+        'repeat': repeat,
+        'time_min': min(times),
+        'time_median': _median(times),
+        'time_max': max(times),
+        'queries': len(queries),
+        'peak_memory': peak_memory,
+        'max_rss': _max_rss(),
+    }
+
+
+def run_benchmarks(data, repeat=DEFAULTS['repeat'], names=None):
+    """
+    Run benchmarks, all or those named. Return dict of results by name.
+    """
+    results = {}
+    for benchmark_class in BENCHMARKS:
+        if names and benchmark_class.name not in names:
+            continue
+        results[benchmark_class.name] = measure(benchmark_class(data),
+                repeat)
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Compare results with baseline results. Return list of regression
+    messages. Benchmarks missing from either side are skipped.
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        result, base = results[name], baseline[name]
+        if result['time_median'] > base['time_median'] * (1 + tolerance):
+            regressions.append('{0}: median {1:.4f}s, baseline {2:.4f}s'
+                    .format(name, result['time_median'],
+                        base['time_median']))
+        if result['queries'] > base['queries']:
+            regressions.append('{0}: {1} queries, baseline {2}'.format(
+                name, result['queries'], base['queries']))
+    return regressions
+
+
+def environment():
+    import django
+    from document_index.renderers import get_backend
+    from django.db import connection
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'json_backend': get_backend(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--depth', type=int, default=DEFAULTS['depth'],
+            help='levels of groups')
+    parser.add_argument('--fanout', type=int, default=DEFAULTS['fanout'],
+            help='children per group')
+    parser.add_argument('--documents', type=int,
+            default=DEFAULTS['documents'])
+    parser.add_argument('--sources', type=int, default=DEFAULTS['sources'],
+            help='sources per document')
+    parser.add_argument('--repeat', type=int, default=DEFAULTS['repeat'])
+    parser.add_argument('--benchmark', action='append', dest='names',
+            help='run only this benchmark, repeatable')
+    parser.add_argument('--output', help='write results to this file')
+    parser.add_argument('--baseline', help='compare with these results')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+            help='allowed slowdown of the median time, default 0.25')
+    options = parser.parse_args(argv)
+
+    from django.conf import settings
+    import settings as test_settings
+    if not settings.configured:
+        settings.configure(**test_settings.__dict__)
+
+    from django.db import connection
+    from django.test.utils import (setup_test_environment,
+            teardown_test_environment)
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        params = dict((key, getattr(options, key)) for key in DEFAULTS)
+        data = build_data(options.depth, options.fanout, options.documents,
+                options.sources)
+        results = run_benchmarks(data, options.repeat, options.names)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    params.update(groups=data['groups'])
+    output = {'params': params, 'environment': environment(),
+            'results': results}
+    for name in sorted(results):
+        result = results[name]
+        sys.stdout.write('{0:32} {1:10.4f}s {2:6} queries\n'.format(name,
+            result['time_median'], result['queries']))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('params') != output['params']:
+            sys.stderr.write('Warning: baseline was run with {0}.\n'.format(
+                baseline.get('params')))
+        regressions = compare(results, baseline['results'],
+                options.tolerance)
+        for regression in regressions:
+            sys.stderr.write('Regression: {0}\n'.format(regression))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Tests for the benchmark harness, on a small data set.
+"""
+from django.test import TestCase
+from document_index.models import Group, Document, Source
+from document_index.tests import benchmarks
+from document_index.tests.factories import (GroupTreeListFactory,
+        DocumentFactory, SourceFactory)
+
+
+class BenchmarksTest(TestCase):
+
+    def tearDown(self):
+        # Later tests expect the factory sequences to start at 0.
+        for factory in (GroupTreeListFactory, DocumentFactory, SourceFactory):
+            factory.reset_sequence()
+
+    def test_build_data(self):
+        data = benchmarks.build_data(depth=2, fanout=3, documents=20,
+                sources=2)
+        self.assertEqual(data['groups'], 12)
+        self.assertEqual(Group.objects.count(), 12)
+        self.assertEqual(data['documents'], 20)
+        self.assertEqual(Source.objects.count(), 40)
+        self.assertEqual(set(Document.objects.values_list('source_count',
+            flat=True)), set([2]))
+
+    def test_run_benchmarks(self):
+        data = benchmarks.build_data(depth=2, fanout=2, documents=10)
+        results = benchmarks.run_benchmarks(data, repeat=2)
+        self.assertEqual(sorted(results), sorted(benchmark.name
+            for benchmark in benchmarks.BENCHMARKS))
+        for result in results.values():
+            self.assertEqual(result['repeat'], 2)
+            self.assertTrue(result['time_min'] <= result['time_median']
+                    <= result['time_max'])
+        self.assertEqual(results['document_values_serializer']['queries'],
+                2)
+        # Moved back and forth, so below the first root again.
+        moved = Group.objects.get(pk=data['moved'].pk)
+        root = Group.objects.get(pk=data['roots'][0].pk)
+        self.assertTrue(moved.path.startswith(root.path))
+        self.assertEqual(moved.depth, 2)
+
+    def test_run_named(self):
+        data = benchmarks.build_data(depth=1, fanout=2, documents=0)
+        results = benchmarks.run_benchmarks(data, repeat=1,
+                names=['group_list'])
+        self.assertEqual(list(results), ['group_list'])
+
+    def test_compare(self):
+        baseline = {
+            'a': {'time_median': 1.0, 'queries': 3},
+            'b': {'time_median': 1.0, 'queries': 3},
+        }
+        results = {
+            'a': {'time_median': 1.2, 'queries': 3},
+            'b': {'time_median': 1.3, 'queries': 4},
+            'c': {'time_median': 9.0, 'queries': 9},
+        }
+        regressions = benchmarks.compare(results, baseline)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(all(regression.startswith('b:')
+            for regression in regressions))
+        self.assertEqual(benchmarks.compare(results, baseline, 0.5), [
+            'b: 4 queries, baseline 3'])
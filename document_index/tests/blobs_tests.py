@@ -0,0 +1,216 @@
+"""
+Tests for the source file content store.
+"""
+import hashlib
+import io
+import os
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.db import DatabaseError
+from django.db.models import ProtectedError
+from django.test import TestCase
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+from document_index import blobs
+from document_index.models import (GroupTreeList, Group, Document, Source,
+        Blob)
+from document_index.views import SourceContent, SourceDetail
+
+CONTENT = b''.join(bytes(bytearray([i % 256])) for i in range(1000))
+
+
+class BlobStoreTest(TestCase):
+
+    def test_store(self):
+        blob, created = blobs.store(io.BytesIO(CONTENT), chunk_size=64)
+        self.assertTrue(created)
+        self.assertEqual(blob.sha256, hashlib.sha256(CONTENT).hexdigest())
+        self.assertEqual(blob.size, 1000)
+        path = blobs.blob_path(blob.sha256)
+        self.assertEqual(path[-len(blob.sha256) - 6:-len(blob.sha256)],
+                os.path.join(blob.sha256[:2], blob.sha256[2:4], ''))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+
+        again, created = blobs.store(io.BytesIO(CONTENT))
+        self.assertFalse(created)
+        self.assertEqual(again.pk, blob.pk)
+        self.assertEqual(os.listdir(os.path.join(blobs.blob_root(), 'tmp')),
+                [])
+
+    def test_receive_then_commit(self):
+        tmp_path, sha256, size = blobs.receive(io.BytesIO(CONTENT))
+        self.assertEqual((sha256, size),
+                (hashlib.sha256(CONTENT).hexdigest(), 1000))
+        # Nothing is in the database until the commit.
+        self.assertFalse(Blob.objects.exists())
+        blob, created = blobs.commit(tmp_path, sha256, size)
+        self.assertTrue(created)
+        self.assertFalse(os.path.exists(tmp_path))
+        with open(blobs.blob_path(sha256), 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+
+    def test_parse_range(self):
+        self.assertEqual(blobs.parse_range(None, 100), None)
+        self.assertEqual(blobs.parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(blobs.parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(blobs.parse_range('bytes=90-200', 100), (90, 99))
+        self.assertEqual(blobs.parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(blobs.parse_range('bytes=-200', 100), (0, 99))
+        # Multiple and malformed ranges are ignored.
+        self.assertEqual(blobs.parse_range('bytes=0-1,5-6', 100), None)
+        self.assertEqual(blobs.parse_range('bytes=9-1', 100), None)
+        with self.assertRaises(ValueError):
+            blobs.parse_range('bytes=100-', 100)
+
+    def test_iter_file(self):
+        blob, created = blobs.store(io.BytesIO(CONTENT))
+        path = blobs.blob_path(blob.sha256)
+        self.assertEqual(b''.join(blobs.iter_file(path, chunk_size=300)),
+                CONTENT)
+        self.assertEqual(b''.join(blobs.iter_file(path, 10, 709, 64)),
+                CONTENT[10:710])
+
+    def test_prune(self):
+        blob, created = blobs.store(io.BytesIO(CONTENT))
+        used, created = blobs.store(io.BytesIO(b'used'))
+        tree = GroupTreeList.objects.create(name='test')
+        user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        group = Group.add_root(tree_id=tree.id, owner=user, name='inbox')
+        document = Document.objects.create(group=group, name='doc')
+        Source.objects.create(document=document, name='page', blob=used)
+
+        self.assertEqual(blobs.prune(), 0)
+        Blob.objects.update(created=blob.created - timedelta(hours=2))
+        self.assertEqual(blobs.prune(), 1)
+        self.assertEqual(list(Blob.objects.values_list('sha256', flat=True)),
+                [used.sha256])
+        self.assertFalse(os.path.exists(blobs.blob_path(blob.sha256)))
+        with self.assertRaises(ProtectedError):
+            used.delete()
+
+    def test_store_after_prune(self):
+        """
+        Storing content again after its blob was pruned puts the file back.
+        """
+        blob, created = blobs.store(io.BytesIO(CONTENT))
+        Blob.objects.update(created=blob.created - timedelta(hours=2))
+        self.assertEqual(blobs.prune(), 1)
+        blob, created = blobs.store(io.BytesIO(CONTENT))
+        self.assertTrue(created)
+        with open(blobs.blob_path(blob.sha256), 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+        self.assertEqual(os.listdir(os.path.join(blobs.blob_root(), 'tmp')),
+                [])
+
+
+class SourceContentTest(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        tree = GroupTreeList.objects.create(name='test')
+        group = Group.add_root(tree_id=tree.id, owner=self.user,
+                name='inbox')
+        document = Document.objects.create(group=group, name='doc')
+        self.source = Source.objects.create(document=document, name='page')
+        self.other = Source.objects.create(document=document, name='copy',
+                sequence=2)
+
+    def put(self, source, user=None):
+        request = self.factory.put('/sources/{0}/content/'.format(source.pk),
+                CONTENT, content_type='application/pdf')
+        force_authenticate(request, user or self.user)
+        return SourceContent.as_view()(request, pk=source.pk)
+
+    def get(self, **headers):
+        request = self.factory.get('/sources/{0}/content/'.format(
+            self.source.pk), **headers)
+        response = SourceContent.as_view()(request, pk=self.source.pk)
+        if response.status_code == 200 or response.status_code == 206:
+            response.body = b''.join(response.streaming_content)
+        return response
+
+    def test_upload(self):
+        response = self.put(self.source)
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.data['deduplicated'])
+        response = self.put(self.other)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['deduplicated'])
+
+        self.assertEqual(Blob.objects.count(), 1)
+        source = Source.objects.get(pk=self.source.pk)
+        self.assertEqual(source.blob_id, response.data['sha256'])
+        self.assertEqual(source.mime_type, 'application/pdf')
+
+    def test_upload_one_transaction(self):
+        """
+        Storing the blob and linking the source commit together.
+        """
+        def fail(*args, **kwargs):
+            raise DatabaseError('link failed')
+        Source.save, save = fail, Source.__dict__['save']
+        try:
+            with self.assertRaises(DatabaseError):
+                self.put(self.source)
+        finally:
+            Source.save = save
+        self.assertFalse(Blob.objects.exists())
+
+    def test_blob_read_only(self):
+        blob, created = blobs.store(io.BytesIO(CONTENT))
+        Source.objects.filter(pk=self.source.pk).update(description='d',
+                comment='c', filename='f', mime_type='text/plain')
+        request = self.factory.patch('/sources/{0}/'.format(self.source.pk),
+                {'blob': blob.sha256}, format='json')
+        force_authenticate(request, self.user)
+        response = SourceDetail.as_view()(request, pk=self.source.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Source.objects.get(pk=self.source.pk).blob_id, None)
+
+    def test_upload_needs_write_access(self):
+        other = User.objects.create_user(
+                username='other', email='other@_', password='secret')
+        self.assertEqual(self.put(self.source, other).status_code, 403)
+
+    def test_download(self):
+        self.assertEqual(self.get().status_code, 404)
+        self.put(self.source)
+
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.body, CONTENT)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        etag = response['ETag']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_range(self):
+        self.put(self.source)
+        response = self.get(HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.body, CONTENT[100:200])
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/1000')
+        self.assertEqual(response['Content-Length'], '100')
+
+        # A stale If-Range gets the whole file.
+        response = self.get(HTTP_RANGE='bytes=100-199', HTTP_IF_RANGE='"x"')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.get(HTTP_RANGE='bytes=1000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1000')
+
+    @override_settings(DOCUMENT_INDEX_BLOB_SENDFILE='X-Accel-Redirect',
+            DOCUMENT_INDEX_BLOB_SENDFILE_PREFIX='/protected/')
+    def test_sendfile(self):
+        response = self.put(self.source)
+        sha256 = response.data['sha256']
+        request = self.factory.get('/sources/{0}/content/'.format(
+            self.source.pk))
+        response = SourceContent.as_view()(request, pk=self.source.pk)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' +
+                blobs.relative_path(sha256))
@@ -0,0 +1,331 @@
+"""
+Tests for bulk group tree import and export.
+"""
+import json
+import os
+import tempfile
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import six
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate
+from document_index.bulk import (ingest_documents, iter_tree_json,
+        load_tree, validate_tree)
+from document_index.models import (GroupTreeList, Group, Document, Source,
+        ChangeLog, SearchTerm, GroupACL, Job)
+from document_index.plans import CaptureQueries
+from document_index.search import search
+from document_index.tasks import load_tree_task
+from document_index.views import DocumentBulkCreate, GroupTree
+
+TREE_DATA = [
+    {'name': 'projects', 'description': 'All projects', 'children': [
+        {'name': 'zeta', 'children': [
+            {'name': 'specs'},
+            {'name': 'drawings', 'comment': 'scanned'},
+        ]},
+        {'name': 'alpha'},
+    ]},
+    {'name': 'archive'},
+]
+
+
+def normalize(data):
+    """
+    Fill defaults and sort siblings by name like the exporter does.
+    """
+    return sorted([{
+        'name': item['name'],
+        'description': item.get('description', ''),
+        'comment': item.get('comment', ''),
+        'children': normalize(item.get('children', [])),
+    } for item in data], key=lambda item: item['name'])
+
+
+class BulkTreeTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        self.tree = GroupTreeList.objects.create(name='test')
+
+    def assertTreeConsistent(self):
+        for problems in Group.find_problems():
+            self.assertEqual(problems, [])
+
+    def test_validate_tree(self):
+        self.assertEqual(validate_tree(TREE_DATA), [])
+        self.assertEqual(validate_tree({}),
+                ['tree: expected a list of groups.'])
+        errors = validate_tree([{'name': 'ok', 'children': [
+            {'description': 'no name'}, {'name': 'x' * 33}, 'bogus']}])
+        self.assertEqual(errors, [
+            '0.children.0.name: this field is required.',
+            '0.children.1.name: longer than 32 characters.',
+            '0.children.2: expected an object.',
+        ])
+
+    def test_load_roots(self):
+        tops = load_tree(TREE_DATA, self.user, self.tree.id)
+        self.assertEqual([top.name for top in tops], ['archive', 'projects'])
+        self.assertEqual(Group.objects.count(), 6)
+        self.assertTreeConsistent()
+        zeta = Group.objects.get(name='zeta')
+        self.assertEqual([child.name for child in zeta.get_children()],
+                ['drawings', 'specs'])
+        self.assertEqual(zeta.get_parent().name, 'projects')
+
+    def test_load_below_existing_children(self):
+        """
+        Top level nodes sort among existing siblings.
+        """
+        parent = Group.add_root(tree_id=self.tree.id, owner=self.user,
+                name='parent')
+        for name in ['b', 'd']:
+            Group.objects.get(id=parent.id).add_child(tree_id=self.tree.id,
+                    owner=self.user, name=name)
+        load_tree([{'name': 'c', 'children': [{'name': 'c1'}]},
+            {'name': 'a'}, {'name': 'e'}], self.user, self.tree.id, parent)
+        self.assertTreeConsistent()
+        parent = Group.objects.get(id=parent.id)
+        self.assertEqual([child.name for child in parent.get_children()],
+                ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(Group.objects.get(name='c').get_children()[0].name,
+                'c1')
+
+    def test_load_many(self):
+        """
+        INSERT batches stay within SQLite's limit of 999 parameters.
+        """
+        data = [{'name': 'root', 'children': [{'name': str(i)}
+            for i in range(150)]}]
+        with CaptureQueries() as captured:
+            load_tree(data, self.user, self.tree.id)
+        self.assertTrue(max(len(params)
+            for sql, params in captured.queries) <= 999)
+        self.assertEqual(Group.objects.count(), 151)
+        self.assertTreeConsistent()
+
+    def test_export_round_trip(self):
+        load_tree(TREE_DATA, self.user, self.tree.id)
+        paths = Group.get_root_nodes().values_list('path', flat=True)
+        for chunk_size in (500, 2):
+            exported = json.loads(''.join(iter_tree_json(list(paths),
+                chunk_size)))
+            self.assertEqual(exported, normalize(TREE_DATA))
+
+    def test_export_empty(self):
+        self.assertEqual(''.join(iter_tree_json([])), '[]')
+
+    def test_import_export_views(self):
+        factory = APIRequestFactory()
+        view = GroupTree.as_view()
+
+        request = factory.post('/groups/0/tree/', TREE_DATA, format='json')
+        force_authenticate(request, self.user)
+        response = view(request, pk=0)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 6)
+
+        projects = Group.objects.get(name='projects')
+        request = factory.get('/groups/tree/')
+        force_authenticate(request, self.user)
+        response = view(request, pk=projects.id)
+        exported = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual(exported, normalize(TREE_DATA[0]['children']))
+
+    def test_import_needs_write_access(self):
+        owner = User.objects.create_user(
+                username='owner', email='owner@_', password='secret')
+        tree = GroupTreeList.objects.create(name='owner')
+        parent = Group.add_root(tree_id=tree.id, owner=owner, name='inbox')
+        factory = APIRequestFactory()
+        for url in ('/groups/{0}/tree/', '/groups/{0}/tree/?async=1'):
+            request = factory.post(url.format(parent.id), TREE_DATA,
+                    format='json')
+            force_authenticate(request, self.user)
+            response = GroupTree.as_view()(request, pk=parent.id)
+            self.assertEqual(response.status_code,
+                    status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Group.objects.count(), 1)
+        self.assertEqual(Job.objects.count(), 0)
+
+        # Shared for writing: the groups go to the tree of the parent.
+        GroupACL.objects.create(group=parent, user=self.user,
+                can_write=True)
+        request = factory.post('/groups/{0}/tree/?async=1'.format(
+            parent.id), TREE_DATA, format='json')
+        force_authenticate(request, self.user)
+        response = GroupTree.as_view()(request, pk=parent.id)
+        self.assertEqual(response.data['status'], Job.DONE)
+        self.assertEqual(set(Group.objects.values_list('tree', flat=True)),
+                set([tree.id]))
+
+        # Revoked before a queued job runs.
+        GroupACL.objects.all().delete()
+        self.assertRaises(PermissionDenied, load_tree_task, TREE_DATA,
+                self.user.pk, None, parent.id)
+
+    def test_import_command(self):
+        other = GroupTreeList.objects.create(name='other')
+        parent = Group.add_root(tree_id=other.id, owner=self.user,
+                name='inbox')
+        handle, path = tempfile.mkstemp()
+        with os.fdopen(handle, 'w') as f:
+            json.dump(TREE_DATA, f)
+        try:
+            call_command('import_groups', path, user='test',
+                    parent=parent.id, stdout=six.StringIO())
+            call_command('import_groups', path, user='test',
+                    stdout=six.StringIO())
+        finally:
+            os.remove(path)
+        self.assertTreeConsistent()
+        # Below a parent the groups go to the tree of the parent.
+        self.assertEqual(set(Group.objects.get(id=parent.id).get_descendants(
+            ).values_list('tree', flat=True)), set([other.id]))
+        self.assertEqual(set(Group.get_root_nodes().exclude(
+            id=parent.id).values_list('tree', flat=True)), set([self.tree.id]))
+
+    def test_import_view_invalid(self):
+        factory = APIRequestFactory()
+        request = factory.post('/groups/0/tree/', [{'name': ''}],
+                format='json')
+        force_authenticate(request, self.user)
+        response = GroupTree.as_view()(request, pk=0)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Group.objects.count(), 0)
+
+
+class DocumentIngestTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        self.tree = GroupTreeList.objects.create(name='test')
+        self.group = Group.add_root(tree_id=self.tree.id, owner=self.user,
+                name='inbox')
+
+    def test_ingest_documents(self):
+        results = ingest_documents([
+            {'group': self.group.id, 'name': 'Invoice', 'sources': [
+                {'name': 'page 1', 'filename': 'p1.tif'},
+                {'name': 'page 2', 'filename': 'p2.tif'},
+            ]},
+            {'group': 999, 'name': 'Orphan'},
+            {'group': self.group.id, 'name': 'Letter', 'comment': 7},
+            {'group': self.group.id, 'name': 'Memo'},
+        ])
+        self.assertEqual([sorted(result) for result in results], [
+            ['document_id', 'row'], ['errors', 'row'], ['errors', 'row'],
+            ['document_id', 'row']])
+        self.assertEqual(results[1]['errors'],
+                ['group: expected the id of an existing group.'])
+        self.assertEqual(results[2]['errors'], ['comment: expected a string.'])
+
+        invoice = Document.objects.get(document_id=results[0]['document_id'])
+        self.assertEqual(invoice.source_count, 2)
+        self.assertEqual(list(invoice.sources.order_by('sequence')
+            .values_list('filename', 'sequence')), [('p1.tif', 1),
+                ('p2.tif', 2)])
+        self.assertEqual(Document.objects.count(), 2)
+        self.assertEqual([document_id for document_id, _ in search('p2')],
+                [invoice.pk])
+
+    def test_ingest_view_ndjson(self):
+        body = '\n'.join([
+            json.dumps({'group': self.group.id, 'name': 'One'}),
+            '{not json',
+            '',
+            json.dumps({'group': self.group.id, 'name': 'Two',
+                'sources': [{'name': 'scan'}]}),
+        ])
+        request = APIRequestFactory().post('/documents/bulk/', body,
+                content_type='application/x-ndjson')
+        force_authenticate(request, self.user)
+        response = DocumentBulkCreate.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 1)
+        self.assertEqual(response.data['results'][1]['row'], 1)
+        self.assertEqual(Source.objects.count(), 1)
+
+    def test_ingest_needs_write_access(self):
+        other = User.objects.create_user(
+                username='other', email='other@_', password='secret')
+        tree = GroupTreeList.objects.create(name='other')
+        shared = Group.add_root(tree_id=tree.id, owner=other, name='shared')
+        GroupACL.objects.create(group=shared, user=self.user)
+        rows = [{'group': shared.id, 'name': 'Read only'},
+                {'group': self.group.id, 'name': 'Own'}]
+        for url in ('/documents/bulk/', '/documents/bulk/?async=1'):
+            request = APIRequestFactory().post(url, rows, format='json')
+            force_authenticate(request, self.user)
+            response = DocumentBulkCreate.as_view()(request)
+            if 'job_id' in response.data:
+                results = json.loads(Job.objects.get(
+                    id=response.data['job_id']).result)
+            else:
+                results = response.data['results']
+            self.assertEqual(results[0]['errors'],
+                    ['group: write access required.'])
+            self.assertTrue('document_id' in results[1])
+        self.assertFalse(Document.objects.filter(group=shared).exists())
+
+    def test_ingest_view_invalid_encoding(self):
+        body = b'\n'.join([json.dumps({'group': self.group.id,
+            'name': 'One'}).encode('utf-8'), b'{"name": "\xff"}'])
+        request = APIRequestFactory().post('/documents/bulk/', body,
+                content_type='application/x-ndjson')
+        force_authenticate(request, self.user)
+        response = DocumentBulkCreate.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['failed'], 1)
+        self.assertTrue(response.data['results'][1]['errors'][0].startswith(
+            'Encoding error'))
+
+    def test_ingest_batches(self):
+        rows = [{'group': self.group.id, 'name': str(i),
+            'sources': [{'name': 'scan'}]} for i in range(3)]
+        ingest_documents(rows, batch_size=2)
+        self.assertEqual(ChangeLog.objects.filter(model='source').count(), 3)
+        self.assertEqual(SearchTerm.objects.filter(term='scan').count(), 3)
+
+    def test_ingest_many_groups(self):
+        """
+        Group id lists stay within SQLite's limit of 999 parameters.
+        """
+        rows = [{'group': self.group.id + i, 'name': str(i)}
+                for i in range(1200)]
+        with CaptureQueries() as captured:
+            results = ingest_documents(rows)
+        self.assertTrue(max(len(params)
+            for sql, params in captured.queries) <= 999)
+        self.assertTrue('document_id' in results[0])
+        self.assertEqual(results[1]['errors'],
+                ['group: expected the id of an existing group.'])
+
+    def test_ingest_many_sources(self):
+        """
+        INSERT batches stay within SQLite's limit of 999 parameters.
+        """
+        rows = [{'group': self.group.id, 'name': 'Scan {0}'.format(i),
+            'sources': [{'name': 'page {0}'.format(j)} for j in range(60)]}
+            for i in range(2)]
+        with CaptureQueries() as captured:
+            results = ingest_documents(rows)
+        self.assertTrue(max(len(params)
+            for sql, params in captured.queries) <= 999)
+        self.assertTrue(all('document_id' in result for result in results))
+        self.assertEqual(Source.objects.count(), 120)
+        self.assertEqual(SearchTerm.objects.filter(term='page').count(), 2)
+
+    def test_ingest_view_not_a_list(self):
+        request = APIRequestFactory().post('/documents/bulk/',
+                {'name': 'x'}, format='json')
+        force_authenticate(request, self.user)
+        response = DocumentBulkCreate.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
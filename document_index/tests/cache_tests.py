@@ -0,0 +1,90 @@
+"""
+Tests for the per user tree lookup cache.
+"""
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+from document_index import cache as tree_cache
+from document_index.bulk import load_tree
+from document_index.models import GroupTreeList, Group
+
+
+class TreeCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+
+    def test_tree_id(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(tree_cache.get_tree_id('test'), None)
+        with self.assertNumQueries(0):
+            self.assertEqual(tree_cache.get_tree_id('test'), None)
+
+        # Creating the tree invalidates the cached miss.
+        tree = GroupTreeList.objects.create(name='test')
+        self.assertEqual(tree_cache.get_tree_id('test'), tree.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(tree_cache.get_tree_id('test'), tree.id)
+
+        tree.delete()
+        self.assertEqual(tree_cache.get_tree_id('test'), None)
+
+    @override_settings(DOCUMENT_INDEX_SHARED_CACHE=False)
+    def test_per_process_cache(self):
+        """
+        Without a shared cache both lookups read the database every time.
+        """
+        tree = GroupTreeList.objects.create(name='test')
+        Group.add_root(tree_id=tree.id, owner=self.user, name='m')
+        for i in range(2):
+            with self.assertNumQueries(1):
+                self.assertEqual(tree_cache.get_tree_id('test'), tree.id)
+            with self.assertNumQueries(1):
+                self.assertEqual(len(tree_cache.get_root_paths(tree.id)), 1)
+        self.assertFalse(tree_cache.is_shared())
+
+    def test_shared(self):
+        cache_settings = {'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with self.settings(DOCUMENT_INDEX_SHARED_CACHE=None,
+                CACHES=cache_settings):
+            self.assertFalse(tree_cache.is_shared())
+        cache_settings['default']['BACKEND'] = \
+                'django.core.cache.backends.memcached.MemcachedCache'
+        with self.settings(DOCUMENT_INDEX_SHARED_CACHE=None,
+                CACHES=cache_settings):
+            self.assertTrue(tree_cache.is_shared())
+
+    def test_root_paths(self):
+        tree = GroupTreeList.objects.create(name='test')
+        other = GroupTreeList.objects.create(name='other')
+        Group.add_root(tree_id=tree.id, owner=self.user, name='m')
+        with self.assertNumQueries(1):
+            paths = tree_cache.get_root_paths(tree.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(tree_cache.get_root_paths(tree.id), paths)
+
+        # A root sorted before 'm' in another tree shifts its path.
+        Group.add_root(tree_id=other.id, owner=self.user, name='a')
+        self.assertEqual(tree_cache.get_root_paths(tree.id),
+                [Group.objects.get(name='m').path])
+
+        # Child nodes do not touch root paths.
+        hits = tree_cache.stats['hits']
+        Group.objects.get(name='m').add_child(tree_id=tree.id,
+                owner=self.user, name='child')
+        tree_cache.get_root_paths(tree.id)
+        self.assertEqual(tree_cache.stats['hits'], hits + 1)
+
+        Group.objects.get(name='a').delete()
+        self.assertEqual(tree_cache.get_root_paths(tree.id),
+                [Group.objects.get(name='m').path])
+
+    def test_bulk_load_invalidates_roots(self):
+        tree = GroupTreeList.objects.create(name='test')
+        self.assertEqual(tree_cache.get_root_paths(tree.id), [])
+        load_tree([{'name': 'x'}], self.user, tree.id)
+        self.assertEqual(len(tree_cache.get_root_paths(tree.id)), 1)
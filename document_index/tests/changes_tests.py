@@ -0,0 +1,152 @@
+"""
+Tests for the change feed.
+"""
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import six, timezone
+from rest_framework.test import APIRequestFactory
+from document_index import changes
+from document_index.models import (GroupTreeList, Group, Document, Source,
+        ChangeLog)
+from document_index.bulk import ingest_documents, load_tree
+from document_index.move import delete_subtree, move_nodes
+from document_index.views import ChangeFeed
+
+
+class ChangeFeedTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        self.tree = GroupTreeList.objects.create(name='test')
+        self.inbox = Group.add_root(tree_id=self.tree.id, owner=self.user,
+                name='inbox')
+        self.start = changes.latest_id()
+
+    def since(self, change_id=None):
+        return changes.encode_token(self.start if change_id is None
+                else change_id)
+
+    def feed(self, **params):
+        request = APIRequestFactory().get('/changes/', params)
+        response = ChangeFeed.as_view()(request)
+        response.render()
+        return response
+
+    def actions(self, since_id=None):
+        result, _ = changes.get_changes(self.start if since_id is None
+                else since_id)
+        return [(change.model, change.object_id, change.action)
+                for change in result]
+
+    def test_signals(self):
+        document = Document(group=self.inbox, name='doc')
+        document.save()
+        source = Source(document=document, sequence=1, name='page')
+        source.save()
+        document.name = 'renamed'
+        document.save()
+        document_id, source_id = document.pk, source.pk
+        document.delete()
+        self.assertEqual(self.actions(), [
+            ('document', document_id, ChangeLog.INSERT),
+            ('source', source_id, ChangeLog.INSERT),
+            ('document', document_id, ChangeLog.UPDATE),
+            ('source', source_id, ChangeLog.DELETE),
+            ('document', document_id, ChangeLog.DELETE),
+        ])
+
+    def test_bulk_writes(self):
+        top, = load_tree([{'name': 'a', 'children': [{'name': 'b'}]}],
+                self.user, self.tree.id, parent=self.inbox)
+        child = Group.objects.get(name='b')
+        self.assertEqual(self.actions(), [
+            ('group', top.pk, ChangeLog.INSERT),
+            ('group', child.pk, ChangeLog.INSERT),
+        ])
+
+        start = changes.latest_id()
+        results = ingest_documents([{'group': self.inbox.pk, 'name': 'doc',
+            'sources': [{'name': 'p1'}, {'name': 'p2'}]}])
+        document = Document.objects.get(pk=results[0]['document_id'])
+        source_ids = list(Source.objects.filter(document=document).order_by(
+            'source_id').values_list('source_id', flat=True))
+        self.assertEqual(self.actions(start), [
+            ('document', document.pk, ChangeLog.INSERT)] + [
+            ('source', source_id, ChangeLog.INSERT)
+            for source_id in source_ids])
+        document.delete()
+
+        start = changes.latest_id()
+        move_nodes([top.pk], 0)
+        delete_subtree(top.pk)
+        self.assertEqual(self.actions(start), [
+            ('group', top.pk, ChangeLog.MOVE),
+            ('group', top.pk, ChangeLog.DELETE),
+            ('group', child.pk, ChangeLog.DELETE),
+        ])
+
+    def test_late_commit(self):
+        first = ChangeLog.objects.order_by('-id')[0].id + 1
+        ChangeLog.objects.create(id=first + 1, model='group', object_id=1,
+                action=ChangeLog.UPDATE)
+        result, token = changes.get_changes(self.start)
+        self.assertEqual([change.id for change in result], [first + 1])
+
+        # A transaction holding a lower id commits long after.
+        ChangeLog.objects.create(id=first, model='group', object_id=2,
+                action=ChangeLog.UPDATE,
+                created=timezone.now() - timedelta(hours=1))
+        result, last = changes.get_changes(token)
+        self.assertEqual([change.id for change in result], [first])
+        self.assertTrue(last > token)
+        self.assertEqual(changes.latest_id(), last)
+        self.assertEqual(changes.get_changes(last), ([], last))
+
+    def test_feed(self):
+        response = self.feed()
+        self.assertEqual(response.data['changes'], [])
+        token = response.data['since']
+        self.assertEqual(changes.decode_token(token), self.start)
+
+        for i in range(3):
+            Document(group=self.inbox, name='doc {0}'.format(i)).save()
+        response = self.feed(since=token, limit=2)
+        self.assertEqual([change['action'] for change in
+            response.data['changes']], [ChangeLog.INSERT] * 2)
+        self.assertTrue(response.data['more'])
+        response = self.feed(since=response.data['since'], limit=2)
+        self.assertEqual(len(response.data['changes']), 1)
+        self.assertFalse(response.data['more'])
+        self.assertEqual(response.data['changes'][0]['model'], 'document')
+
+        response = self.feed(since=response.data['since'])
+        self.assertEqual(response.data['changes'], [])
+
+    def test_wait(self):
+        changes.POLL_INTERVAL, interval = 0.01, changes.POLL_INTERVAL
+        try:
+            response = self.feed(since=self.since(), wait='0.05')
+        finally:
+            changes.POLL_INTERVAL = interval
+        self.assertEqual(response.data['changes'], [])
+        self.assertEqual(response.data['since'], self.since())
+
+    def test_invalid(self):
+        self.assertEqual(self.feed(since='garbage').status_code, 400)
+        self.assertEqual(self.feed(since=changes.encode_token('x')
+            ).status_code, 400)
+        self.assertEqual(self.feed(limit='0').status_code, 400)
+        self.assertEqual(self.feed(wait='-1').status_code, 400)
+
+    def test_prune(self):
+        Document(group=self.inbox, name='doc').save()
+        ChangeLog.objects.filter(id__lte=self.start).update(
+                created=timezone.now() - timedelta(days=40))
+        out = six.StringIO()
+        call_command('prune_changes', days=30, stdout=out)
+        self.assertEqual(out.getvalue().strip(),
+                '{0} change(s) deleted.'.format(self.start))
+        self.assertEqual(ChangeLog.objects.count(), 1)
@@ -0,0 +1,113 @@
+"""
+Tests for the streaming document export.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import six, timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from document_index.export import export_documents, iter_documents
+from document_index.models import GroupTreeList, Group, Document, Source
+from document_index.views import DocumentExport
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        tree = GroupTreeList.objects.create(name='test')
+        self.inbox = Group.add_root(tree_id=tree.id, owner=self.user,
+                name='inbox')
+        self.archive = Group.add_root(tree_id=tree.id, owner=self.user,
+                name='archive')
+        self.documents = []
+        for i in range(5):
+            group = self.inbox if i % 2 else self.archive
+            document = Document(group=group, name=u'Doc \xe9 {0}'.format(i))
+            document.save()
+            for sequence in range(1, i % 3 + 1):
+                Source(document=document, sequence=sequence,
+                        name='page {0}'.format(sequence),
+                        filename='p{0}.tif'.format(sequence)).save()
+            self.documents.append(document)
+
+    def test_chunks(self):
+        with self.assertNumQueries(6):
+            chunks = list(iter_documents(chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        document, sources = chunks[0][1]
+        self.assertEqual(dict(document)['name'], u'Doc \xe9 1')
+        self.assertEqual([dict(source)['filename'] for source in sources],
+                ['p1.tif'])
+
+    def test_ndjson(self):
+        rows = [json.loads(line) for line in
+                ''.join(export_documents(chunk_size=2)).splitlines()]
+        self.assertEqual([row['document_id'] for row in rows],
+                [document.pk for document in self.documents])
+        self.assertEqual(len(rows[0]['sources']), 0)
+        self.assertEqual([source['sequence'] for source in rows[2]['sources']],
+                [1, 2])
+        self.assertEqual(rows[2]['group_id'], self.archive.id)
+        self.assertTrue(rows[0]['created'].endswith('Z'))
+
+    def test_filters(self):
+        rows = list(export_documents(group=Group.objects.get(name='inbox')))
+        self.assertEqual(len(''.join(rows).splitlines()), 2)
+        later = timezone.now() + timedelta(hours=1)
+        self.assertEqual(''.join(export_documents(modified_after=later)), '')
+
+    def test_csv_gzip_view(self):
+        request = APIRequestFactory().get(
+                '/documents/export/?output=csv&gzip=1')
+        force_authenticate(request, self.user)
+        response = DocumentExport.as_view()(request)
+        self.assertEqual(response['Content-Disposition'],
+                'attachment; filename=documents.csv.gz')
+        data = gzip.GzipFile(fileobj=io.BytesIO(
+            b''.join(response.streaming_content))).read()
+        if six.PY3:
+            data = data.decode('utf-8')
+        rows = list(csv.reader(io.BytesIO(data) if six.PY2 else
+            io.StringIO(data)))
+        self.assertEqual(rows[0][:2], ['document_id', 'document_group_id'])
+        # One row per source, one for each document without sources.
+        self.assertEqual(len(rows), 1 + 1 + 1 + 2 + 1 + 1)
+
+    def test_view_invalid(self):
+        factory = APIRequestFactory()
+        for url, status_code in [('/?output=xml', 400), ('/?group=999', 404),
+                ('/?modified_after=yesterday', 400),
+                ('/?modified_before=2014-13-01T00:00:00', 400)]:
+            request = factory.get(url)
+            force_authenticate(request, self.user)
+            self.assertEqual(DocumentExport.as_view()(request).status_code,
+                    status_code)
+
+    def test_command(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            call_command('export_documents', format='csv', gzip=True,
+                    group=self.archive.id, chunk_size=1, output=path)
+            with gzip.open(path) as f:
+                lines = f.read().splitlines()
+        finally:
+            os.remove(path)
+        # Header and documents 0, 2 and 4 with 0, 2 and 1 sources.
+        self.assertEqual(len(lines), 1 + 1 + 2 + 1)
+
+    def test_command_invalid(self):
+        for options in [{'modified_after': '2014-13-01T00:00:00'},
+                {'chunk_size': 1000}, {'chunk_size': 0}]:
+            with self.assertRaises(CommandError):
+                call_command('export_documents', **options)
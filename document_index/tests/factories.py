@@ -1,6 +1,6 @@
 import factory
 from django.contrib.auth.models import Group, Permission, User
-from document_index.models import GroupTreeList, Group
+from document_index.models import GroupTreeList, Group, Document, Source
 
 
 class UserFactory(factory.Factory):
@@ -25,3 +25,21 @@ class GroupFactory(factory.Factory):
     name = 'Test Group'
     description = 'Group for running tests'
     comment = 'Comment for test group'
+
+
+class DocumentFactory(factory.Factory):
+    FACTORY_FOR = Document
+
+    name = factory.Sequence(lambda n: 'Document {0}'.format(n))
+    description = factory.Sequence(lambda n: 'Description {0}'.format(n))
+    comment = 'Comment for test document'
+
+
+class SourceFactory(factory.Factory):
+    FACTORY_FOR = Source
+
+    name = factory.Sequence(lambda n: 'Source {0}'.format(n))
+    description = factory.Sequence(lambda n: 'Description {0}'.format(n))
+    filename = factory.Sequence(lambda n: 'source{0}.pdf'.format(n))
+    mime_type = 'application/pdf'
+    comment = 'Comment for test source'
@@ -0,0 +1,135 @@
+"""
+Tests for the values_list() based list serializers. Their output must be
+byte identical to that of the DRF serializers.
+"""
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework import generics
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+from document_index.models import (GroupTreeList, Group, Document, Source,
+        Blob)
+from document_index.serializers import (GroupSerializer, DocumentSerializer,
+        UserSerializer)
+from document_index.fastserializers import (GroupValuesSerializer,
+        DocumentValuesSerializer, UserValuesSerializer)
+from document_index.pagination import KeysetPaginationMixin
+from document_index.views import DocumentList, UserList
+
+
+class PagedDocumentList(DocumentList):
+    paginate_by = 2
+
+
+class PlainDocumentList(KeysetPaginationMixin, generics.ListAPIView):
+    queryset = DocumentList.queryset
+    serializer_class = DocumentSerializer
+    keyset_fields = DocumentList.keyset_fields
+    paginate_by = 2
+
+
+class ValuesSerializerTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        User.objects.create_user(username='other', email='other@_')
+        self.tree = GroupTreeList.objects.create(name='test')
+        self.root = Group.add_root(tree_id=self.tree.id, owner=self.user,
+                name='root', description='root description', comment='')
+        self.child = self.root.add_child(tree_id=self.tree.id,
+                owner=self.user, name=u'caf\xe9', description='',
+                comment='child comment')
+        blob = Blob.objects.create(sha256='ab' * 32, size=3)
+        for i in range(5):
+            document = Document.objects.create(group=self.child,
+                    name=u'document \xfc {0}'.format(i),
+                    description='description', comment='comment')
+            for j in range(i % 3):
+                Source.objects.create(document=document,
+                        name='source {0}'.format(j), description='',
+                        filename='file.pdf', mime_type='application/pdf',
+                        comment='', blob=blob if j else None)
+        self.request = APIRequestFactory().get('/')
+        self.context = {'request': self.request, 'format': None}
+
+    def assertSameJSON(self, expected, data):
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(expected), renderer.render(data))
+
+    def test_documents(self):
+        queryset = Document.objects.select_related('group').prefetch_related(
+                'sources').order_by('document_id')
+        serializer = DocumentValuesSerializer(self.context)
+        self.assertSameJSON(
+                DocumentSerializer(queryset, many=True,
+                    context=self.context).data,
+                serializer.serialize(serializer.rows(queryset)))
+
+    def test_documents_queries(self):
+        serializer = DocumentValuesSerializer(self.context)
+        with self.assertNumQueries(2):
+            data = serializer.serialize(serializer.rows(
+                Document.objects.all()))
+        self.assertEqual(len(data), 5)
+        self.assertEqual(serializer.serialize([]), [])
+
+    def test_groups(self):
+        queryset = Group.objects.select_related('owner').order_by('path')
+        child_counts = {self.root.pk: 7}
+        context = dict(self.context, child_counts=child_counts)
+        serializer = GroupValuesSerializer(context)
+        self.assertSameJSON(
+                GroupSerializer(queryset, many=True, context=context).data,
+                serializer.serialize(serializer.rows(queryset)))
+
+    def test_users(self):
+        queryset = User.objects.order_by('id')
+        serializer = UserValuesSerializer(self.context)
+        self.assertSameJSON(
+                UserSerializer(queryset, many=True, context=self.context).data,
+                serializer.serialize(serializer.rows(queryset)))
+
+    def test_row_attributes(self):
+        row = DocumentValuesSerializer.rows(Document.objects.all())[0]
+        document = Document.objects.get(pk=row.pk)
+        self.assertEqual(row.group_id, self.child.pk)
+        self.assertEqual(row.created, document.created)
+
+    def test_iter_rows(self):
+        """
+        Each chunk is read with its own query, in key order.
+        """
+        queryset = Document.objects.all()
+        fields = DocumentList.keyset_fields
+        with self.assertNumQueries(3):
+            chunks = list(DocumentValuesSerializer.iter_rows(queryset,
+                fields, chunk_size=2))
+        self.assertEqual([len(rows) for rows in chunks], [2, 2, 1])
+        self.assertEqual([row.pk for rows in chunks for row in rows],
+                list(queryset.order_by(*fields).values_list('pk',
+                    flat=True)))
+
+    def get(self, view, url):
+        response = view.as_view()(APIRequestFactory().get(url))
+        response.render()
+        return response
+
+    def test_page_number_pagination(self):
+        for url in ('/documents/', '/documents/?page=2',
+                '/documents/?page=3'):
+            self.assertEqual(self.get(PlainDocumentList, url).content,
+                    self.get(PagedDocumentList, url).content)
+
+    def test_keyset_pagination(self):
+        url = '/documents/?cursor='
+        while url:
+            response = self.get(PagedDocumentList, url)
+            self.assertEqual(self.get(PlainDocumentList, url).content,
+                    response.content)
+            url = response.data['next']
+
+    def test_unpaginated_list(self):
+        response = self.get(UserList, '/users/')
+        self.assertEqual(sorted(user['username'] for user in response.data),
+                ['other', 'test'])
@@ -0,0 +1,78 @@
+"""
+Tests for the Group path integrity checker.
+"""
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+from document_index.bulk import load_tree
+from document_index.integrity import (check_tree, explain_path_query,
+        iter_nodes)
+from document_index.models import GroupTreeList, Group
+
+TREE_DATA = [
+    {'name': 'a', 'children': [
+        {'name': 'a1', 'children': [{'name': 'a1x'}, {'name': 'a1y'}]},
+        {'name': 'a2'},
+    ]},
+    {'name': 'b', 'children': [{'name': 'b1'}]},
+]
+
+
+class IntegrityTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        self.tree = GroupTreeList.objects.create(name='test')
+        load_tree(TREE_DATA, self.user, self.tree.id)
+
+    def test_iter_nodes_chunks(self):
+        paths = [row[1] for row in iter_nodes('', chunk_size=2)]
+        self.assertEqual(paths, list(Group.objects.order_by(
+            'path').values_list('path', flat=True)))
+        a1 = Group.objects.get(name='a1')
+        self.assertEqual(len(list(iter_nodes(a1.path, chunk_size=1))), 3)
+
+    def test_consistent_tree(self):
+        report = check_tree(self.tree.id, chunk_size=2)
+        self.assertTrue(report.ok)
+        self.assertEqual(report.checked, 7)
+
+    def test_repair(self):
+        Group.objects.filter(name='a1').update(numchild=5)
+        Group.objects.filter(name='b').update(numchild=0)
+        Group.objects.filter(name='a1x').update(depth=7)
+
+        report = check_tree(chunk_size=2)
+        self.assertEqual(len(report.problems), 3)
+        self.assertEqual(report.fixed, 0)
+
+        report = check_tree(self.tree.id, repair=True, chunk_size=2)
+        self.assertEqual(report.fixed, 3)
+        self.assertTrue(check_tree(self.tree.id).ok)
+        for problems in Group.find_problems():
+            self.assertEqual(problems, [])
+
+    def test_orphan(self):
+        a1 = Group.objects.get(name='a1')
+        Group.objects.filter(id=a1.id).update(path=a1.path + '0000')
+        problems = check_tree().problems
+        # a1 is an orphan with wrong depth and numchild now, a1x and a1y
+        # lost their parent and a lost a child.
+        expected = Group.objects.filter(name__in=['a', 'a1', 'a1x', 'a1y'])
+        self.assertEqual(sorted(set(group_id for group_id, _ in problems)),
+                sorted(expected.values_list('id', flat=True)))
+        self.assertEqual(len(problems), 6)
+
+    def test_explain(self):
+        uses_index, plan = explain_path_query()
+        self.assertTrue(plan)
+        self.assertTrue(uses_index)
+
+    def test_command(self):
+        Group.objects.filter(name='a2').update(numchild=1)
+        out = StringIO()
+        call_command('check_groups', repair=True, stdout=out)
+        self.assertIn('7 node(s) checked, 1 problem(s), 1 fixed.',
+                out.getvalue())
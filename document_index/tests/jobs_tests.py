@@ -0,0 +1,209 @@
+"""
+Tests for the database backed job queue.
+"""
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.db import DatabaseError
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from document_index import jobs
+from document_index.models import (GroupTreeList, Group, Document, Job,
+        GroupACL)
+from document_index.views import DocumentBulkCreate, JobDetail
+
+calls = []
+
+
+@jobs.task('test_flaky')
+def flaky(fail):
+    calls.append(fail)
+    if fail == 'database':
+        raise DatabaseError('Lock timeout.')
+    if fail == 'value':
+        raise ValueError('Bad argument.')
+    jobs.report_progress(1, 2)
+    return {'ok': True}
+
+
+@jobs.task('test_reclaimed')
+def reclaimed():
+    # The lease expired and another worker claimed the job meanwhile.
+    Job.objects.filter(id=jobs._local.job_id).update(worker='other')
+    return {'ok': True}
+
+
+@override_settings(DOCUMENT_INDEX_JOBS_EAGER=False)
+class JobQueueTest(TestCase):
+
+    def setUp(self):
+        del calls[:]
+
+    def due(self, job):
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+
+    def test_run(self):
+        job = jobs.submit('test_flaky', None)
+        self.assertEqual(job.status, jobs.PENDING)
+        self.assertEqual(jobs.claim_next(), job.id)
+        self.assertEqual(jobs.claim_next(), None)
+        jobs.run(job.id)
+        job = jobs.get_job(job.id)
+        self.assertEqual(job.status, jobs.DONE)
+        self.assertEqual((job.progress, job.total), (1, 2))
+        self.assertEqual(job.result, '{"ok": true}')
+
+    def test_retry(self):
+        job = jobs.submit('test_flaky', 'database', max_attempts=2)
+        jobs.run(jobs.claim_next())
+        job = jobs.get_job(job.id)
+        self.assertEqual(job.status, jobs.PENDING)
+        self.assertEqual(job.error, 'Lock timeout.')
+        self.assertTrue(job.run_after >= timezone.now() +
+                timedelta(seconds=jobs.RETRY_DELAY - 1))
+        # Not due yet.
+        self.assertEqual(jobs.claim_next(), None)
+
+        self.due(job)
+        jobs.run(jobs.claim_next())
+        job = jobs.get_job(job.id)
+        self.assertEqual(job.status, jobs.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(calls, ['database', 'database'])
+
+    def test_no_retry_on_bad_arguments(self):
+        job = jobs.submit('test_flaky', 'value')
+        jobs.run(jobs.claim_next())
+        job = jobs.get_job(job.id)
+        self.assertEqual(job.status, jobs.FAILED)
+        self.assertEqual(job.attempts, 1)
+
+    def test_retry_delay(self):
+        self.assertEqual([jobs._retry_delay(n) for n in (1, 2, 3)],
+                [jobs.RETRY_DELAY, jobs.RETRY_DELAY * 2, jobs.RETRY_DELAY * 4])
+        self.assertEqual(jobs._retry_delay(100), jobs.MAX_RETRY_DELAY)
+
+    def test_idempotency_key(self):
+        job = jobs.submit('test_flaky', None, idempotency_key='abc')
+        self.assertEqual(jobs.submit('test_flaky', None,
+            idempotency_key='abc').id, job.id)
+        self.assertNotEqual(jobs.submit('test_flaky', None).id, job.id)
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_arguments_not_serializable(self):
+        with self.assertRaises(ValueError):
+            jobs.submit('test_flaky', object())
+        self.assertEqual(Job.objects.count(), 0)
+
+    def test_unknown_job(self):
+        with self.assertRaises(ValueError):
+            jobs.submit('no_such_job')
+
+    def test_requeue_stale(self):
+        job = jobs.submit('test_flaky', None)
+        jobs.claim(job.id)
+        self.assertEqual(jobs.requeue_stale(), 0)
+        Job.objects.filter(id=job.id).update(
+                modified=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.claim_next(), job.id)
+
+    def test_lost_lease(self):
+        job = jobs.submit('test_reclaimed')
+        self.assertEqual(jobs.claim_next('slow'), job.id)
+        self.assertFalse(jobs.run(job.id, 'slow'))
+        job = jobs.get_job(job.id)
+        self.assertEqual((job.status, job.worker, job.result),
+                (jobs.RUNNING, 'other', None))
+
+    def test_heartbeat(self):
+        job = jobs.submit('test_flaky', None)
+        worker, other = jobs.worker_id(), jobs.worker_id()
+        self.assertNotEqual(worker, other)
+        self.assertEqual(jobs.claim_next(worker), job.id)
+        hour_ago = timezone.now() - timedelta(hours=1)
+        Job.objects.filter(id=job.id).update(modified=hour_ago)
+        # A live worker renews the lease of a job that never reports.
+        self.assertEqual(jobs.heartbeat(other), 0)
+        self.assertEqual(jobs.heartbeat(worker), 1)
+        self.assertEqual(jobs.requeue_stale(), 0)
+
+        Job.objects.filter(id=job.id).update(modified=hour_ago)
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(Job.objects.get(id=job.id).worker, '')
+
+
+class JobViewTest(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        tree = GroupTreeList.objects.create(name='test')
+        self.group = Group.add_root(tree_id=tree.id, owner=self.user,
+                name='inbox')
+
+    def ingest(self, **headers):
+        request = self.factory.post('/documents/bulk/?async=1',
+                [{'group': self.group.id, 'name': 'doc'}], format='json',
+                **headers)
+        force_authenticate(request, self.user)
+        return DocumentBulkCreate.as_view()(request)
+
+    def job(self, job_id, user):
+        request = self.factory.get('/jobs/{0}/'.format(job_id))
+        force_authenticate(request, user)
+        return JobDetail.as_view()(request, pk=job_id)
+
+    def test_async_ingest(self):
+        response = self.ingest(HTTP_IDEMPOTENCY_KEY='batch-1')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], jobs.DONE)
+        job_id = response.data['job_id']
+        self.assertTrue(response.data['job'].endswith(
+            '/jobs/{0}/'.format(job_id)))
+
+        data = self.job(job_id, self.user).data
+        self.assertEqual((data['progress'], data['total']), (1, 1))
+        self.assertEqual(data['result'][0]['document_id'],
+                Document.objects.get().pk)
+
+        # Sent again, e.g. after a timeout.
+        self.assertEqual(self.ingest(
+            HTTP_IDEMPOTENCY_KEY='batch-1').data['job_id'], job_id)
+        self.assertEqual(Document.objects.count(), 1)
+
+    def test_async_ingest_invalid_line(self):
+        request = self.factory.post('/documents/bulk/?async=1',
+                '{{"group": {0}, "name": "doc"}}\n{{"name":\n'.format(
+                    self.group.id),
+                content_type='application/x-ndjson')
+        force_authenticate(request, self.user)
+        response = DocumentBulkCreate.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result['row'] for result in
+            response.data['results']], [1])
+        self.assertEqual(Job.objects.count(), 0)
+
+    def test_idempotency_key_per_user(self):
+        job_id = self.ingest(HTTP_IDEMPOTENCY_KEY='batch-1').data['job_id']
+        other = User.objects.create_user(
+                username='other', email='other@_', password='secret')
+        GroupACL.objects.create(group=self.group, user=other,
+                can_write=True)
+        request = self.factory.post('/documents/bulk/?async=1',
+                [{'group': self.group.id, 'name': 'other doc'}],
+                format='json', HTTP_IDEMPOTENCY_KEY='batch-1')
+        force_authenticate(request, other)
+        response = DocumentBulkCreate.as_view()(request)
+        self.assertEqual(response.status_code, 202)
+        self.assertNotEqual(response.data['job_id'], job_id)
+        self.assertEqual(Document.objects.count(), 2)
+
+    def test_other_users_job(self):
+        job_id = self.ingest().data['job_id']
+        other = User.objects.create_user(
+                username='other', email='other@_', password='secret')
+        self.assertEqual(self.job(job_id, other).status_code, 404)
+        self.assertEqual(self.job('0' * 32, self.user).status_code, 404)
@@ -0,0 +1,110 @@
+"""
+Tests for keyset pagination.
+"""
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate
+from document_index.models import Group, Document
+from document_index.pagination import (decode_cursor, encode_cursor,
+        keyset_filter)
+from document_index.views import DocumentList, GroupList
+from factories import GroupTreeListFactory, DocumentFactory
+
+
+class CursorTest(TestCase):
+    """
+    Tests for cursor tokens.
+    """
+
+    def test_cursor_round_trip(self):
+        values = ['2014-03-01T12:00:00.123456+00:00', '42']
+        self.assertEqual(decode_cursor(encode_cursor(values)), values)
+
+    def test_cursor_invalid(self):
+        self.assertRaises(ValueError, decode_cursor, 'not a cursor!')
+        self.assertRaises(ValueError, decode_cursor, encode_cursor('x'))
+
+    def test_keyset_filter_wrong_length(self):
+        self.assertRaises(ValueError, keyset_filter, Document.objects.all(),
+                ('created', 'document_id'), ['1'])
+
+
+class KeysetPaginationTest(TestCase):
+    """
+    Walk list views page by page with cursors.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        self.tree = GroupTreeListFactory(name='test')
+        self.tree.save()
+        self.group = Group.add_root(tree_id=self.tree.id, owner=self.user,
+            name='test group name', description='test group description',
+            comment='test group comment')
+        self.factory = APIRequestFactory()
+
+    def walk(self, view, url, **kwargs):
+        """
+        Follow next links. Return list of pages.
+        """
+        pages = []
+        while url and len(pages) < 10:
+            request = self.factory.get(url)
+            force_authenticate(request, self.user)
+            response = view(request, **kwargs)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.data['results'])
+            url = response.data['next']
+        return pages
+
+    def test_documents_cursor(self):
+        for i in range(7):
+            DocumentFactory(group=self.group).save()
+        # Ties on created must be broken by document_id.
+        Document.objects.filter(document_id__lte=4).update(
+                created=timezone.now())
+
+        view = DocumentList.as_view(paginate_by_param='page_size')
+        pages = self.walk(view, '/documents/?page_size=3&cursor=')
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        ids = [row['document_id'] for page in pages for row in page]
+        self.assertEqual(sorted(ids), sorted(
+            Document.objects.values_list('document_id', flat=True)))
+
+    def test_documents_cursor_no_count(self):
+        for i in range(4):
+            DocumentFactory(group=self.group).save()
+        request = self.factory.get('/documents/', {'cursor': ''})
+        force_authenticate(request, self.user)
+        # documents with groups, prefetched sources
+        with self.assertNumQueries(2):
+            response = DocumentList.as_view()(request)
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertEqual(response.data['next'], None)
+
+    def test_documents_without_cursor(self):
+        DocumentFactory(group=self.group).save()
+        request = self.factory.get('/documents/')
+        force_authenticate(request, self.user)
+        response = DocumentList.as_view()(request)
+        self.assertEqual(len(response.data), 1)
+
+    def test_documents_bad_cursor(self):
+        request = self.factory.get('/documents/', {'cursor': 'bogus'})
+        force_authenticate(request, self.user)
+        response = DocumentList.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_group_children_cursor(self):
+        for name in ['d', 'b', 'e', 'a', 'c']:
+            Group.objects.get(id=self.group.id).add_child(
+                    tree_id=self.tree.id, owner=self.user, name=name)
+
+        view = GroupList.as_view(paginate_by_param='page_size')
+        url = '/groups/parent/{0}/?page_size=2&cursor='.format(self.group.id)
+        pages = self.walk(view, url, pk=self.group.id)
+        self.assertEqual([[row['name'] for row in page] for page in pages],
+                [['a', 'b'], ['c', 'd'], ['e']])
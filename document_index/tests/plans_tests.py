@@ -0,0 +1,98 @@
+"""
+Query plan regression tests. Every filtered SELECT run by the hot views is
+explained on SQLite, and a test fails when one of them scans a whole table.
+"""
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.utils.unittest import skipUnless
+from rest_framework.test import APIClient
+from document_index import changes
+from document_index.models import GroupTreeList, Group, Document, Source
+from document_index.plans import CaptureQueries, explain, full_scans
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Plans are checked on SQLite.')
+class QueryPlanTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        tree = GroupTreeList.objects.create(name='test')
+        self.inbox = Group.add_root(tree_id=tree.id, owner=self.user,
+                name='inbox')
+        self.child = Group.objects.get(pk=self.inbox.pk).add_child(
+                tree_id=tree.id, owner=self.user, name='child')
+        self.document = Document.objects.create(group=self.child,
+                name='doc')
+        self.source = Source.objects.create(document=self.document,
+                name='page')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertNoFullScans(self, *urls):
+        for url in urls:
+            with CaptureQueries() as captured:
+                response = self.client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertTrue(response.status_code < 400, url)
+            for sql, params in captured.selects():
+                # Reading all rows is what unfiltered queries ask for.
+                if ' WHERE ' not in sql:
+                    continue
+                if full_scans(sql, params):
+                    self.fail('Full scan for {0}:\n{1}\n{2}'.format(url, sql,
+                        '\n'.join(explain(sql, params))))
+
+    def test_detects_full_scan(self):
+        queryset = Document.objects.filter(description='x')
+        sql, params = queryset.query.sql_with_params()
+        self.assertEqual(full_scans(sql, params), ['document_index_document'])
+        queryset = Document.objects.filter(group=self.child)
+        sql, params = queryset.query.sql_with_params()
+        self.assertEqual(full_scans(sql, params), [])
+
+    def test_group_views(self):
+        self.assertNoFullScans(
+                '/groups/parent/0/',
+                '/groups/parent/{0}/'.format(self.inbox.pk),
+                '/groups/parent/{0}/?cursor='.format(self.inbox.pk),
+                '/groups/{0}/'.format(self.inbox.pk),
+                '/groups/annotated_list/{0}/'.format(self.inbox.pk),
+                '/groups/{0}/tree/'.format(self.inbox.pk),
+                '/groups/{0}/breadcrumbs/'.format(self.child.pk),
+                '/groups/shared/')
+
+    def test_document_views(self):
+        self.assertNoFullScans(
+                '/groups/{0}/documents/'.format(self.inbox.pk),
+                '/groups/{0}/documents/?cursor='.format(self.inbox.pk),
+                '/groups/{0}/documents/?aggregate=1'.format(self.inbox.pk),
+                '/groups/{0}/documents/?ordering=-modified'.format(
+                    self.inbox.pk),
+                '/documents/?cursor=',
+                '/documents/{0}/'.format(self.document.pk),
+                '/documents/search/?q=doc',
+                '/documents/export/?group={0}'.format(self.inbox.pk),
+                '/documents/export/?modified_after=2000-01-01T00:00:00Z')
+
+    def test_document_next_page(self):
+        """
+        A real cursor filters on created > x OR (created = x AND
+        document_id > y), which must not scan the table.
+        """
+        Document.objects.bulk_create([Document(group=self.child,
+            name='doc {0}'.format(i)) for i in range(50)])
+        for url in ('/documents/?cursor=',
+                '/groups/{0}/documents/?cursor='.format(self.inbox.pk)):
+            next_url = self.client.get(url).data['next']
+            self.assertTrue(next_url)
+            self.assertNoFullScans(next_url)
+
+    def test_source_views(self):
+        self.assertNoFullScans(
+                '/sources/{0}/'.format(self.source.pk),
+                '/changes/?since={0}'.format(changes.encode_token(0)))
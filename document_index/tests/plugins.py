@@ -0,0 +1,16 @@
+"""
+Nose plugins for running tests, see NOSE_PLUGINS in settings.py.
+"""
+from django.core.cache import cache
+from django_nose.plugin import AlwaysOnPlugin
+
+
+class ClearCachePlugin(AlwaysOnPlugin):
+    """
+    Clear the cache before each test, as rolled back trees leave cached
+    lookups behind.
+    """
+    name = 'clear-cache'
+
+    def beforeTest(self, test):
+        cache.clear()
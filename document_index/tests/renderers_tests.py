@@ -0,0 +1,123 @@
+"""
+Tests for JSON rendering and streaming.
+"""
+import json
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.datastructures import SortedDict
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+from document_index import renderers
+from document_index.fastserializers import GroupValuesSerializer
+from document_index.models import GroupTreeList, Group, Document
+from document_index.plans import CaptureQueries
+from document_index.renderers import (FastJSONRenderer, dumps,
+        iter_json_array)
+from document_index.views import DocumentList, GroupAnnotatedList
+
+DATA = [SortedDict([
+    ('name', u'caf\xe9 / bar'),
+    ('created', datetime(2014, 3, 1, 12, 0, 0, 123456, tzinfo=timezone.utc)),
+    ('size', Decimal('1.50')),
+    ('sources', [1, 2, None]),
+]), {'empty': {}}]
+
+
+@override_settings(DOCUMENT_INDEX_JSON_BACKEND='json')
+class RendererTest(TestCase):
+
+    def test_json_backend(self):
+        expected = JSONRenderer().render(DATA)
+        self.assertEqual(dumps(DATA), expected)
+        self.assertEqual(FastJSONRenderer().render(DATA), expected)
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_iter_json_array(self):
+        expected = JSONRenderer().render(DATA * 10)
+        chunks = list(iter_json_array(iter(DATA * 10), buffer_size=100))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(b''.join(chunks), expected)
+        self.assertEqual(b''.join(iter_json_array([])), b'[]')
+
+    def test_unknown_backend(self):
+        for backend in ('nope', 'orjson'):
+            with self.settings(DOCUMENT_INDEX_JSON_BACKEND=backend):
+                self.assertRaises(ImproperlyConfigured, dumps, DATA)
+
+
+@unittest.skipIf(renderers.ujson is None,
+        'No ujson taking default installed.')
+@override_settings(DOCUMENT_INDEX_JSON_BACKEND='ujson')
+class FastBackendTest(TestCase):
+
+    def test_same_data(self):
+        self.assertEqual(
+                json.loads(FastJSONRenderer().render(DATA).decode('utf-8')),
+                json.loads(JSONRenderer().render(DATA).decode('utf-8')))
+        self.assertEqual(json.loads(b''.join(iter_json_array(
+            DATA)).decode('utf-8')), json.loads(dumps(DATA).decode('utf-8')))
+
+
+@override_settings(DOCUMENT_INDEX_JSON_BACKEND='json')
+class StreamingViewTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        self.tree = GroupTreeList.objects.create(name='test')
+        self.root = Group.add_root(tree_id=self.tree.id, owner=self.user,
+                name='root')
+        for i in range(3):
+            child = self.root.add_child(tree_id=self.tree.id,
+                    owner=self.user, name='child {0}'.format(i))
+            child.add_child(tree_id=self.tree.id, owner=self.user,
+                    name='grandchild {0}'.format(i))
+            Document.objects.create(group=child, name='document',
+                    description='', comment='')
+
+    def get(self, view, url, **kwargs):
+        request = APIRequestFactory().get(url)
+        force_authenticate(request, self.user)
+        response = view.as_view()(request, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+            return response.content
+        return b''.join(response.streaming_content)
+
+    def test_document_list(self):
+        self.assertEqual(self.get(DocumentList, '/documents/?stream=1'),
+                self.get(DocumentList, '/documents/'))
+
+    def test_annotated_list(self):
+        for pk in (0, self.root.pk):
+            streamed = self.get(GroupAnnotatedList, '/?stream=1', pk=pk)
+            self.assertEqual(json.loads(streamed.decode('utf-8')),
+                    json.loads(self.get(GroupAnnotatedList, '/',
+                        pk=pk).decode('utf-8')))
+            self.assertTrue(len(json.loads(streamed.decode('utf-8'))) >= 6)
+
+    def test_annotated_list_chunks(self):
+        iter_rows = GroupValuesSerializer.iter_rows
+
+        def small_chunks(cls, queryset, fields=None):
+            return iter_rows(queryset, fields, chunk_size=2)
+        GroupValuesSerializer.iter_rows = classmethod(small_chunks)
+        try:
+            with CaptureQueries() as captured:
+                streamed = self.get(GroupAnnotatedList, '/?stream=1', pk=0)
+        finally:
+            del GroupValuesSerializer.iter_rows
+        self.assertEqual(json.loads(streamed.decode('utf-8')),
+                json.loads(self.get(GroupAnnotatedList, '/',
+                    pk=0).decode('utf-8')))
+        # 7 nodes, read 2 at a time, each read limited.
+        table = Group._meta.db_table
+        selects = [sql for sql, params in captured.selects()
+                if 'FROM "{0}"'.format(table) in sql and 'path' in sql]
+        self.assertEqual(len([sql for sql in selects if 'LIMIT' in sql]), 4)
@@ -0,0 +1,132 @@
+"""
+Tests for document_index full text search.
+"""
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate
+from document_index.models import Group, SearchTerm
+from document_index.search import rebuild_index, search, tokenize
+from document_index.views import DocumentSearch
+from factories import GroupTreeListFactory, DocumentFactory, SourceFactory
+
+
+class TokenizeTest(TestCase):
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Scan_2014-03.PDF, page 1'),
+                ['scan', '2014', '03', 'pdf', 'page', '1'])
+        self.assertEqual(tokenize(None), [])
+
+
+class SearchTest(TestCase):
+    """
+    Index maintenance and ranking.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        self.tree = GroupTreeListFactory(name='test')
+        self.tree.save()
+        self.root = Group.add_root(tree_id=self.tree.id, owner=self.user,
+                name='root')
+        self.child = Group.objects.get(id=self.root.id).add_child(
+                tree_id=self.tree.id, owner=self.user, name='child')
+        self.other = Group.add_root(tree_id=self.tree.id, owner=self.user,
+                name='other')
+
+        self.invoice = self.add_document(self.child, 'Invoice March',
+                'Electricity invoice')
+        self.letter = self.add_document(self.other, 'Letter',
+                'Letter about the invoice')
+        self.scan = SourceFactory(document=self.letter,
+                filename='scan_march.pdf')
+        self.scan.save()
+
+    def add_document(self, group, name, description):
+        document = DocumentFactory(group=group, name=name,
+                description=description)
+        document.save()
+        return document
+
+    def ids(self, results):
+        return [document_id for document_id, score in results]
+
+    def test_ranking(self):
+        """
+        A match in the name outranks a match in the description.
+        """
+        self.assertEqual(self.ids(search('invoice')),
+                [self.invoice.pk, self.letter.pk])
+
+    def test_all_terms_required(self):
+        self.assertEqual(self.ids(search('invoice electricity')),
+                [self.invoice.pk])
+
+    def test_prefix(self):
+        self.assertEqual(self.ids(search('elec')), [self.invoice.pk])
+        self.assertEqual(search('elec', prefix=False), [])
+
+    def test_source_terms(self):
+        """
+        Source metadata is indexed under its document.
+        """
+        self.assertEqual(self.ids(search('scan')), [self.letter.pk])
+        self.scan.delete()
+        self.assertEqual(search('scan'), [])
+
+    def test_limit(self):
+        """
+        Ranking and limit are applied in one query.
+        """
+        with self.assertNumQueries(1):
+            self.assertEqual(self.ids(search('invoice', limit=1)),
+                    [self.invoice.pk])
+
+    def test_term_matching_twice(self):
+        """
+        A posting matching two prefixes scores for both.
+        """
+        self.assertEqual(search('electricity elec'),
+                [(self.invoice.pk, 4)])
+
+    def test_group_subtree(self):
+        # Sorted insertion of 'other' moved 'root', so reload both.
+        root = Group.objects.get(id=self.root.id)
+        other = Group.objects.get(id=self.other.id)
+        self.assertEqual(self.ids(search('invoice', group=root)),
+                [self.invoice.pk])
+        self.assertEqual(self.ids(search('invoice', group=other)),
+                [self.letter.pk])
+
+    def test_document_update_and_delete(self):
+        self.invoice.name = 'Receipt'
+        self.invoice.save()
+        self.assertEqual(self.ids(search('receipt')), [self.invoice.pk])
+        self.letter.delete()
+        self.assertEqual(self.ids(search('invoice')), [self.invoice.pk])
+        self.assertFalse(SearchTerm.objects.filter(
+            document_id=self.letter.pk).exists())
+
+    def test_rebuild_index(self):
+        SearchTerm.objects.all().delete()
+        self.assertEqual(rebuild_index(chunk_size=1), 2)
+        self.assertEqual(self.ids(search('march')),
+                [self.invoice.pk, self.letter.pk])
+
+    def test_search_view(self):
+        factory = APIRequestFactory()
+        view = DocumentSearch.as_view()
+
+        request = factory.get('/documents/search/', {'q': 'invoice'})
+        force_authenticate(request, self.user)
+        response = view(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['document_id'] for row in response.data],
+                [self.invoice.pk, self.letter.pk])
+
+        request = factory.get('/documents/search/', {'q': ' '})
+        force_authenticate(request, self.user)
+        response = view(request)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,185 @@
+"""
+Tests for source sequence numbering.
+"""
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.forms.models import modelform_factory
+from django.test import TestCase
+from django.utils import six
+from rest_framework.test import APIRequestFactory, force_authenticate
+from document_index import sequences
+from document_index.models import GroupTreeList, Group, Document, Source
+from document_index.serializers import SourceSerializer
+from document_index.views import DocumentDetail, DocumentSourceOrder
+
+
+class SequenceTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        tree = GroupTreeList.objects.create(name='test')
+        group = Group.add_root(tree_id=tree.id, owner=self.user,
+                name='inbox')
+        self.document = Document.objects.create(group=group, name='doc')
+        self.sources = [Source.objects.create(document=self.document,
+            name='page {0}'.format(i)) for i in range(1, 5)]
+
+    def numbering(self):
+        return list(Source.objects.filter(document=self.document).order_by(
+            'sequence').values_list('name', 'sequence'))
+
+    def source_count(self):
+        return Document.objects.get(pk=self.document.pk).source_count
+
+    def test_allocate(self):
+        self.assertEqual([source.sequence for source in self.sources],
+                [1, 2, 3, 4])
+        self.assertEqual(self.source_count(), 4)
+        with transaction.atomic():
+            self.assertEqual(Document.allocate_sequences(
+                self.document.pk, 10), 5)
+        self.assertEqual(self.source_count(), 14)
+        self.assertEqual(Source.objects.create(document=self.document,
+            name='next').sequence, 15)
+
+    def test_explicit_sequence(self):
+        with self.assertRaises(ValidationError):
+            Source.objects.create(document=self.document, name='ten',
+                    sequence=10)
+        self.assertEqual(self.source_count(), 4)
+        Source.objects.create(document=self.document, name='five',
+                sequence=5)
+        self.assertEqual(self.source_count(), 5)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Source.objects.create(document=self.document, name='dup',
+                        sequence=2)
+        self.assertEqual(self.source_count(), 5)
+        self.assertEqual([sequence for name, sequence in self.numbering()],
+                [1, 2, 3, 4, 5])
+
+    def test_delete_closes_gap(self):
+        self.sources[1].delete()
+        self.assertEqual(self.numbering(), [('page 1', 1), ('page 3', 2),
+            ('page 4', 3)])
+        self.assertEqual(self.source_count(), 3)
+        self.sources[3].delete()
+        self.assertEqual(self.source_count(), 2)
+        self.assertEqual(Source.objects.create(document=self.document,
+            name='page 5').sequence, 3)
+
+    def test_delete_stale_instances(self):
+        # Loaded before either delete, like the forms of an admin formset.
+        self.sources[1].delete()
+        self.sources[2].delete()
+        self.assertEqual(self.numbering(), [('page 1', 1), ('page 4', 2)])
+        self.assertEqual(self.source_count(), 2)
+        self.assertEqual(Source.objects.create(document=self.document,
+            name='page 5').sequence, 3)
+
+    def test_delete_document(self):
+        self.document.delete()
+        self.assertEqual(Source.objects.count(), 0)
+
+    def test_reorder(self):
+        ids = [source.pk for source in reversed(self.sources)]
+        # Independent of the number of sources.
+        with self.assertNumQueries(8):
+            sequences.reorder(self.document.pk, ids)
+        self.assertEqual(self.numbering(), [('page 4', 1), ('page 3', 2),
+            ('page 2', 3), ('page 1', 4)])
+
+    def test_reorder_batches(self):
+        sequences.BATCH_SIZE, batch_size = 3, sequences.BATCH_SIZE
+        try:
+            sequences.reorder(self.document.pk, [source.pk for source in
+                reversed(self.sources)])
+        finally:
+            sequences.BATCH_SIZE = batch_size
+        self.assertEqual([sequence for name, sequence in self.numbering()],
+                [1, 2, 3, 4])
+        self.assertEqual(self.numbering()[0][0], 'page 4')
+
+    def test_allocate_across_batches(self):
+        with transaction.atomic():
+            first = Document.allocate_sequences(self.document.pk, 6)
+        self.assertEqual(first, 5)
+        Source.objects.bulk_create([Source(document=self.document,
+            name='page {0}'.format(sequence), sequence=sequence)
+            for sequence in range(first, first + 6)])
+        ids = list(Source.objects.filter(document=self.document).order_by(
+            '-sequence').values_list('source_id', flat=True))
+        # Ten sources renumbered three at a time, the last batch short.
+        sequences.BATCH_SIZE, batch_size = 3, sequences.BATCH_SIZE
+        try:
+            sequences.reorder(self.document.pk, ids)
+        finally:
+            sequences.BATCH_SIZE = batch_size
+        self.assertEqual(self.source_count(), 10)
+        for source in list(Source.objects.filter(pk__in=ids[2:4])):
+            source.delete()
+        names = ['page {0}'.format(n) for n in (10, 9, 6, 5, 4, 3, 2, 1)]
+        self.assertEqual(self.numbering(), list(zip(names, range(1, 9))))
+        self.assertEqual(self.source_count(), 8)
+        self.assertEqual(Source.objects.create(document=self.document,
+            name='page 11').sequence, 9)
+
+    def test_reorder_needs_all_sources(self):
+        with self.assertRaises(ValueError):
+            sequences.reorder(self.document.pk, [self.sources[0].pk])
+        self.assertEqual(self.numbering()[0], ('page 1', 1))
+
+    def test_renumber_command(self):
+        # Left by the old numbering.
+        Source.objects.filter(pk=self.sources[2].pk).update(sequence=7)
+        Document.objects.filter(pk=self.document.pk).update(source_count=0)
+        out = six.StringIO()
+        call_command('renumber_sources', stdout=out)
+        self.assertEqual(out.getvalue().strip(), '1 document(s) renumbered.')
+        self.assertEqual([sequence for name, sequence in self.numbering()],
+                [1, 2, 3, 4])
+        self.assertEqual(self.source_count(), 4)
+
+    def test_order_view(self):
+        ids = [self.sources[2].pk, self.sources[0].pk, self.sources[1].pk,
+                self.sources[3].pk]
+        factory = APIRequestFactory()
+        request = factory.put('/', {'sources': ids}, format='json')
+        force_authenticate(request, self.user)
+        response = DocumentSourceOrder.as_view()(request, pk=self.document.pk)
+        self.assertEqual(response.data['sources'], ids)
+
+        request = factory.put('/', {'sources': ids[:2]}, format='json')
+        force_authenticate(request, self.user)
+        response = DocumentSourceOrder.as_view()(request, pk=self.document.pk)
+        self.assertEqual(response.status_code, 400)
+
+    def test_source_count_read_only(self):
+        Document.objects.filter(pk=self.document.pk).update(
+                description='d', comment='c')
+        request = APIRequestFactory().patch('/', {'source_count': 0},
+                format='json')
+        force_authenticate(request, self.user)
+        response = DocumentDetail.as_view()(request, pk=self.document.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.source_count(), 4)
+        self.assertEqual(Source.objects.create(document=self.document,
+            name='page 5').sequence, 5)
+
+    def test_gap_is_invalid_input(self):
+        form = modelform_factory(Source, fields=('document', 'name',
+            'sequence'))({'document': self.document.pk, 'name': 'ten',
+                'sequence': 10})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(list(form.errors), ['sequence'])
+
+        # The API takes no sequence, so it cannot leave a gap.
+        serializer = SourceSerializer(data={'document': self.document.pk,
+            'name': 'ten', 'description': 'd', 'filename': 'f',
+            'mime_type': 'text/plain', 'comment': 'c', 'sequence': 10},
+            context={'request': APIRequestFactory().post('/')})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.save().sequence, 5)
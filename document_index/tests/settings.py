@@ -1,5 +1,6 @@
 """Settings for running tests."""
 import os
+import tempfile
 
 DEBUG = True
 USE_TZ = True
@@ -14,6 +15,16 @@ DATABASES = {
     }
 }
 
+# Tests run in one process, so the default local memory cache is shared.
+DOCUMENT_INDEX_SHARED_CACHE = True
+
+NOSE_PLUGINS = ['document_index.tests.plugins.ClearCachePlugin']
+
+# Run background jobs inline.
+DOCUMENT_INDEX_JOBS_EAGER = True
+
+DOCUMENT_INDEX_BLOB_ROOT = tempfile.mkdtemp()
+
 ROOT_URLCONF = 'document_index.tests.urls'
 
 STATIC_URL = '/static/'
@@ -52,6 +63,8 @@ EXTERNAL_APPS = [
     'django.contrib.sitemaps',
     'django.contrib.sites',
     'django_nose',
+    'provider',
+    'provider.oauth2',
 ]
 
 INTERNAL_APPS = [
@@ -0,0 +1,87 @@
+"""
+Tests for in-memory tree snapshots.
+"""
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+from document_index import snapshot
+from document_index.models import Group
+from document_index.move import move_nodes
+from document_index.views import GroupBreadcrumbs
+from tree_tests import TreeTestMixin
+
+
+class SnapshotTest(TreeTestMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        snapshot.clear()
+        self.build_tree()
+
+    def ids(self, *names):
+        return [self.nodes[name].id for name in names]
+
+    def test_tree_queries(self):
+        tree = snapshot.get_tree_snapshot(self.tree.id)
+        self.assertEqual(len(tree), 10)
+        a1x, a2, b1xz = self.ids('a1x', 'a2', 'b1xz')
+
+        self.assertEqual(tree.ancestors(b1xz), self.ids('b', 'b1', 'b1x'))
+        self.assertEqual(tree.depth(b1xz), 4)
+        self.assertEqual(tree.parent(a2), self.nodes['a'].id)
+        self.assertEqual(tree.parent(self.nodes['c'].id), None)
+        self.assertEqual(tree.descendants(self.nodes['a'].id),
+                self.ids('a1', 'a1x', 'a1y', 'a2'))
+        self.assertTrue(tree.is_descendant(a1x, self.nodes['a'].id))
+        self.assertFalse(tree.is_descendant(a2, self.nodes['a1'].id))
+        self.assertFalse(tree.is_descendant(a2, a2))
+        self.assertTrue(tree.is_descendant(a2, a2, include_self=True))
+        self.assertEqual(tree.lca(a1x, a2), self.nodes['a'].id)
+        self.assertEqual(tree.lca(a1x, self.nodes['a1'].id),
+                self.nodes['a1'].id)
+        self.assertEqual(tree.lca(a1x, b1xz), None)
+
+    def test_cached_until_changed(self):
+        snapshot.get_tree_snapshot(self.tree.id)
+        with self.assertNumQueries(0):
+            tree = snapshot.get_tree_snapshot(self.tree.id)
+            self.assertEqual(tree.breadcrumbs(self.nodes['a1y'].id), [
+                (self.nodes['a'].id, 'a'), (self.nodes['a1'].id, 'a1'),
+                (self.nodes['a1y'].id, 'a1y')])
+
+        # Only the changed branch is loaded again.
+        self.add('a3', 'a')
+        with self.assertNumQueries(1):
+            tree = snapshot.get_tree_snapshot(self.tree.id)
+        self.assertEqual(tree.parent(self.nodes['a3'].id),
+                self.nodes['a'].id)
+
+        move_nodes(self.ids('b1'), self.nodes['a'].id)
+        tree = snapshot.get_tree_snapshot(self.tree.id)
+        self.assertEqual(tree.ancestors(self.nodes['b1xz'].id),
+                self.ids('a', 'b1', 'b1x'))
+
+    @override_settings(DOCUMENT_INDEX_SHARED_CACHE=False)
+    def test_not_kept_without_shared_cache(self):
+        pk = self.nodes['b1x'].id
+        snapshot.get_group_snapshot(pk)
+        # A write in another process bumps no version seen here.
+        Group.objects.filter(pk=self.nodes['b1'].id).update(name='renamed')
+        self.assertEqual([name for group_id, name in
+            snapshot.get_group_snapshot(pk).breadcrumbs(pk)],
+            ['b', 'renamed', 'b1x'])
+        self.assertEqual(snapshot.get_tree_snapshot(
+            self.tree.id).breadcrumbs(pk)[1][1], 'renamed')
+        self.assertEqual(len(snapshot._branches), 0)
+
+    def test_breadcrumbs_view(self):
+        view = GroupBreadcrumbs.as_view()
+        factory = APIRequestFactory()
+        pk = self.nodes['b1x'].id
+        view(factory.get('/groups/{0}/breadcrumbs/'.format(pk)), pk=pk)
+        with self.assertNumQueries(0):
+            response = view(factory.get('/'), pk=pk)
+        self.assertEqual([crumb['name'] for crumb in response.data],
+                ['b', 'b1', 'b1x'])
+        self.assertEqual(view(factory.get('/'), pk=999).status_code, 404)
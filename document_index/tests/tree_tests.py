@@ -0,0 +1,438 @@
+"""
+Tests for document_index set based tree helpers.
+"""
+import json
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+from django.test import TestCase
+from rest_framework.test import APIRequestFactory, force_authenticate
+from document_index import tree
+from document_index.access import READ, WRITE, get_prefixes, has_access
+from document_index.models import Group, GroupACL, Job
+from document_index.move import (DeleteError, MoveError, delete_subtree,
+        move_nodes)
+from document_index.tasks import delete_subtree_task, move_nodes_task
+from document_index.tree import (annotate, count_children,
+        get_subtree_nodes, get_tree_nodes, rebuild_numchild, subtree_range)
+from document_index.views import (GroupAnnotatedList, GroupDetail,
+        GroupDocumentList, GroupMove, JobDetail)
+from factories import GroupTreeListFactory, DocumentFactory, SourceFactory
+
+
+class TreeTestMixin(object):
+    """
+    Build a small tree with uneven branches.
+
+        a
+        +-- a1
+        |   +-- a1x
+        |   +-- a1y
+        +-- a2
+        b
+        +-- b1
+            +-- b1x
+                +-- b1xz
+        c
+    """
+
+    def build_tree(self):
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        self.tree = GroupTreeListFactory(name='test')
+        self.tree.save()
+        self.nodes = {}
+        self.add('a')
+        self.add('a1', 'a')
+        self.add('a1x', 'a1')
+        self.add('a1y', 'a1')
+        self.add('a2', 'a')
+        self.add('b')
+        self.add('b1', 'b')
+        self.add('b1x', 'b1')
+        self.add('b1xz', 'b1x')
+        self.add('c')
+
+    def add(self, name, parent=None):
+        kwargs = {'tree_id': self.tree.id, 'owner': self.user, 'name': name}
+        if parent is None:
+            node = Group.add_root(**kwargs)
+        else:
+            parent_node = Group.objects.get(id=self.nodes[parent].id)
+            node = parent_node.add_child(**kwargs)
+        self.nodes[name] = node
+        return node
+
+    def get(self, name):
+        return Group.objects.get(id=self.nodes[name].id)
+
+
+class SubtreeRangeTest(TreeTestMixin, TestCase):
+    """
+    Tests for subtree range queries.
+    """
+
+    def setUp(self):
+        self.build_tree()
+
+    def test_subtree_range_matches_descendants(self):
+        """
+        Range query returns the node and exactly its descendants.
+        """
+        node = self.get('a1')
+        queryset = Group.objects.filter(path__range=subtree_range(node.path))
+        self.assertEqual(sorted(n.name for n in queryset),
+                ['a1', 'a1x', 'a1y'])
+
+    def test_get_subtree_nodes_excluding_self(self):
+        """
+        Descendants only, in path order.
+        """
+        nodes = get_subtree_nodes([self.get('b').path], include_self=False)
+        self.assertEqual([n.name for n in nodes], ['b1', 'b1x', 'b1xz'])
+
+    def test_get_tree_nodes(self):
+        """
+        Whole tree in path order.
+        """
+        names = [n.name for n in get_tree_nodes(self.tree.id)]
+        self.assertEqual(names, [n.name for n in Group.get_tree()])
+
+    def test_count_children(self):
+        """
+        In memory child counts agree with treebeard.
+        """
+        nodes = list(get_tree_nodes(self.tree.id))
+        counts = count_children(nodes)
+        for node in nodes:
+            self.assertEqual(counts[node.pk], node.get_children_count())
+
+
+class AnnotateTest(TreeTestMixin, TestCase):
+    """
+    Annotation must match treebeard's get_annotated_list.
+    """
+
+    def setUp(self):
+        self.build_tree()
+
+    def assertSameAnnotation(self, top_nodes, nodes):
+        expected = []
+        for top_node in top_nodes:
+            expected.extend((node.pk, info)
+                    for node, info in Group.get_annotated_list(top_node))
+        actual = [(node.pk, info) for node, info in annotate(nodes)]
+        self.assertEqual(actual, expected)
+
+    def test_annotate_roots(self):
+        self.assertSameAnnotation(Group.get_root_nodes(),
+                get_tree_nodes(self.tree.id))
+
+    def test_annotate_children(self):
+        parent = self.get('b')
+        self.assertSameAnnotation(parent.get_children(),
+                get_subtree_nodes([parent.path], include_self=False))
+
+    def test_annotate_empty(self):
+        self.assertEqual(list(annotate([])), [])
+
+
+class GroupAnnotatedListQueryTest(TreeTestMixin, TestCase):
+    """
+    The annotated list view must not issue a query per node.
+    """
+
+    def setUp(self):
+        self.build_tree()
+        self.factory = APIRequestFactory()
+        self.view = GroupAnnotatedList.as_view()
+
+    def test_annotated_list_tree_queries(self):
+        request = self.factory.get('/groups/annotated_list/0/')
+        force_authenticate(request, self.user)
+        # tree lookup, root paths, subtree
+        with self.assertNumQueries(3):
+            response = self.view(request, pk=0)
+        self.assertEqual(len(response.data), 10)
+        self.assertEqual(response.data[0]['name'], 'a')
+        self.assertEqual(response.data[0]['numchild'], 2)
+        self.assertEqual(response.data[0]['owner'], 'test')
+
+    def test_annotated_list_children_queries(self):
+        parent = self.get('a')
+        request = self.factory.get('/groups/annotated_list/')
+        force_authenticate(request, self.user)
+        # parent lookup, subtree
+        with self.assertNumQueries(2):
+            response = self.view(request, pk=parent.id)
+        self.assertEqual([row['name'] for row in response.data],
+                ['a1', 'a1x', 'a1y', 'a2'])
+        self.assertEqual([row['level'] for row in response.data],
+                [0, 1, 1, 0])
+        self.assertEqual(response.data[2]['close'], [0, 1])
+
+
+class ChildCountTest(TreeTestMixin, TestCase):
+    """
+    Tests for numchild repair.
+    """
+
+    def setUp(self):
+        self.build_tree()
+
+    def test_rebuild_numchild(self):
+        Group.objects.filter(name__in=['a', 'b1x']).update(numchild=7)
+        Group.objects.filter(name='c').update(numchild=1)
+        self.assertEqual(rebuild_numchild(self.tree.id), 3)
+        self.assertEqual(self.get('a').numchild, 2)
+        self.assertEqual(self.get('b1x').numchild, 1)
+        self.assertEqual(self.get('c').numchild, 0)
+        self.assertEqual(rebuild_numchild(), 0)
+
+    def test_rebuild_numchild_batches(self):
+        Group.objects.update(numchild=7)
+        tree.UPDATE_BATCH_SIZE, batch_size = 2, tree.UPDATE_BATCH_SIZE
+        try:
+            self.assertEqual(rebuild_numchild(self.tree.id),
+                    Group.objects.count())
+        finally:
+            tree.UPDATE_BATCH_SIZE = batch_size
+        self.assertEqual(self.get('a').numchild, 2)
+        self.assertEqual(rebuild_numchild(), 0)
+
+
+class GroupDocumentListTest(TreeTestMixin, TestCase):
+    """
+    Documents of a whole subtree.
+    """
+
+    def setUp(self):
+        self.build_tree()
+        self.factory = APIRequestFactory()
+        self.view = GroupDocumentList.as_view()
+        self.documents = {}
+        for name, sources in (('a', 1), ('a1x', 2), ('a1y', 0), ('a2', 1),
+                ('b1', 3)):
+            document = DocumentFactory(group=self.get(name),
+                    name='doc ' + name)
+            document.save()
+            for i in range(sources):
+                SourceFactory(document=document, sequence=i + 1).save()
+            self.documents[name] = document
+
+    def get_response(self, name, data=None):
+        request = self.factory.get('/groups/documents/', data or {})
+        force_authenticate(request, self.user)
+        return self.view(request, pk=self.nodes[name].id)
+
+    def test_subtree_documents(self):
+        with self.assertNumQueries(3):
+            response = self.get_response('a')
+        self.assertEqual(sorted(row['name'] for row in response.data),
+                ['doc a', 'doc a1x', 'doc a1y', 'doc a2'])
+
+    def test_subtree_documents_filter_and_ordering(self):
+        response = self.get_response('a', {'name': 'A1',
+            'ordering': '-name'})
+        self.assertEqual([row['name'] for row in response.data],
+                ['doc a1y', 'doc a1x'])
+
+    def test_subtree_documents_bad_date(self):
+        response = self.get_response('a', {'modified_after': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        response = self.get_response('a',
+                {'modified_after': '2014-13-01T00:00:00'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_subtree_documents_bad_cursor(self):
+        response = self.get_response('a', {'cursor': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_subtree_documents_ordering_cursor(self):
+        for data in ({'cursor': ''}, {'stream': '1'}):
+            data['ordering'] = 'name'
+            response = self.get_response('a', data)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('ordering', response.data['detail'])
+
+    def test_subtree_aggregate(self):
+        response = self.get_response('a', {'aggregate': '1'})
+        self.assertEqual(response.data['documents'], 4)
+        self.assertEqual(response.data['sources'], 4)
+        self.assertEqual(response.data['own_documents'], 1)
+        self.assertEqual(response.data['own_sources'], 1)
+        children = [(child['name'], child['documents'], child['sources'])
+                for child in response.data['children']]
+        self.assertEqual(children, [('a1', 2, 2), ('a2', 1, 1)])
+
+
+class GroupMoveTest(TreeTestMixin, TestCase):
+    """
+    Tests for the set based move engine.
+    """
+
+    def setUp(self):
+        self.build_tree()
+
+    def assertTreeConsistent(self):
+        for problems in Group.find_problems():
+            self.assertEqual(problems, [])
+
+    def children(self, name):
+        return [node.name for node in self.get(name).get_children()]
+
+    def test_move_shifts_siblings(self):
+        """
+        Moved subtree sorts among the new siblings, which shift right.
+        """
+        node, descendants = move_nodes([self.nodes['b1'].id],
+                self.nodes['a'].id)[0]
+        self.assertEqual(descendants, 2)
+        self.assertEqual(node.depth, 2)
+        self.assertEqual(self.children('a'), ['a1', 'a2', 'b1'])
+
+        move_nodes([self.nodes['a1x'].id], self.nodes['b1x'].id)
+        self.assertEqual(self.children('b1x'), ['a1x', 'b1xz'])
+        self.assertEqual(self.get('a1x').depth, 4)
+        self.assertEqual(self.get('a1').numchild, 1)
+        self.assertEqual(self.get('b1x').numchild, 2)
+        self.assertEqual(self.get('b').numchild, 0)
+        self.assertTreeConsistent()
+
+    def test_move_into_shifted_sibling(self):
+        """
+        A node inside a sibling that is shifted out of the way still moves.
+        """
+        move_nodes([self.nodes['b1x'].id], 0)
+        self.assertEqual([node.name for node in Group.get_root_nodes()],
+                ['a', 'b', 'b1x', 'c'])
+        self.assertEqual(self.get('b1xz').depth, 2)
+        self.assertTreeConsistent()
+
+    def test_move_many(self):
+        moved = move_nodes([self.nodes['a1'].id, self.nodes['c'].id,
+            self.nodes['b1'].id], self.nodes['b'].id)
+        self.assertEqual([node.name for node, _ in moved],
+                ['a1', 'c', 'b1'])
+        self.assertEqual(self.children('b'), ['a1', 'b1', 'c'])
+        self.assertEqual(self.get('b').numchild, 3)
+        self.assertTreeConsistent()
+
+    def test_move_below_itself(self):
+        with self.assertRaises(MoveError):
+            move_nodes([self.nodes['b'].id], self.nodes['b1x'].id)
+        self.assertEqual(self.get('b1x').depth, 3)
+
+    def test_batch_view(self):
+        factory = APIRequestFactory()
+        request = factory.patch('/groups/move/', {'parent': 0,
+            'nodes': [self.nodes['a1'].id, self.nodes['b1x'].id]},
+            format='json')
+        force_authenticate(request, self.user)
+        response = GroupMove.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([group['descendants']
+            for group in response.data['groups']], [2, 1])
+        self.assertEqual(len(Group.get_root_nodes()), 5)
+        self.assertTreeConsistent()
+
+    def test_batch_view_async(self):
+        factory = APIRequestFactory()
+        request = factory.patch('/groups/move/?async=1', {'parent': 0,
+            'nodes': [self.nodes['a1'].id]}, format='json')
+        force_authenticate(request, self.user)
+        response = GroupMove.as_view()(request)
+        self.assertEqual(response.status_code, 202)
+        job = Job.objects.get(id=response.data['job_id'])
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(json.loads(job.result)[0]['descendants'], 2)
+        self.assertEqual(len(Group.get_root_nodes()), 4)
+        self.assertTreeConsistent()
+
+        request = factory.patch('/groups/move/', {'parent': 0,
+            'nodes': 'a1'}, format='json')
+        force_authenticate(request, self.user)
+        response = GroupMove.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+
+
+class GroupDeleteTest(TreeTestMixin, TestCase):
+    """
+    Tests for set based subtree deletes.
+    """
+
+    def setUp(self):
+        self.build_tree()
+        self.factory = APIRequestFactory()
+
+    def delete(self, name, url_suffix=''):
+        pk = self.nodes[name].id
+        request = self.factory.delete('/groups/{0}/{1}'.format(pk, url_suffix))
+        force_authenticate(request, self.user)
+        return GroupDetail.as_view()(request, pk=pk)
+
+    def test_delete_subtree(self):
+        self.assertEqual(delete_subtree(self.nodes['a1'].id), 3)
+        self.assertEqual(self.get('a').numchild, 1)
+        self.assertEqual(sorted(Group.objects.values_list('name', flat=True)),
+                ['a', 'a2', 'b', 'b1', 'b1x', 'b1xz', 'c'])
+        for problems in Group.find_problems():
+            self.assertEqual(problems, [])
+
+    def test_delete_view(self):
+        # One more for recording the deleted groups in the change log and
+        # one for collecting the grants on them.
+        with self.assertNumQueries(11):
+            response = self.delete('b')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual([node.name for node in Group.get_root_nodes()],
+                ['a', 'c'])
+        self.assertEqual(Group.objects.count(), 6)
+
+    def test_delete_with_acls(self):
+        other = User.objects.create_user(username='other', email='other@_')
+        GroupACL.objects.create(group=self.get('b1x'), user=other,
+                can_write=True)
+        kept = GroupACL.objects.create(group=self.get('a'), user=other)
+        self.assertTrue(has_access(other, self.get('b1xz').path, WRITE))
+        self.assertEqual(delete_subtree(self.nodes['b'].id), 4)
+        self.assertEqual(list(GroupACL.objects.all()), [kept])
+        # Cached prefixes no longer include the deleted branch.
+        self.assertEqual(get_prefixes(other)[WRITE], [])
+        self.assertEqual(get_prefixes(other)[READ], [self.get('a').path])
+
+    def test_delete_with_documents(self):
+        DocumentFactory(group=self.get('b1xz')).save()
+        response = self.delete('b')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Group.objects.count(), 10)
+        with self.assertRaises(DeleteError):
+            delete_subtree(self.nodes['b1'].id)
+
+    def test_delete_async(self):
+        response = self.delete('a', '?async=1')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Group.objects.count(), 5)
+
+        request = self.factory.get(response.data['job'])
+        force_authenticate(request, self.user)
+        response = JobDetail.as_view()(request, pk=response.data['job_id'])
+        self.assertEqual(response.data['status'], 'done')
+        self.assertEqual(response.data['result'], 5)
+
+    def test_jobs_check_access(self):
+        """
+        Access may be revoked between queueing a job and running it.
+        """
+        other = User.objects.create_user(
+                username='other', email='other@_', password='secret')
+        self.assertRaises(PermissionDenied, delete_subtree_task,
+                self.nodes['a1'].id, other.pk)
+        self.assertRaises(PermissionDenied, move_nodes_task,
+                [self.nodes['a1'].id], 0, other.pk)
+        # The new parent must be writable too.
+        GroupACL.objects.create(group=self.get('a1'), user=other,
+                can_write=True)
+        self.assertRaises(PermissionDenied, move_nodes_task,
+                [self.nodes['a1'].id], self.nodes['b'].id, other.pk)
+        self.assertEqual(Group.objects.count(), 10)
+        self.assertEqual(self.get('a1').depth, 2)
@@ -0,0 +1,146 @@
+"""
+Tests for versioned response caching with ETags.
+"""
+from django.contrib.auth.models import User
+from django.core.cache import cache, get_cache
+from django.test import TestCase
+from django.test.utils import override_settings
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate
+from document_index import cache as tree_cache, snapshot, versions
+from document_index.bulk import load_tree
+from document_index.models import GroupTreeList, Group, Document, Source
+from document_index.views import (DocumentDetail, GroupAnnotatedList,
+        GroupDetail)
+
+
+class VersionedCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        self.tree = GroupTreeList.objects.create(name='test')
+        self.root = Group.add_root(tree_id=self.tree.id, owner=self.user,
+                name='root')
+        self.document = Document(group=self.root, name='Invoice')
+        self.document.save()
+
+    def get(self, view, url, pk, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        request = self.factory.get(url, **headers)
+        force_authenticate(request, self.user)
+        response = view.as_view()(request, pk=pk)
+        response.render()
+        return response
+
+    def test_document_not_modified(self):
+        url = '/documents/{0}/'.format(self.document.pk)
+        response = self.get(DocumentDetail, url, self.document.pk)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        # Served from cache without touching the database.
+        with self.assertNumQueries(0):
+            response = self.get(DocumentDetail, url, self.document.pk)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.data['name'], 'Invoice')
+
+        response = self.get(DocumentDetail, url, self.document.pk, etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+        # Adding a source changes the document representation.
+        Source(document=self.document, name='page 1').save()
+        response = self.get(DocumentDetail, url, self.document.pk, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data['sources']), 1)
+
+    @override_settings(DOCUMENT_INDEX_SHARED_CACHE=False)
+    def test_per_process_cache(self):
+        """
+        Without a shared cache responses are neither cached nor tagged, as
+        other processes would not see the version bumps.
+        """
+        url = '/documents/{0}/'.format(self.document.pk)
+        response = self.get(DocumentDetail, url, self.document.pk)
+        self.assertFalse(response.has_header('ETag'))
+        Document.objects.filter(pk=self.document.pk).update(name='Receipt')
+        response = self.get(DocumentDetail, url, self.document.pk, '"x"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['name'], 'Receipt')
+
+    def test_unreachable_cache(self):
+        """
+        A cache failing silently stores no versions. Responses are neither
+        cached nor tagged then, as made up versions would never change.
+        """
+        url = '/documents/{0}/'.format(self.document.pk)
+        dummy = get_cache('django.core.cache.backends.dummy.DummyCache')
+        versions.cache = tree_cache.cache = dummy
+        try:
+            self.assertEqual(versions.get_versions(['x']), None)
+            self.assertEqual(versions.group_versions([self.root.path]), None)
+            response = self.get(DocumentDetail, url, self.document.pk)
+            self.assertFalse(response.has_header('ETag'))
+            Document.objects.filter(pk=self.document.pk).update(
+                    name='Receipt')
+            response = self.get(DocumentDetail, url, self.document.pk, '*')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['name'], 'Receipt')
+
+            snapshot.clear()
+            snapshot.get_group_snapshot(self.root.pk)
+            self.assertEqual(len(snapshot._branches), 0)
+        finally:
+            versions.cache = tree_cache.cache = cache
+
+    def test_deleted_document(self):
+        url = '/documents/{0}/'.format(self.document.pk)
+        pk = self.document.pk
+        self.get(DocumentDetail, url, pk)
+        self.document.delete()
+        response = self.get(DocumentDetail, url, pk)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_group_detail(self):
+        url = '/groups/{0}/'.format(self.root.pk)
+        etag = self.get(GroupDetail, url, self.root.pk)['ETag']
+        response = self.get(GroupDetail, url, self.root.pk, etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Group.objects.get(id=self.root.id).add_child(tree_id=self.tree.id,
+                owner=self.user, name='child')
+        response = self.get(GroupDetail, url, self.root.pk, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['numchild'], 1)
+
+    def test_annotated_list(self):
+        url = '/groups/annotated_list/0/'
+        response = self.get(GroupAnnotatedList, url, 0)
+        etag = response['ETag']
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(
+            self.get(GroupAnnotatedList, url, 0, etag).status_code,
+            status.HTTP_304_NOT_MODIFIED)
+
+        # Bulk loads rewrite paths without model signals.
+        load_tree([{'name': 'a'}], self.user, self.tree.id,
+                Group.objects.get(id=self.root.id))
+        response = self.get(GroupAnnotatedList, url, 0, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+
+    def test_other_branch_keeps_etag(self):
+        other = Group.add_root(tree_id=self.tree.id, owner=self.user,
+                name='zz')
+        url = '/groups/annotated_list/{0}/'.format(self.root.pk)
+        etag = self.get(GroupAnnotatedList, url, self.root.pk)['ETag']
+
+        # Changes below another root leave this branch alone.
+        Group.objects.get(id=other.id).add_child(tree_id=self.tree.id,
+                owner=self.user, name='child')
+        response = self.get(GroupAnnotatedList, url, self.root.pk, etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
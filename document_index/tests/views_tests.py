@@ -5,10 +5,11 @@ from django.test import TestCase
 from rest_framework.test import (APIRequestFactory, APIClient,
         force_authenticate)
 from rest_framework import status
-from document_index.views import GroupList, GroupDetail
-from document_index.models import Group, GroupTreeList
+from document_index.views import GroupList, GroupDetail, DocumentList
+from document_index.models import Group, GroupTreeList, Source
 import document_index
-from factories import GroupTreeListFactory, GroupFactory
+from factories import (GroupTreeListFactory, GroupFactory, DocumentFactory,
+        SourceFactory)
 
 
 class GetGroupPostData(object):
@@ -200,3 +201,49 @@ class GroupDetailRetrieveUpdateDestroyTest(TestCase):
         else:
             self.assertTrue(False)
 
+
+
+class DocumentListQueryTest(TestCase):
+    """
+    DocumentList must run a constant number of queries per page.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+                username='test', email='test@_', password='secret')
+        self.tree = GroupTreeListFactory(name='test')
+        self.tree.save()
+        self.group = Group.add_root(tree_id=self.tree.id, owner=self.user,
+            name='test group name', description='test group description',
+            comment='test group comment')
+        self.factory = APIRequestFactory()
+        self.view = DocumentList.as_view()
+
+    def add_documents(self, count):
+        for i in range(count):
+            document = DocumentFactory(group=self.group)
+            document.save()
+            for j in range(2):
+                SourceFactory(document=document, sequence=j + 1).save()
+
+    def get_documents(self, count):
+        request = self.factory.get('/documents/')
+        force_authenticate(request, self.user)
+        # documents with groups, prefetched sources
+        with self.assertNumQueries(2):
+            response = self.view(request)
+        self.assertEqual(len(response.data), count)
+        return response
+
+    def test_document_list_queries(self):
+        self.add_documents(2)
+        self.get_documents(2)
+        self.add_documents(8)
+        response = self.get_documents(10)
+        document = response.data[0]
+        self.assertEqual(document['group'],
+                'http://testserver/groups/{0}/'.format(self.group.id))
+        self.assertEqual(len(document['sources']), 2)
+        self.assertEqual(document['sources'][0]['source'],
+                'http://testserver/sources/{0}/'.format(
+                    Source.objects.filter(document__document_id=
+                        document['document_id'])[0].source_id))
@@ -0,0 +1,235 @@
+"""
+Set based helpers for the materialized path group tree.
+
+treebeard works one node at a time and issues SQL for every call. The helpers
+here fetch whole subtrees with range queries on ``Group.path`` and do the rest
+of the work in memory.
+"""
+from django.db import connection
+from django.db.models import Count, Q
+from document_index.models import Group, Document
+
+# Ids per UPDATE in update_by_value(), below SQLite's limit of 999
+# parameters.
+UPDATE_BATCH_SIZE = 900
+
+
+def subtree_range(path):
+    """
+    Return (low, high) bounds covering ``path`` and all of its descendants.
+    Use with ``path__range``. Unlike ``path__startswith`` a range lookup can
+    use the index on ``path``.
+    """
+    max_length = Group._meta.get_field('path').max_length
+    return (path, path + Group.alphabet[-1] * (max_length - len(path)))
+
+
+def subtree_q(paths, include_self=True, prefix=''):
+    """
+    Return Q object matching the subtrees below each path in ``paths``.
+    ``prefix`` is prepended to the lookup, e.g. 'group__' to filter documents.
+    """
+    query = None
+    for path in paths:
+        low, high = subtree_range(path)
+        if include_self:
+            node_q = Q(**{prefix + 'path__range': (low, high)})
+        else:
+            node_q = Q(**{prefix + 'path__gt': low,
+                prefix + 'path__lte': high})
+        query = node_q if query is None else query | node_q
+    return query
+
+
+def get_subtree_nodes(paths, include_self=True):
+    """
+    Return queryset with the subtrees below ``paths`` in path order. Owner is
+    fetched in the same query since every serialized node needs it.
+    """
+    query = subtree_q(paths, include_self)
+    if query is None:
+        return Group.objects.none()
+    return Group.objects.filter(query).select_related('owner').order_by('path')
+
+
+def get_tree_nodes(tree_id):
+    """
+    Return all nodes below the root nodes of a tree in path order.
+    """
+    root_paths = list(Group.get_root_nodes().filter(
+            tree_id=tree_id).values_list('path', flat=True))
+    return get_subtree_nodes(root_paths)
+
+
+def count_children(nodes):
+    """
+    Count children of each node from a complete subtree listing. Return dict
+    keyed by node id.
+    """
+    by_path = dict((node.path, node) for node in nodes)
+    counts = dict((node.pk, 0) for node in nodes)
+    for node in nodes:
+        parent = by_path.get(node.path[:-Group.steplen])
+        if parent is not None:
+            counts[parent.pk] += 1
+    return counts
+
+
+def annotate(nodes):
+    """
+    Generate (node, info) pairs from nodes in path order. The result is the
+    same as calling treebeard's get_annotated_list() on each top level node
+    and concatenating the lists, without a query per top level node.
+    """
+    pending = None
+    start_depth = prev_depth = None
+
+    for node in nodes:
+        depth = node.depth
+
+        # A node at or above the starting depth begins the next top level
+        # branch. Close everything still open in the current one.
+        if start_depth is not None and depth <= start_depth:
+            pending[1]['close'] = list(range(0, prev_depth - start_depth + 1))
+            yield pending
+            pending = None
+            start_depth = prev_depth = None
+
+        if start_depth is None:
+            start_depth = depth
+
+        info = {
+            'open': prev_depth is None or depth > prev_depth,
+            'close': [],
+            'level': depth - start_depth,
+        }
+
+        if pending is not None:
+            if depth < prev_depth:
+                pending[1]['close'] = list(range(0, prev_depth - depth))
+            yield pending
+
+        pending = (node, info)
+        prev_depth = depth
+
+    if pending is not None:
+        pending[1]['close'] = list(range(0, prev_depth - start_depth + 1))
+        yield pending
+
+
+def _count_by_parent_path(queryset):
+    """
+    Count nodes in queryset grouped by the path of their parent in one
+    query. Return dict keyed by parent path.
+    """
+    rows = queryset.extra(
+            select={'parent_path': 'SUBSTR(path, 1, LENGTH(path) - %s)'},
+            select_params=(Group.steplen,)).values('parent_path').annotate(
+                    count=Count('pk')).order_by()
+    return dict((row['parent_path'], row['count']) for row in rows)
+
+
+def update_by_value(fixes, field):
+    """
+    Set ``field`` of groups, with ``fixes`` a dict of value to list of ids.
+    Each value is one UPDATE per UPDATE_BATCH_SIZE ids. Return number of
+    rows updated.
+    """
+    updated = 0
+    for value, pks in fixes.items():
+        for start in range(0, len(pks), UPDATE_BATCH_SIZE):
+            updated += Group.objects.filter(
+                    pk__in=pks[start:start + UPDATE_BATCH_SIZE]).update(
+                        **{field: value})
+    return updated
+
+
+def rebuild_numchild(tree_id=None):
+    """
+    Compare the denormalized ``numchild`` column with actual child counts
+    and fix the rows that differ, e.g. after bulk imports. Limit to one tree
+    when ``tree_id`` is given. Return number of nodes fixed.
+    """
+    if tree_id is None:
+        queryset = Group.objects.all()
+    else:
+        root_paths = Group.get_root_nodes().filter(
+                tree_id=tree_id).values_list('path', flat=True)
+        query = subtree_q(root_paths)
+        if query is None:
+            return 0
+        queryset = Group.objects.filter(query)
+
+    counts = _count_by_parent_path(queryset)
+
+    # Group mismatched nodes by correct value so each value is one UPDATE.
+    fixes = {}
+    for pk, path, numchild in queryset.values_list('pk', 'path', 'numchild'):
+        actual = counts.get(path, 0)
+        if numchild != actual:
+            fixes.setdefault(actual, []).append(pk)
+
+    return update_by_value(fixes, 'numchild')
+
+
+def subtree_documents(group):
+    """
+    Return queryset with the documents of every group in the subtree below
+    ``group``, including its own, as one join on a path range.
+    """
+    return Document.objects.filter(
+            group__path__range=subtree_range(group.path))
+
+
+def subtree_document_counts(group):
+    """
+    Count documents and sources below ``group`` per child subtree with one
+    grouped query. Return dict keyed by child path. Documents attached to
+    ``group`` itself are counted under its own path.
+    """
+    path_column = '{0}.{1}'.format(
+            connection.ops.quote_name(Group._meta.db_table),
+            connection.ops.quote_name('path'))
+    rows = subtree_documents(group).extra(
+            select={'branch': 'SUBSTR({0}, 1, %s)'.format(path_column)},
+            select_params=(len(group.path) + Group.steplen,)).values(
+                    'branch').annotate(
+                            documents=Count('document_id', distinct=True),
+                            sources=Count('sources')).order_by()
+    return dict((row['branch'], (row['documents'], row['sources']))
+            for row in rows)
+
+
+class AnnotatedTree(object):
+    """
+    Annotated listing of a complete set of subtrees.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+        self.child_counts = count_children(self.nodes)
+
+    def __iter__(self):
+        return annotate(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def serialize(self, serializer):
+        """
+        Generate one dict per node combining serializer output and the
+        annotation info.
+        """
+        return serialize_annotated(self.nodes, serializer)
+
+
+def serialize_annotated(nodes, serializer):
+    """
+    Generate one dict per node of ``nodes`` in path order combining
+    serializer output and the annotation info. ``nodes`` may be any
+    iterable, it is read once, a node at a time.
+    """
+    for node, info in annotate(nodes):
+        data = dict(serializer.to_native(node).items())
+        data.update(info)
+        yield data
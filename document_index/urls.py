@@ -8,19 +8,42 @@ urlpatterns = patterns('',
     url(r'^oauth2/', include('provider.oauth2.urls', namespace='oauth2')),
     url(r'^groups/parent/(?P<pk>[0-9]+)/$', views.GroupList.as_view(),
         name='group-list'),
+    url(r'^groups/shared/$', views.GroupShared.as_view(),
+        name='group-shared'),
     url(r'^groups/(?P<pk>[0-9]+)/$', views.GroupDetail.as_view(),
         name='group-detail'),
     url(r'groups/annotated_list/(?P<pk>[0-9]+)/$',
         views.GroupAnnotatedList.as_view(), name='group-annotated-list'),
     url(r'^groups/(?P<pk>[0-9]+)/move/$', views.GroupMove.as_view(),
         name='group-move'),
+    url(r'^groups/move/$', views.GroupMove.as_view(),
+        name='group-move-batch'),
     url(r'^groups/(?P<pk>[0-9]+)/delete/$', views.GroupDetail.as_view(),
         name='group-delete'),
+    url(r'^groups/(?P<pk>[0-9]+)/breadcrumbs/$',
+        views.GroupBreadcrumbs.as_view(), name='group-breadcrumbs'),
+    url(r'^groups/(?P<pk>[0-9]+)/tree/$', views.GroupTree.as_view(),
+        name='group-tree'),
+    url(r'^groups/(?P<pk>[0-9]+)/documents/$',
+        views.GroupDocumentList.as_view(), name='group-document-list'),
     url(r'^documents/$', views.DocumentList.as_view(), name='document-list'),
+    url(r'^documents/export/$', views.DocumentExport.as_view(),
+        name='document-export'),
+    url(r'^documents/bulk/$', views.DocumentBulkCreate.as_view(),
+        name='document-bulk'),
+    url(r'^documents/search/$', views.DocumentSearch.as_view(),
+        name='document-search'),
     url(r'^documents/(?P<pk>[0-9]+)/$',
         views.DocumentDetail.as_view(), name='document-detail'),
+    url(r'^documents/(?P<pk>[0-9]+)/sources/order/$',
+        views.DocumentSourceOrder.as_view(), name='document-source-order'),
     url(r'^sources/(?P<pk>[0-9]+)/$',
         views.SourceDetail.as_view(), name='source-detail'),
+    url(r'^changes/$', views.ChangeFeed.as_view(), name='change-feed'),
+    url(r'^sources/(?P<pk>[0-9]+)/content/$',
+        views.SourceContent.as_view(), name='source-content'),
+    url(r'^jobs/(?P<pk>[0-9a-f]+)/$', views.JobDetail.as_view(),
+        name='job-detail'),
     url(r'^users/$', views.UserList.as_view()),
     url(r'^users/(?P<pk>[0-9]+)/$', views.UserDetail.as_view()),
 )
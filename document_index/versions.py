@@ -0,0 +1,149 @@
+"""
+Versioned response caching with strong ETags.
+
+Each document and each group tree branch, i.e. the subtree below one root
+node, has a version counter in Django's cache. Signal handlers in
+signals.py bump the counters on writes. Serialized responses are cached
+under a key derived from the versions of the data they show, so a write
+never has to find and delete cached responses: it changes the key instead.
+The same key is sent as the ETag and a matching If-None-Match is answered
+with 304 Not Modified.
+
+Branches are keyed by root path. Adding or removing root nodes shifts root
+paths, so group versions also include the roots generation from cache.py.
+Moves and bulk loads rewrite paths without model signals and bump a
+version shared by all groups.
+
+Versions are bumped in the cache of the process handling the write, so
+responses are only cached with a cache shared by all processes, e.g.
+memcached, see cache.is_shared(). Otherwise views answer every request
+from the database and send no ETag. The same applies while the cache
+cannot store a version, e.g. when memcached is unreachable.
+"""
+import hashlib
+import time
+from django.core.cache import cache
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from document_index.cache import is_shared, roots_generation
+from document_index.models import Group
+
+VERSION_KEY = 'document_index:version:{0}'
+RESPONSE_KEY = 'document_index:response:{0}'
+
+# Version bumped by set based path rewrites.
+GROUPS = 'groups'
+
+# Version bumped by any ACL or team membership change.
+ACLS = 'acls'
+
+
+def branch(path):
+    """
+    Return version name of the tree branch holding the node at path.
+    """
+    return 'branch:{0}'.format(path[:Group.steplen])
+
+
+def document(pk):
+    return 'document:{0}'.format(pk)
+
+
+def owner(user_id):
+    """
+    Return version name of the groups owned by a user.
+    """
+    return 'owner:{0}'.format(user_id)
+
+
+def get_versions(names):
+    """
+    Return list of current versions for names, in the same order, or None
+    if a version cannot be stored. Cache backends fail silently, and a
+    made up version would never change.
+    """
+    keys = [VERSION_KEY.format(name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Start from the clock so an evicted version is not reused.
+            cache.add(key, int(time.time() * 1000000))
+            versions[key] = cache.get(key)
+            if versions[key] is None:
+                return None
+    return [versions[key] for key in keys]
+
+
+def bump_version(name):
+    try:
+        cache.incr(VERSION_KEY.format(name))
+    except ValueError:
+        # Not cached yet. Nothing can be stale.
+        pass
+
+
+def group_versions(paths):
+    """
+    Return versions of the branches holding the nodes at paths, or None if
+    they are unknown.
+    """
+    names = [GROUPS] + sorted(set(branch(path) for path in paths))
+    generation = roots_generation()
+    values = get_versions(names)
+    if generation is None or values is None:
+        return None
+    return [generation] + values
+
+
+class VersionedCacheMixin(object):
+    """
+    Cache successful GET responses of a view and serve them with a strong
+    ETag, if the cache is shared. Views implement get_cache_versions(),
+    returning the versions of the data shown or None to bypass the cache.
+    Views defining their own get() wrap it with versioned_response().
+
+    The cached value is the response data, not the rendered content, so
+    content negotiation still applies. The ETag covers the absolute URL and
+    the accepted renderer as well as the versions.
+    """
+
+    def get_cache_versions(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def get_etag(self, request, versions):
+        key = repr((self.__class__.__name__, request.build_absolute_uri(),
+            request.accepted_renderer.format, versions))
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def get(self, request, *args, **kwargs):
+        return self.versioned_response(request,
+                super(VersionedCacheMixin, self).get, *args, **kwargs)
+
+    def versioned_response(self, request, handler, *args, **kwargs):
+        """
+        Return the cached response, a 304, or the response of handler.
+        """
+        if not is_shared():
+            return handler(request, *args, **kwargs)
+        versions = self.get_cache_versions(request, *args, **kwargs)
+        if versions is None:
+            return handler(request, *args, **kwargs)
+
+        etag = self.get_etag(request, versions)
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and (if_none_match.strip() == '*' or
+                etag in parse_etags(if_none_match)):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            key = RESPONSE_KEY.format(etag)
+            data = cache.get(key)
+            if data is not None:
+                response = Response(data)
+            else:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(key, response.data)
+        response['ETag'] = quote_etag(etag)
+        return response
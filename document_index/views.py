@@ -1,16 +1,70 @@
+import itertools
+import json
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
-from rest_framework import generics, permissions, status
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_datetime
+from django.utils.datastructures import SortedDict
+from rest_framework import filters, generics, parsers, permissions, status
+from rest_framework.exceptions import ParseError
+from rest_framework.reverse import reverse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from document_index.models import GroupTreeList, Group, Document, Source
 from document_index.serializers import (GroupSerializer, DocumentSerializer,
         SourceSerializer, UserSerializer)
-from document_index.permissions import IsOwnerOrReadOnly
-
-
-class GroupList(generics.ListCreateAPIView):
+from document_index.pagination import KeysetPaginationMixin
+from document_index.fastserializers import (ValuesListMixin,
+        GroupValuesSerializer, DocumentValuesSerializer, UserValuesSerializer)
+from document_index import search
+from document_index.bulk import (count_nodes, ingest_documents,
+        iter_tree_json, load_tree, validate_tree)
+from document_index.parsers import InvalidLine, NDJSONParser
+from document_index.access import READ, WRITE, get_prefixes, has_access
+from document_index.permissions import GroupAccessFilter, IsOwnerOrReadOnly
+from document_index.fields import reverse_pk
+from document_index.renderers import StreamingJSONResponse
+from document_index.cache import get_root_paths, get_tree_id
+from document_index.move import (DeleteError, MoveError, delete_subtree,
+        has_documents, move_nodes)
+from document_index import blobs, changes, export, jobs, sequences
+# Registers the job functions.
+from document_index import tasks
+from document_index.snapshot import get_group_snapshot
+from document_index import versions
+from document_index.tree import (AnnotatedTree, get_subtree_nodes,
+        serialize_annotated, subtree_documents, subtree_document_counts)
+
+
+def run_async(request):
+    return request.QUERY_PARAMS.get('async') == '1'
+
+
+def submit_job(request, name, *args):
+    """
+    Queue a background job for the request and return a 202 response
+    linking to it. A repeated ``Idempotency-Key`` header returns the job
+    queued first.
+    """
+    job = jobs.submit(name, *args,
+            idempotency_key=request.META.get('HTTP_IDEMPOTENCY_KEY'),
+            owner=request.user if request.user.is_authenticated() else None)
+    return Response(SortedDict([
+        ('job_id', job.id),
+        ('job', reverse('job-detail', kwargs={'pk': job.id},
+            request=request)),
+        ('status', job.status),
+    ]), status=status.HTTP_202_ACCEPTED)
+
+
+class GroupList(ValuesListMixin, KeysetPaginationMixin,
+        generics.ListCreateAPIView):
     serializer_class = GroupSerializer
+    values_serializer_class = GroupValuesSerializer
+    filter_backends = (GroupAccessFilter,)
+    keyset_fields = ('path',)
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
     def pre_save(self, obj):
@@ -21,8 +75,9 @@ class GroupList(generics.ListCreateAPIView):
         # TODO: request.user available only if logged in user.
         try:
             if self.parent == 0:
-                tree_id = GroupTreeList.objects.get(
-                        name=self.request.user.username).id
+                tree_id = get_tree_id(self.request.user.username)
+                if tree_id is None:
+                    raise GroupTreeList.DoesNotExist
                 queryset = Group.get_root_nodes().filter(tree_id=tree_id)
             else:
                 parent_node = Group.objects.get(id=self.parent)
@@ -49,6 +104,15 @@ class GroupList(generics.ListCreateAPIView):
         """Override create method on CreateModelMixin to prevent double save.
         treebeard calls save() on node add. Maybe there is a way around that.
         """
+        # The serializer adds the node, so the parent is checked first, like
+        # on every other group write.
+        parent_id = int(kwargs['pk'])
+        if parent_id != 0:
+            parent = get_object_or_404(Group, id=parent_id)
+            if not has_access(request.user, parent.path, WRITE):
+                return Response({'detail': 'Write access required.'},
+                        status=status.HTTP_403_FORBIDDEN)
+
         request.DATA['parent'] = kwargs['pk']
         serializer = self.get_serializer(data=request.DATA, files=request.FILES)
 
@@ -62,43 +126,94 @@ class GroupList(generics.ListCreateAPIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class GroupAnnotatedList(APIView):
+def _group_cache_versions(group_id):
+    paths = list(Group.objects.filter(id=group_id).values_list(
+        'path', flat=True))
+    if not paths:
+        return None
+    return versions.group_versions(paths)
+
+
+class GroupAnnotatedList(versions.VersionedCacheMixin, APIView):
     """
     Implements API endpoint for retrieving an annotated list from any node in
     the group tree including the node itself.
     """
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
+    def get_cache_versions(self, request, *args, **kwargs):
+        parent_id = int(kwargs['pk'])
+        if parent_id != 0:
+            # Kept for annotated_list() on a cache miss.
+            self.parent_node = Group.objects.filter(id=parent_id).first()
+            if self.parent_node is None:
+                return None
+            return versions.group_versions([self.parent_node.path])
+        tree_id = get_tree_id(request.user.username)
+        if tree_id is None:
+            return None
+        group_versions = versions.group_versions(get_root_paths(tree_id))
+        if group_versions is None:
+            return None
+        return [tree_id] + group_versions
+
     def get(self, request, *args, **kwargs):
-        # Need parent_id for get_queryset()
+        if request.QUERY_PARAMS.get('stream') == '1':
+            # Read and encoded a chunk of nodes at a time, never cached.
+            return StreamingJSONResponse(self.streamed_nodes(request,
+                *args, **kwargs))
+        return self.versioned_response(request, self.annotated_list,
+                *args, **kwargs)
+
+    def get_nodes(self, request, *args, **kwargs):
+        """
+        Return queryset with the listed nodes in path order.
+        """
         self.parent = int(kwargs['pk'])
-        queryset = None
 
+        # The whole listing is covered by path range queries.
         try:
             if self.parent == 0:
-                tree_id = GroupTreeList.objects.get(
-                        name=self.request.user.username).id
-                queryset = Group.get_root_nodes().filter(tree_id=tree_id)
-            else:
-                parent_node = Group.objects.get(id=self.parent)
-                queryset = parent_node.get_children()
+                tree_id = get_tree_id(self.request.user.username)
+                if tree_id is None:
+                    raise GroupTreeList.DoesNotExist
+                return get_subtree_nodes(get_root_paths(tree_id))
+            parent_node = getattr(self, 'parent_node', None) or \
+                    Group.objects.get(id=self.parent)
+            return get_subtree_nodes([parent_node.path], include_self=False)
         except ObjectDoesNotExist:
-            queryset = Group.objects.none()
-
-
-        master_annotated_list = []
+            return Group.objects.none()
 
-        for parent_node in queryset:
-            for child_node, info in parent_node.annotated_list():
-                serializer = GroupSerializer(child_node,
-                        context={'request': request})
-                combined_data = dict(serializer.data.items() + info.items())
-                master_annotated_list.append(combined_data)
+    def annotated_nodes(self, request, *args, **kwargs):
+        """
+        Return generator of the serialized nodes.
+        """
+        nodes = self.get_nodes(request, *args, **kwargs)
+        annotated_tree = AnnotatedTree(GroupValuesSerializer.rows(nodes))
+        serializer = GroupValuesSerializer(context={'request': request,
+            'child_counts': annotated_tree.child_counts})
+        return annotated_tree.serialize(serializer)
 
+    def streamed_nodes(self, request, *args, **kwargs):
+        """
+        Return generator of the serialized nodes, read with one keyset query
+        per chunk in path order. Child counts come from ``numchild`` since
+        the listing is never held as a whole.
+        """
+        nodes = self.get_nodes(request, *args, **kwargs)
+        rows = itertools.chain.from_iterable(
+                GroupValuesSerializer.iter_rows(nodes, ('path',)))
+        serializer = GroupValuesSerializer(context={'request': request})
+        return serialize_annotated(rows, serializer)
+
+    def annotated_list(self, request, *args, **kwargs):
+        master_annotated_list = list(self.annotated_nodes(request,
+            *args, **kwargs))
         return Response(master_annotated_list, status=status.HTTP_200_OK)
 
 
-class GroupDetail(generics.RetrieveUpdateDestroyAPIView):
+class GroupDetail(versions.VersionedCacheMixin,
+        generics.RetrieveUpdateDestroyAPIView):
     """
     Handle Retrieve, Update, Destroy operations with HTTP verbs GET, PUT, and
     DELETE.
@@ -109,6 +224,9 @@ class GroupDetail(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,
             IsOwnerOrReadOnly,)
 
+    def get_cache_versions(self, request, *args, **kwargs):
+        return _group_cache_versions(kwargs['pk'])
+
     def pre_save(self, obj):
         # TODO: conditionally if not already present.
         obj.owner = self.request.user
@@ -139,54 +257,596 @@ class GroupDetail(generics.RetrieveUpdateDestroyAPIView):
 
     def delete(self, request, *args, **kwargs):
         """
-        Delete group node. Logic to reside in model object. Do not allow
-        delete if group has documents attached.
+        Delete group node with all of its descendants. Refused if any of
+        them has documents attached. With ``async=1`` the delete runs as a
+        background job and the response links to the job.
         """
-        # TODO: Check for child nodes. Refuse to delete if child nodes exist.
-        # Look into Treebeard exceptions if this is attempted.
-        group_id = kwargs['pk']
-        return Response({'detail': '{0} deleted'.format(group_id)},
+        group = self.get_object()
+        if has_documents(group.path):
+            return Response({'detail': 'Group has documents attached.'},
+                    status=status.HTTP_409_CONFLICT)
+
+        if run_async(request):
+            return submit_job(request, 'delete_subtree', group.id,
+                    request.user.pk)
+
+        try:
+            delete_subtree(group.id)
+        except DeleteError as e:
+            return Response({'detail': str(e)},
+                    status=status.HTTP_409_CONFLICT)
+        return Response({'detail': '{0} deleted'.format(group.id)},
             status=status.HTTP_204_NO_CONTENT)
 
 
 class GroupMove(generics.UpdateAPIView):
     """
     Provide functionality for moving group node to be child of another group
-    node. Logic to reside in model. HTTP verb will be PUT since this will be
-    construed as an update of the entire group instance. Some fuzziness here.
-    See https://tabo.pe/projects/django-treebeard/docs/1.61/api.html#treebeard.models.Node.move
+    node. HTTP verb is PATCH with the new ``parent`` id, 0 for root level.
+    Without a pk in the URL, ``nodes`` is a list of group ids to move to the
+    same parent in one transaction. Responds with a summary of each moved
+    subtree, or with ``async=1`` links to a background job doing the move.
     """
     def patch(self, request, *args, **kwargs):
+        if 'pk' in kwargs:
+            node_ids = [kwargs['pk']]
+        else:
+            node_ids = request.DATA.get('nodes')
+        try:
+            parent_id = int(request.DATA.get('parent'))
+            if not isinstance(node_ids, list):
+                raise TypeError
+            node_ids = [int(node_id) for node_id in node_ids]
+        except (TypeError, ValueError):
+            return Response({'detail': 'Expected group ids.'},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+        # The moved groups and the new parent must all be writable.
+        paths = Group.objects.filter(id__in=node_ids + [parent_id])
+        if not all(has_access(request.user, path, WRITE)
+                for path in paths.values_list('path', flat=True)):
+            return Response({'detail': 'Write access required.'},
+                    status=status.HTTP_403_FORBIDDEN)
+
+        if run_async(request):
+            return submit_job(request, 'move_nodes', node_ids, parent_id,
+                    request.user.pk)
+        try:
+            moved = move_nodes(node_ids, parent_id)
+        except Group.DoesNotExist:
+            return Response({'detail': 'Group not found.'},
+                    status=status.HTTP_404_NOT_FOUND)
+        except MoveError as e:
+            return Response({'detail': str(e)},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(SortedDict([
+            ('detail', 'node moved'),
+            ('groups', [SortedDict([
+                ('group', reverse_pk('group-detail', node.id, request)),
+                ('depth', node.depth),
+                ('numchild', node.numchild),
+                ('descendants', descendants),
+            ]) for node, descendants in moved]),
+        ]), status.HTTP_200_OK)
+
+
+class GroupShared(generics.ListAPIView):
+    """
+    Top most groups other users shared with the requesting user or their
+    teams. Everything below them is shared as well.
+    """
+    serializer_class = GroupSerializer
 
-        parent_id = request.DATA['parent']
-        parent_node = Group.objects.get(id=parent_id)
-        node_id = kwargs['pk']
-        node = Group.objects.get(id=node_id)
-        node.move(parent_node, 'sorted-child')
-        # This response assumes success. Check and handle.
-        return Response({'detail': 'node moved'}, status.HTTP_200_OK)
+    def get_queryset(self):
+        return Group.objects.filter(
+                path__in=get_prefixes(self.request.user)[READ]).exclude(
+                    owner_id=self.request.user.pk).select_related('owner')
 
 
+class GroupBreadcrumbs(APIView):
+    """
+    Ancestors of a group from the root node down, the group included.
+    Answered from the in-memory tree snapshot.
+    """
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
+    def get(self, request, *args, **kwargs):
+        snapshot = get_group_snapshot(int(kwargs['pk']))
+        if snapshot is None:
+            return Response({'detail': 'Not found'},
+                    status=status.HTTP_404_NOT_FOUND)
+        return Response([SortedDict([
+            ('group', reverse_pk('group-detail', group_id, request)),
+            ('name', name),
+        ]) for group_id, name in snapshot.breadcrumbs(int(kwargs['pk']))])
 
-class DocumentList(generics.ListCreateAPIView):
-    queryset = Document.objects.all()
+
+class GroupTree(APIView):
+    """
+    Bulk import and streaming export of nested group trees below a group,
+    or below the requesting user's tree for pk 0. Each group is an object
+    with name, description, comment and a list of children.
+    """
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+
+    def get(self, request, *args, **kwargs):
+        """
+        Export the subtrees below the group.
+        """
+        parent_id = int(kwargs['pk'])
+        if parent_id == 0:
+            queryset = Group.get_root_nodes().filter(
+                    tree__name=request.user.username)
+        else:
+            queryset = get_object_or_404(Group, id=parent_id).get_children()
+        paths = list(queryset.values_list('path', flat=True))
+        return StreamingHttpResponse(iter_tree_json(paths),
+                content_type='application/json')
+
+    def post(self, request, *args, **kwargs):
+        """
+        Import groups below the group in a single transaction, with
+        ``async=1`` in a background job. Needs write access to the group.
+        """
+        errors = validate_tree(request.DATA)
+        if errors:
+            return Response({'detail': errors},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+        parent_id = int(kwargs['pk'])
+        if parent_id != 0:
+            parent = get_object_or_404(Group, id=parent_id)
+            if not has_access(request.user, parent.path, WRITE):
+                return Response({'detail': 'Write access required.'},
+                        status=status.HTTP_403_FORBIDDEN)
+            # New groups belong to the tree of their parent.
+            tree_id = parent.tree_id
+        else:
+            parent = None
+            tree_id = GroupTreeList.objects.get_or_create(
+                    name=request.user.username)[0].id
+
+        if run_async(request):
+            return submit_job(request, 'load_tree', request.DATA,
+                    request.user.pk, tree_id, parent_id)
+        groups = load_tree(request.DATA, request.user, tree_id, parent)
+        return Response({
+            'created': count_nodes(request.DATA),
+            'groups': [reverse_pk('group-detail', group.id, request)
+                for group in groups],
+        }, status=status.HTTP_201_CREATED)
+
+
+class DocumentList(ValuesListMixin, KeysetPaginationMixin,
+        generics.ListCreateAPIView):
+    # Sources and groups are loaded with the page instead of per document.
+    queryset = Document.objects.select_related('group').prefetch_related(
+            'sources')
     serializer_class = DocumentSerializer
+    values_serializer_class = DocumentValuesSerializer
+    filter_backends = (GroupAccessFilter,)
+    access_lookup_prefix = 'group__'
+    keyset_fields = ('created', 'document_id')
+
+
+class DocumentExport(APIView):
+    """
+    Streaming export of all documents with their sources.
+
+    Query parameters: ``output`` ndjson (default) or csv, ``gzip=1`` to
+    compress, ``group`` to limit to the subtree below a group, and
+    ``modified_after`` and ``modified_before`` ISO 8601 datetimes.
+    """
+
+    def get(self, request, *args, **kwargs):
+        params = request.QUERY_PARAMS
+        output = params.get('output', export.NDJSON)
+        if output not in export.CONTENT_TYPES:
+            return Response({'detail': 'Unknown output format.'},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+        options = {}
+        if params.get('group'):
+            try:
+                options['group'] = Group.objects.get(id=int(params['group']))
+            except (ValueError, ObjectDoesNotExist):
+                return Response({'detail': 'Group not found.'},
+                        status=status.HTTP_404_NOT_FOUND)
+        for param in ('modified_after', 'modified_before'):
+            if params.get(param):
+                try:
+                    options[param] = parse_datetime(params[param])
+                except ValueError:
+                    # Well formed, but out of range.
+                    options[param] = None
+                if options[param] is None:
+                    raise ParseError('Invalid {0}.'.format(param))
+
+        compress = params.get('gzip') == '1'
+        filename = 'documents.{0}'.format(output)
+        if compress:
+            response = StreamingHttpResponse(export.export_documents(output,
+                True, **options), content_type='application/gzip')
+            filename += '.gz'
+        else:
+            response = StreamingHttpResponse(export.export_documents(output,
+                **options), content_type=export.CONTENT_TYPES[output])
+        response['Content-Disposition'] = 'attachment; filename={0}'.format(
+                filename)
+        return response
+
+
+class DocumentBulkCreate(APIView):
+    """
+    Batch ingestion of documents with their sources. Accepts a JSON array or
+    NDJSON with one document per line. Each document has a group id, name,
+    description, comment and a list of sources. Failed rows are reported
+    with their errors and do not abort the batch, as do documents for groups
+    the user may not write to. With ``async=1`` the batch is ingested by a
+    background job.
+    """
+    parser_classes = (parsers.JSONParser, NDJSONParser)
 
+    def post(self, request, *args, **kwargs):
+        if not isinstance(request.DATA, list):
+            return Response({'detail': 'Expected a list of documents.'},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+        if run_async(request):
+            # Unparsable lines cannot be queued, reject the batch.
+            invalid = [{'row': i, 'errors': [row.message]}
+                    for i, row in enumerate(request.DATA)
+                    if isinstance(row, InvalidLine)]
+            if invalid:
+                return Response(SortedDict([
+                    ('detail', 'Invalid lines.'),
+                    ('results', invalid),
+                ]), status=status.HTTP_400_BAD_REQUEST)
+            return submit_job(request, 'ingest_documents', request.DATA,
+                    request.user.pk)
+        results = ingest_documents(request.DATA,
+                write_prefixes=get_prefixes(request.user)[WRITE])
+        created = sum(1 for result in results if 'document_id' in result)
+        return Response(SortedDict([
+            ('created', created),
+            ('failed', len(results) - created),
+            ('results', results),
+        ]), status=status.HTTP_200_OK)
+
+
+class GroupDocumentList(ValuesListMixin, KeysetPaginationMixin,
+        generics.ListAPIView):
+    """
+    Documents of a group and all of its descendant groups.
+
+    Query parameters: ``name`` to filter on a name substring,
+    ``modified_after`` and ``modified_before`` ISO 8601 datetimes, and
+    ``ordering`` on name, created, modified or document_id, not with
+    ``cursor`` or ``stream``. With ``aggregate=1`` return document and
+    source counts per child subtree instead of the documents.
+    """
+    serializer_class = DocumentSerializer
+    values_serializer_class = DocumentValuesSerializer
+    filter_backends = (GroupAccessFilter, filters.OrderingFilter)
+    access_lookup_prefix = 'group__'
+    ordering_fields = ('name', 'created', 'modified', 'document_id')
+    ordering = ('created', 'document_id')
+    keyset_fields = ('created', 'document_id')
+
+    def get_group(self):
+        if not hasattr(self, 'group'):
+            self.group = get_object_or_404(Group, id=self.kwargs['pk'])
+        return self.group
+
+    def get_queryset(self):
+        queryset = subtree_documents(self.get_group()).select_related(
+                'group').prefetch_related('sources')
+
+        params = self.request.QUERY_PARAMS
+        if params.get('name'):
+            queryset = queryset.filter(name__icontains=params['name'])
+        for param, lookup in (('modified_after', 'modified__gte'),
+                ('modified_before', 'modified__lt')):
+            if params.get(param):
+                try:
+                    value = parse_datetime(params[param])
+                except ValueError:
+                    # Well formed, but out of range.
+                    value = None
+                if value is None:
+                    raise ParseError('Invalid {0}.'.format(param))
+                queryset = queryset.filter(**{lookup: value})
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        params = request.QUERY_PARAMS
+        if params.get('aggregate') == '1':
+            return self.aggregate(request)
+        if 'ordering' in params and (self.cursor_param in params or
+                params.get(self.stream_param) == '1'):
+            raise ParseError('ordering cannot be combined with cursor or '
+                    'stream, which follow created and document_id.')
+        return super(GroupDocumentList, self).list(request, *args, **kwargs)
+
+    def aggregate(self, request):
+        """
+        Document and source counts for the whole subtree and for each child
+        subtree holding documents.
+        """
+        group = self.get_group()
+        counts = subtree_document_counts(group)
+        children = Group.objects.filter(path__in=counts.keys()).exclude(
+                id=group.id).order_by('path')
+
+        documents = sum(count[0] for count in counts.values())
+        sources = sum(count[1] for count in counts.values())
+        own = counts.get(group.path, (0, 0))
+        return Response(SortedDict([
+            ('group', reverse_pk('group-detail', group.id, request)),
+            ('documents', documents),
+            ('sources', sources),
+            ('own_documents', own[0]),
+            ('own_sources', own[1]),
+            ('children', [SortedDict([
+                ('group', reverse_pk('group-detail', child.id, request)),
+                ('name', child.name),
+                ('documents', counts[child.path][0]),
+                ('sources', counts[child.path][1]),
+            ]) for child in children]),
+        ]))
+
+
+class DocumentSearch(generics.ListAPIView):
+    """
+    Ranked full text search over document and source metadata.
+
+    Query parameters: ``q`` search terms, all of which must match, ``group``
+    to restrict results to the subtree below a group, and ``prefix=0`` to
+    match whole terms only. The best search.MAX_RESULTS matches are listed.
+    """
+    serializer_class = DocumentSerializer
 
-class DocumentDetail(generics.RetrieveUpdateDestroyAPIView):
+    def list(self, request, *args, **kwargs):
+        query = request.QUERY_PARAMS.get('q', '')
+        if not search.tokenize(query):
+            return Response({'detail': 'Search terms required.'},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+        group = None
+        group_id = request.QUERY_PARAMS.get('group')
+        if group_id:
+            try:
+                group = Group.objects.get(id=int(group_id))
+            except (ValueError, ObjectDoesNotExist):
+                return Response({'detail': 'Group not found.'},
+                        status=status.HTTP_404_NOT_FOUND)
+
+        prefix = request.QUERY_PARAMS.get('prefix') != '0'
+        ranked = search.search(query, group=group, prefix=prefix)
+
+        # Paginate the ranked ids, then load only the documents on the page.
+        page = self.paginate_queryset(ranked)
+        rows = page.object_list if page is not None else ranked
+        documents = Document.objects.select_related('group').prefetch_related(
+                'sources').in_bulk([document_id for document_id, _ in rows])
+        self.object_list = [documents[document_id]
+                for document_id, _ in rows if document_id in documents]
+
+        if page is not None:
+            page.object_list = self.object_list
+            serializer = self.get_pagination_serializer(page)
+        else:
+            serializer = self.get_serializer(self.object_list, many=True)
+        return Response(serializer.data)
+
+
+class DocumentDetail(versions.VersionedCacheMixin,
+        generics.RetrieveUpdateDestroyAPIView):
     queryset = Document.objects.all()
     serializer_class = DocumentSerializer
 
+    def get_cache_versions(self, request, *args, **kwargs):
+        # No query needed: the version alone identifies the document state.
+        return versions.get_versions([versions.document(kwargs['pk'])])
+
+
+class DocumentSourceOrder(APIView):
+    """
+    Reorder the sources of a document. PUT ``sources``, a list of all of
+    its source ids in the new order. They are numbered 1..n.
+    """
+
+    def put(self, request, *args, **kwargs):
+        document = get_object_or_404(Document.objects.select_related(
+            'group'), document_id=kwargs['pk'])
+        if not has_access(request.user, document.group.path, WRITE):
+            return Response({'detail': 'Write access required.'},
+                    status=status.HTTP_403_FORBIDDEN)
+        source_ids = request.DATA.get('sources')
+        try:
+            if not isinstance(source_ids, list):
+                raise TypeError
+            sequences.reorder(document.pk,
+                    [int(source_id) for source_id in source_ids])
+        except (TypeError, ValueError):
+            return Response({'detail': 'Expected all source ids of the '
+                'document.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'sources': list(Source.objects.filter(
+            document=document).order_by('sequence').values_list(
+                'source_id', flat=True))})
+
 
 class SourceDetail(generics.RetrieveUpdateDestroyAPIView):
     queryset = Source.objects.all()
     serializer_class = SourceSerializer
 
 
-class UserList(generics.ListAPIView):
+class SourceContent(APIView):
+    """
+    File content of a source. PUT stores the request body, deduplicated
+    with identical files of other sources, and needs write access to the
+    group. GET serves it, or a single byte range with a Range header.
+    """
+
+    def get_source(self):
+        return get_object_or_404(Source.objects.select_related(
+            'document__group', 'blob'), source_id=self.kwargs['pk'])
+
+    def get(self, request, *args, **kwargs):
+        source = self.get_source()
+        blob = source.blob
+        if blob is None:
+            return Response({'detail': 'Source has no content.'},
+                    status=status.HTTP_404_NOT_FOUND)
+
+        etag = '"{0}"'.format(blob.sha256)
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            return HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+
+        byte_range = None
+        if request.META.get('HTTP_IF_RANGE', etag) == etag:
+            try:
+                byte_range = blobs.parse_range(
+                        request.META.get('HTTP_RANGE'), blob.size)
+            except ValueError:
+                response = HttpResponse(
+                        status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response['Content-Range'] = 'bytes */{0}'.format(blob.size)
+                return response
+
+        content_type = source.mime_type or 'application/octet-stream'
+        sendfile = blobs.sendfile_header()
+        if sendfile is not None:
+            # The front end server sends the file and handles ranges.
+            header, prefix = sendfile
+            response = HttpResponse(content_type=content_type)
+            response[header] = (prefix + blobs.relative_path(blob.sha256)
+                    if prefix else blobs.blob_path(blob.sha256))
+        elif byte_range is None:
+            response = StreamingHttpResponse(blobs.iter_file(
+                blobs.blob_path(blob.sha256)), content_type=content_type)
+            response['Content-Length'] = str(blob.size)
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(blobs.iter_file(
+                blobs.blob_path(blob.sha256), start, end),
+                status=status.HTTP_206_PARTIAL_CONTENT,
+                content_type=content_type)
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(
+                    start, end, blob.size)
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        return response
+
+    def put(self, request, *args, **kwargs):
+        source = self.get_source()
+        if not has_access(request.user, source.document.group.path, WRITE):
+            return Response({'detail': 'Write access required.'},
+                    status=status.HTTP_403_FORBIDDEN)
+
+        content_type = request.META.get('CONTENT_TYPE', '').split(';')[0]
+        if content_type and content_type != 'application/octet-stream':
+            source.mime_type = content_type[:50]
+        # The body is read in chunks from the underlying request, unparsed,
+        # before any transaction starts. The blob row then stays locked until
+        # the source links to it, so prune() cannot remove an unused blob
+        # commit() returned meanwhile.
+        received = blobs.receive(request._request)
+        with transaction.atomic():
+            blob, created = blobs.commit(*received)
+            source.blob = blob
+            source.save()
+        return Response(SortedDict([
+            ('sha256', blob.sha256),
+            ('size', blob.size),
+            ('deduplicated', not created),
+        ]), status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+class JobDetail(APIView):
+    """
+    State of a background job: status, progress, attempts, result and
+    error. Jobs are visible to the user who submitted them only.
+    """
+
+    def get(self, request, *args, **kwargs):
+        job = jobs.get_job(kwargs['pk'])
+        if job is None or (job.owner_id is not None and
+                job.owner_id != request.user.pk and
+                not request.user.is_superuser):
+            return Response({'detail': 'Not found'},
+                    status=status.HTTP_404_NOT_FOUND)
+        return Response(SortedDict([
+            ('id', job.id),
+            ('name', job.name),
+            ('status', job.status),
+            ('progress', job.progress),
+            ('total', job.total),
+            ('attempts', job.attempts),
+            ('max_attempts', job.max_attempts),
+            ('run_after', job.run_after),
+            ('result', json.loads(job.result) if job.result else None),
+            ('error', job.error or None),
+            ('created', job.created),
+            ('modified', job.modified),
+        ]))
+
+
+class ChangeFeed(APIView):
+    """
+    Inserts, updates, deletes and moves of groups, documents and sources
+    after ``since``, a token from an earlier response, in order. Without
+    ``since`` only the current token is returned to start syncing from.
+    ``limit`` caps the number of changes, ``wait`` holds the request up to
+    MAX_WAIT seconds until changes arrive.
+    """
+    MAX_LIMIT = 500
+    MAX_WAIT = 30
+
+    def get(self, request, *args, **kwargs):
+        params = request.QUERY_PARAMS
+        try:
+            limit = min(int(params.get('limit', self.MAX_LIMIT)),
+                    self.MAX_LIMIT)
+            wait = min(float(params.get('wait', 0)), self.MAX_WAIT)
+            if limit < 1 or wait < 0:
+                raise ValueError
+        except ValueError:
+            return Response({'detail': 'Invalid limit or wait.'},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+        if not params.get('since'):
+            return Response(SortedDict([('changes', []),
+                ('since', changes.encode_token(changes.latest_id()))]))
+        try:
+            since_id = changes.decode_token(params['since'])
+        except ValueError:
+            return Response({'detail': 'Invalid token.'},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+        if wait:
+            result, last_id = changes.wait_for_changes(since_id, wait, limit)
+        else:
+            result, last_id = changes.get_changes(since_id, limit)
+        return Response(SortedDict([
+            ('changes', [SortedDict([
+                ('model', change.model),
+                ('id', change.object_id),
+                ('action', change.action),
+                ('created', change.created),
+            ]) for change in result]),
+            ('since', changes.encode_token(last_id)),
+            ('more', len(result) == limit),
+        ]))
+
+
+class UserList(ValuesListMixin, KeysetPaginationMixin, generics.ListAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    values_serializer_class = UserValuesSerializer
+    keyset_fields = ('id',)
 
 
 class UserDetail(generics.RetrieveAPIView):